@@ -5,7 +5,9 @@ import sys
 
 from flask import Flask, render_template
 
-from app import commands, public, user
+from app import commands, public, shop, user
+from app.database import register_unit_of_work, replica_router
+from app.dbpool import init_pool
 from app.extensions import (
     bcrypt,
     cache,
@@ -16,6 +18,20 @@ from app.extensions import (
     migrate,
     webpack,
 )
+from app.hashing import hasher
+from app.metrics import metrics
+from app.pagecache import page_cache
+from app.shop.cart import init_cart
+from app.shop.dispatch import dispatcher
+from app.shop.inventory import init_inventory
+from app.shop.nearby import nearby_index
+from app.shop.pipeline import init_pipeline
+from app.shop.popularity import init_popularity
+from app.shop.promos import promo_index
+from app.shop.ratings import rating_buffer
+from app.shop.status import status_hub
+from app.user.identity import identity_cache
+from app.warmup import init_template_cache
 
 
 def create_app(config_object="app.settings"):
@@ -37,13 +53,30 @@ def create_app(config_object="app.settings"):
 def register_extensions(app):
     """Register Flask extensions."""
     bcrypt.init_app(app)
+    hasher.init_app(app)
     cache.init_app(app)
+    identity_cache.init_app(app)
+    init_pool(app)
+    replica_router.init_app(app)
     db.init_app(app)
     csrf_protect.init_app(app)
     login_manager.init_app(app)
     debug_toolbar.init_app(app)
     migrate.init_app(app, db)
     webpack.init_app(app)
+    page_cache.init_app(app)
+    metrics.init_app(app)
+    register_unit_of_work(app)
+    init_template_cache(app)
+    init_cart(app)
+    promo_index.init_app(app)
+    init_popularity(app)
+    rating_buffer.init_app(app)
+    nearby_index.init_app(app)
+    dispatcher.init_app(app)
+    init_pipeline(app)
+    init_inventory(app)
+    status_hub.init_app(app)
     return None
 
 
@@ -51,6 +84,7 @@ def register_blueprints(app):
     """Register Flask blueprints."""
     app.register_blueprint(public.views.blueprint)
     app.register_blueprint(user.views.blueprint)
+    app.register_blueprint(shop.views.blueprint)
     return None
 
 
@@ -63,7 +97,7 @@ def register_errorhandlers(app):
         error_code = getattr(error, "code", 500)
         return render_template(f"{error_code}.html"), error_code
 
-    for errcode in [401, 404, 500]:
+    for errcode in [401, 403, 404, 500]:
         app.errorhandler(errcode)(render_error)
     return None
 
@@ -82,6 +116,16 @@ def register_commands(app):
     """Register Click commands."""
     app.cli.add_command(commands.test)
     app.cli.add_command(commands.lint)
+    app.cli.add_command(commands.warmup)
+    app.cli.add_command(commands.bench)
+    app.cli.add_command(commands.rebuild_popularity)
+    app.cli.add_command(commands.rebuild_ratings)
+    app.cli.add_command(commands.dispatch)
+    app.cli.add_command(commands.checkout_worker)
+    app.cli.add_command(commands.stock)
+    app.cli.add_command(commands.prune_order_events)
+    app.cli.add_command(commands.export)
+    app.cli.add_command(commands.import_users)
 
 
 def configure_logger(app):
@@ -1,14 +1,20 @@
 # -*- coding: utf-8 -*-
 """Click commands."""
+import json
 import os
 from glob import glob
 from subprocess import call
 
 import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from app import warmup as warmup_steps
 
 HERE = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT = os.path.join(HERE, os.pardir)
 TEST_PATH = os.path.join(PROJECT_ROOT, "tests")
+BENCH_BASELINE = os.path.join(PROJECT_ROOT, "benchmarks", "baseline.json")
 
 
 @click.command()
@@ -63,3 +69,261 @@ def lint(fix_imports, check):
         execute_tool("Fixing import order", "isort", *isort_args)
     execute_tool("Formatting style", "black", *black_args)
     execute_tool("Checking code style", "flake8")
+
+
+@click.command()
+@with_appcontext
+def warmup():
+    """Run the worker warm-up and report how long each step takes."""
+    app = current_app._get_current_object()
+    report = warmup_steps.prepare(app)
+    report.update(warmup_steps.warm_worker(app))
+    for name, seconds in report.items():
+        click.echo(f"{name:<12} {seconds * 1000:8.1f} ms")
+    click.echo(f"{'total':<12} {sum(report.values()) * 1000:8.1f} ms")
+
+
+@click.command()
+@click.option("-n", "--requests", default=200, help="Timed requests per scenario")
+@click.option("--warmup", default=10, help="Untimed requests per scenario")
+@click.option("--users", default=1000, help="Users to seed the database with")
+@click.option(
+    "--database-url",
+    default=None,
+    help="Database to seed and benchmark (default: benchmarks.settings)",
+)
+@click.option("--bcrypt-rounds", default=4, help="bcrypt cost used by the suite")
+@click.option(
+    "-o", "--output", default="bench_results.json", help="Where to save the results"
+)
+@click.option("--baseline", default=BENCH_BASELINE, help="Baseline to compare with")
+@click.option(
+    "--tolerance", default=0.25, help="Allowed fractional slowdown before failing"
+)
+@click.option(
+    "--save-baseline", is_flag=True, help="Store these results as the new baseline"
+)
+def bench(
+    requests,
+    warmup,
+    users,
+    database_url,
+    bcrypt_rounds,
+    output,
+    baseline,
+    tolerance,
+    save_baseline,
+):
+    """Run the benchmark suite and compare it with the stored baseline."""
+    from benchmarks import suite
+
+    app = suite.make_app(database_url=database_url, bcrypt_rounds=bcrypt_rounds)
+    suite.seed(app, users)
+    results = suite.run(app, requests=requests, warmup=warmup)
+
+    click.echo(
+        f"{'scenario':<24}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}"
+        f"{'p99 ms':>10}{'queries':>10}"
+    )
+    for name, summary in results.items():
+        click.echo(
+            f"{name:<24}{summary['ops_per_sec']:>10.1f}{summary['p50_ms']:>10.2f}"
+            f"{summary['p95_ms']:>10.2f}{summary['p99_ms']:>10.2f}"
+            f"{summary['queries_per_request']:>10.2f}"
+        )
+    with open(output, "w") as output_file:
+        json.dump(results, output_file, indent=2, sort_keys=True)
+    click.echo(f"Results saved to {output}")
+
+    if save_baseline:
+        with open(baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        click.echo(f"Baseline saved to {baseline}")
+        return
+    if not os.path.exists(baseline):
+        click.echo(f"No baseline at {baseline}; run with --save-baseline to create one")
+        return
+    with open(baseline) as baseline_file:
+        regressions = suite.compare(results, json.load(baseline_file), tolerance)
+    for regression in regressions:
+        click.secho(f"REGRESSION {regression}", fg="red", err=True)
+    if regressions:
+        exit(1)
+    click.echo("No regressions against the baseline")
+
+
+@click.command("rebuild-popularity")
+@with_appcontext
+def rebuild_popularity():
+    """Recompute the menu item popularity scores from the orders."""
+    from app.shop import popularity
+
+    count = popularity.rebuild()
+    click.echo(f"Rebuilt popularity of {count} menu items")
+
+
+@click.command("rebuild-ratings")
+@click.option(
+    "--check", is_flag=True, help="Only report drift, don't rewrite the aggregates"
+)
+@with_appcontext
+def rebuild_ratings(check):
+    """Recompute the rating aggregates from the ratings and report any drift."""
+    from app.shop import ratings
+
+    ratings.rating_buffer.flush()
+    drifted = ratings.rebuild(fix=not check)
+    for kind, subject_id in drifted:
+        click.echo(f"{kind} {subject_id}: aggregate out of date")
+    if not drifted:
+        click.echo("All rating aggregates match the ratings")
+    elif check:
+        exit(1)
+    else:
+        click.echo(f"Rebuilt {len(drifted)} rating aggregates")
+
+
+@click.command()
+@click.option("--once", is_flag=True, help="Dispatch one batch and exit")
+@with_appcontext
+def dispatch(once):
+    """Assign placed orders to available couriers in batches."""
+    from app.shop.dispatch import dispatcher
+
+    if once:
+        count = dispatcher.run_once()
+        click.echo(f"Dispatched {count} orders")
+    else:
+        dispatcher.run()
+
+
+@click.command("checkout-worker")
+@click.option("--once", is_flag=True, help="Work through the queue once and exit")
+@with_appcontext
+def checkout_worker(once):
+    """Advance submitted checkouts through their states."""
+    from app.shop import pipeline
+
+    if once:
+        count = 0
+        while pipeline.process_next() is not None:
+            count += 1
+        click.echo(f"Ran {count} checkout steps")
+    else:
+        pipeline.run()
+
+
+@click.command()
+@click.argument("item_id", type=int)
+@click.argument("quantity", type=int, required=False)
+@click.option("--shards", type=int, help="Rows to split the stock over")
+@click.option("--untrack", is_flag=True, help="Stop tracking the item's stock")
+@with_appcontext
+def stock(item_id, quantity, shards, untrack):
+    """Show or set the units in stock of a menu item."""
+    from app.database import db
+    from app.shop import inventory
+
+    if untrack:
+        inventory.untrack(item_id)
+        db.session.commit()
+    elif quantity is not None:
+        inventory.set_stock(item_id, quantity, shards=shards)
+        db.session.commit()
+    units = inventory.stock_levels([item_id]).get(item_id)
+    if units is None:
+        click.echo(f"Item {item_id} is not stock tracked")
+    else:
+        click.echo(f"Item {item_id}: {units} in stock")
+
+
+@click.command("prune-order-events")
+@click.option("--days", default=7, help="Keep the events of this many days")
+@with_appcontext
+def prune_order_events(days):
+    """Delete old order status events."""
+    import datetime as dt
+
+    from app.shop import status
+
+    count = status.prune(dt.datetime.utcnow() - dt.timedelta(days=days))
+    click.echo(f"Deleted {count} order events")
+
+
+@click.command()
+@click.argument("table", type=click.Choice(["users", "orders"]))
+@click.option(
+    "-f", "--format", "fmt", type=click.Choice(["csv", "jsonl"]), default="csv"
+)
+@click.option("--gzip", "compress", is_flag=True, help="Gzip the output")
+@click.option("-o", "--output", default="-", help="File to write, default stdout")
+@with_appcontext
+def export(table, fmt, compress, output):
+    """Stream a whole table to a file as CSV or JSON Lines."""
+    import time
+
+    from app import export as exports
+
+    start = time.perf_counter()
+    rows = [0]
+
+    def progress(count):
+        rows[0] = count
+
+    with click.open_file(output, "wb") as out:
+        for chunk in exports.export(table, fmt, compress=compress, progress=progress):
+            out.write(chunk)
+    elapsed = time.perf_counter() - start
+    click.echo(
+        f"Exported {rows[0]} {table} in {elapsed:.1f}s "
+        f"({rows[0] / max(elapsed, 1e-9):.0f} rows/s)",
+        err=True,
+    )
+
+
+@click.command("import-users")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "-f", "--format", "fmt", type=click.Choice(["csv", "jsonl"]), help="File format"
+)
+@click.option("--batch-size", default=1000, help="Rows per insert and commit")
+@click.option("--workers", type=int, help="Hashing processes, default CPU count")
+@click.option("--checkpoint", help="Progress file, default PATH.checkpoint")
+@click.option("--restart", is_flag=True, help="Ignore the checkpoint, start over")
+@with_appcontext
+def import_users(path, fmt, batch_size, workers, checkpoint, restart):
+    """Import user accounts from a CSV or JSON Lines file, resuming if stopped."""
+    import os
+
+    from app.user import importer
+
+    try:
+        fmt = fmt or importer.detect_format(path)
+    except ValueError as error:
+        raise click.UsageError(str(error))
+    checkpoint = checkpoint or f"{path}.checkpoint"
+    if restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    done = importer.read_checkpoint(checkpoint)
+    if done:
+        click.echo(f"Resuming after row {done}")
+
+    def report(progress):
+        click.echo(
+            f"{progress.rows} rows: {progress.imported} imported, "
+            f"{progress.skipped} skipped, "
+            f"{progress.imported / max(progress.elapsed, 1e-9):.0f} users/s"
+        )
+
+    result = importer.import_users(
+        path,
+        fmt=fmt,
+        checkpoint=checkpoint,
+        batch_size=batch_size,
+        workers=workers,
+        progress=report,
+    )
+    click.echo(
+        f"Imported {result.imported} users, skipped {result.skipped}, "
+        f"in {result.elapsed:.1f}s"
+    )
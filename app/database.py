@@ -1,5 +1,18 @@
 # -*- coding: utf-8 -*-
 """Database module, including the SQLAlchemy database object and DB-related utilities."""
+import time
+from contextlib import ContextDecorator, contextmanager
+from itertools import count, islice
+
+from flask import g, has_request_context
+from flask import session as http_session
+from flask.signals import Namespace
+from sqlalchemy import event, exc, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import CompoundSelect, Select, UpdateBase
+from werkzeug.exceptions import InternalServerError
+
 from .compat import basestring
 from .extensions import db
 
@@ -7,6 +20,24 @@ from .extensions import db
 Column = db.Column
 relationship = db.relationship
 
+_signals = Namespace()
+
+#: Sent with ``sender=<model class>`` and ``identity=<primary key tuple>`` once
+#: a write made through :class:`CRUDMixin` to an existing record is committed.
+record_committed = _signals.signal("record-committed")
+
+_WRITTEN_KEY = "crud_written_records"
+_UNIT_OF_WORK_KEY = "unit_of_work_depth"
+_PRIMARY_KEY = "replica_use_primary"
+_FORCED_PRIMARY_KEY = "replica_forced_primary"
+_WROTE_KEY = "replica_wrote"
+_REPLICA_KEY = "replica_bind"
+#: Flask session key holding the time until which reads stay on the primary
+STICKY_UNTIL_KEY = "_db_primary_until"
+
+#: Process-wide counters for :class:`UnitOfWork`.
+unit_of_work_stats = {"units": 0, "commits_avoided": 0}
+
 
 class CRUDMixin(object):
     """Mixin that adds convenience methods for CRUD (create, read, update, delete) operations."""
@@ -17,23 +48,402 @@ class CRUDMixin(object):
         instance = cls(**kwargs)
         return instance.save()
 
+    @classmethod
+    def create_many(cls, rows, batch_size=1000, return_ids=False):
+        """Insert many records, committing once per batch.
+
+        ``rows`` is an iterable of dicts of column values. They are inserted with
+        ``bulk_insert_mappings``, so the model constructor does not run: compute
+        derived values such as password hashes beforehand.
+
+        :param return_ids: Return the generated primary keys instead of the
+            number of rows. This needs one INSERT per row on most backends.
+        """
+        pk = _primary_key(cls).key
+        ids = []
+        total = 0
+        for batch in _batches(rows, batch_size):
+            db.session.bulk_insert_mappings(cls, batch, return_defaults=return_ids)
+            db.session.commit()
+            if return_ids:
+                ids.extend(row[pk] for row in batch)
+            total += len(batch)
+        return ids if return_ids else total
+
+    @classmethod
+    def update_many(cls, rows, batch_size=1000):
+        """Update many records, committing once per batch.
+
+        Each dict in ``rows`` must contain the primary key and the columns to
+        change. Returns the number of rows sent.
+        """
+        pk = _primary_key(cls).key
+        total = 0
+        for batch in _batches(rows, batch_size):
+            db.session.bulk_update_mappings(cls, batch)
+            for row in batch:
+                _queue_committed(cls, (row[pk],))
+            db.session.commit()
+            total += len(batch)
+        return total
+
+    @classmethod
+    def delete_many(cls, ids, batch_size=1000):
+        """Delete records by primary key, committing once per batch.
+
+        Returns the number of rows deleted.
+        """
+        pk_column = _primary_key(cls)
+        total = 0
+        for batch in _batches(ids, batch_size):
+            total += cls.query.filter(pk_column.in_(batch)).delete(
+                synchronize_session=False
+            )
+            for record_id in batch:
+                _queue_committed(cls, (record_id,))
+            db.session.commit()
+        return total
+
     def update(self, commit=True, **kwargs):
         """Update specific fields of a record."""
         for attr, value in kwargs.items():
             setattr(self, attr, value)
+        self._track_write()
         return commit and self.save() or self
 
     def save(self, commit=True):
         """Save the record."""
         db.session.add(self)
-        if commit:
+        self._track_write()
+        if _commit_requested(commit):
             db.session.commit()
         return self
 
     def delete(self, commit=True):
         """Remove the record from the database."""
+        self._track_write()
         db.session.delete(self)
-        return commit and db.session.commit()
+        return _commit_requested(commit) and db.session.commit()
+
+    def _track_write(self):
+        """Remember this record so ``record_committed`` fires after the next commit."""
+        identity = inspect(self).identity
+        if identity is not None:
+            _queue_committed(type(self), identity)
+
+
+def _commit_requested(commit):
+    """Return whether a CRUD call should commit now.
+
+    Inside a :class:`UnitOfWork` the commit is deferred to the end of the unit.
+    """
+    if not commit:
+        return False
+    if db.session.info.get(_UNIT_OF_WORK_KEY):
+        unit_of_work_stats["commits_avoided"] += 1
+        return False
+    return True
+
+
+def _queue_committed(model, identity):
+    """Queue ``record_committed`` for a written row until the session commits."""
+    db.session.info.setdefault(_WRITTEN_KEY, set()).add((model, identity))
+
+
+def _primary_key(model):
+    """Return the single primary key column of ``model``."""
+    return inspect(model).primary_key[0]
+
+
+def _batches(iterable, size):
+    """Yield lists of at most ``size`` items from ``iterable``."""
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+
+@event.listens_for(Session, "after_commit")
+def _send_record_committed(session):
+    """Notify listeners about records written in the committed transaction."""
+    for model, identity in session.info.pop(_WRITTEN_KEY, ()):
+        record_committed.send(model, identity=identity)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_written_records(session):
+    """Rolled back writes never reached the database."""
+    session.info.pop(_WRITTEN_KEY, None)
+
+
+@event.listens_for(Session, "after_commit")
+def _stick_to_primary(session):
+    """Keep the visitor's next requests on the primary once their write commits."""
+    if not session.info.pop(_WROTE_KEY, False) or not has_request_context():
+        return
+    app = getattr(session, "app", None)
+    router = app.extensions.get("replica_router") if app is not None else None
+    if router is not None and router.sticky_seconds > 0:
+        http_session[STICKY_UNTIL_KEY] = time.time() + router.sticky_seconds
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_write(session):
+    session.info.pop(_WROTE_KEY, None)
+
+
+class ReplicaRouter(object):
+    """Send reads to read replicas and everything else to the primary.
+
+    Replicas are configured with ``SQLALCHEMY_REPLICA_URIS`` and become the
+    binds ``replica0``, ``replica1``, ... Only plain ``SELECT`` statements go to
+    a replica. A session that has written anything reads from the primary for
+    the rest of its life, and once such a write commits during a request the
+    visitor's following requests also read from the primary for
+    ``DATABASE_REPLICA_STICKY_SECONDS``, which should cover the replication lag.
+
+    A replica that fails a query or a health check is skipped for
+    ``DATABASE_REPLICA_RETRY_SECONDS``; with no healthy replica left, reads
+    fall back to the primary. Reads that must not see a lagging replica, e.g.
+    to cache their result, go in a :func:`use_primary` block.
+    """
+
+    def __init__(self, app=None):
+        """Create instance."""
+        self.binds = []
+        self.sticky_seconds = 0
+        self.retry_seconds = 0
+        self.check_interval = 0
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self._down_until = {}
+        self._checked_at = {}
+        self._engines = {}
+        self._counter = count()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Add the replicas to ``SQLALCHEMY_BINDS``; run before ``db.init_app``."""
+        app.config.setdefault("SQLALCHEMY_REPLICA_URIS", [])
+        app.config.setdefault("DATABASE_REPLICA_STICKY_SECONDS", 5)
+        app.config.setdefault("DATABASE_REPLICA_RETRY_SECONDS", 30)
+        app.config.setdefault("DATABASE_REPLICA_CHECK_INTERVAL", 10)
+        self.sticky_seconds = app.config["DATABASE_REPLICA_STICKY_SECONDS"]
+        self.retry_seconds = app.config["DATABASE_REPLICA_RETRY_SECONDS"]
+        self.check_interval = app.config["DATABASE_REPLICA_CHECK_INTERVAL"]
+        self._down_until.clear()
+        self._checked_at.clear()
+        self._engines.clear()
+        uris = app.config["SQLALCHEMY_REPLICA_URIS"]
+        self.binds = [f"replica{index}" for index in range(len(uris))]
+        if not uris:
+            return None
+        binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+        binds.update(zip(self.binds, uris))
+        app.config["SQLALCHEMY_BINDS"] = binds
+        if not event.contains(Engine, "handle_error", self._handle_error):
+            event.listen(Engine, "handle_error", self._handle_error)
+        app.extensions["replica_router"] = self
+        return None
+
+    def get_bind(self, session, mapper, clause):
+        """Return a replica engine for reads, or None to use the primary."""
+        if not self.binds or _bind_key(mapper) is not None:
+            return None
+        if session._flushing or clause is None or isinstance(clause, UpdateBase):
+            session.info[_PRIMARY_KEY] = True
+            session.info[_WROTE_KEY] = True
+            return None
+        if (
+            not _is_read(clause)
+            or session.info.get(_PRIMARY_KEY)
+            or session.info.get(_FORCED_PRIMARY_KEY)
+            or self._sticky_request()
+        ):
+            self.primary_reads += 1
+            return None
+        key = self._choose(session)
+        if key is None:
+            self.primary_reads += 1
+            return None
+        self.replica_reads += 1
+        engine = db.get_engine(session.app, bind=key)
+        self._engines[engine] = key
+        return engine
+
+    def _sticky_request(self):
+        return (
+            has_request_context()
+            and http_session.get(STICKY_UNTIL_KEY, 0) > time.time()
+        )
+
+    def _choose(self, session):
+        """Return the replica bind for ``session``, keeping it once chosen."""
+        key = session.info.get(_REPLICA_KEY)
+        if key is not None and self._healthy(session.app, key):
+            return key
+        healthy = [key for key in self.binds if self._healthy(session.app, key)]
+        if not healthy:
+            return None
+        key = healthy[next(self._counter) % len(healthy)]
+        session.info[_REPLICA_KEY] = key
+        return key
+
+    def _healthy(self, app, key):
+        """Return whether ``key`` is usable, pinging it every ``check_interval``."""
+        now = time.monotonic()
+        if self._down_until.get(key, 0) > now:
+            return False
+        if now - self._checked_at.get(key, float("-inf")) < self.check_interval:
+            return True
+        self._checked_at[key] = now
+        try:
+            with db.get_engine(app, bind=key).connect() as connection:
+                connection.execute(text("SELECT 1"))
+        except exc.DBAPIError:
+            self.mark_down(key)
+            return False
+        return True
+
+    def mark_down(self, key):
+        """Stop routing reads to ``key`` for ``retry_seconds``."""
+        self._down_until[key] = time.monotonic() + self.retry_seconds
+        self._checked_at.pop(key, None)
+
+    def _handle_error(self, context):
+        key = self._engines.get(context.engine)
+        if key is not None and (
+            context.is_disconnect
+            or isinstance(context.sqlalchemy_exception, exc.OperationalError)
+        ):
+            self.mark_down(key)
+
+    def stats(self):
+        """Return read counters and the replicas currently skipped."""
+        now = time.monotonic()
+        return {
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+            "replicas_down": sum(
+                1 for until in self._down_until.values() if until > now
+            ),
+        }
+
+
+@contextmanager
+def use_primary():
+    """Send the reads of ``db.session`` inside the block to the primary."""
+    info = db.session.info
+    info[_FORCED_PRIMARY_KEY] = info.get(_FORCED_PRIMARY_KEY, 0) + 1
+    try:
+        yield
+    finally:
+        info[_FORCED_PRIMARY_KEY] -= 1
+        if not info[_FORCED_PRIMARY_KEY]:
+            del info[_FORCED_PRIMARY_KEY]
+
+
+def _bind_key(mapper):
+    """Return the ``__bind_key__`` of ``mapper``'s table, if any."""
+    if mapper is None:
+        return None
+    return mapper.persist_selectable.info.get("bind_key")
+
+
+def _is_read(clause):
+    """Return whether ``clause`` is a ``SELECT`` that takes no row locks."""
+    return (
+        isinstance(clause, (Select, CompoundSelect))
+        and clause._for_update_arg is None
+    )
+
+
+replica_router = ReplicaRouter()
+
+
+class UnitOfWork(ContextDecorator):
+    """Combine the commits of ``save``/``update``/``delete`` into one.
+
+    Use it as a context manager or a view decorator. Commits requested by
+    :class:`CRUDMixin` inside the unit only add to the session; the outermost
+    unit flushes and commits once on exit, or rolls everything back if an
+    exception escapes. Primary keys of new records are assigned at flush time,
+    so call ``db.session.flush()`` if an ID is needed before the unit ends.
+    """
+
+    def __enter__(self):
+        """Enter the unit."""
+        info = db.session.info
+        info[_UNIT_OF_WORK_KEY] = info.get(_UNIT_OF_WORK_KEY, 0) + 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Commit or roll back if this is the outermost unit."""
+        info = db.session.info
+        info[_UNIT_OF_WORK_KEY] -= 1
+        if info[_UNIT_OF_WORK_KEY]:
+            return False
+        del info[_UNIT_OF_WORK_KEY]
+        unit_of_work_stats["units"] += 1
+        if exc_type is not None:
+            db.session.rollback()
+            return False
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return False
+
+
+def unit_of_work():
+    """Return a :class:`UnitOfWork`, which also works as a view decorator."""
+    return UnitOfWork()
+
+
+def register_unit_of_work(app):
+    """Run every request in a unit of work if ``UNIT_OF_WORK_REQUESTS`` is set.
+
+    The unit ends in ``after_request``, before the response and the session
+    cookie are sent: it commits if the response is not a server error and rolls
+    back otherwise. Flask also runs ``after_request`` for the 500 response built
+    after a view raised. A failed commit turns the response into a 500. Units
+    left open, e.g. because an exception propagated, are rolled back in
+    ``teardown_request``.
+    """
+    if not app.config.get("UNIT_OF_WORK_REQUESTS"):
+        return None
+
+    @app.before_request
+    def enter_unit_of_work():
+        g.unit_of_work = UnitOfWork().__enter__()
+
+    @app.after_request
+    def exit_unit_of_work(response):
+        unit = g.pop("unit_of_work", None)
+        if unit is None:
+            return response
+        if response.status_code >= 500:
+            error = RuntimeError(f"request ended with status {response.status_code}")
+            unit.__exit__(type(error), error, None)
+            return response
+        try:
+            unit.__exit__(None, None, None)
+        except Exception:
+            app.logger.exception("Could not commit the request's unit of work")
+            return app.make_response(app.handle_http_exception(InternalServerError()))
+        return response
+
+    @app.teardown_request
+    def roll_back_unit_of_work(exc):
+        unit = g.pop("unit_of_work", None)
+        if unit is not None:
+            error = exc or RuntimeError("request ended without a response")
+            unit.__exit__(type(error), error, None)
+
+    return None
 
 
 class Model(CRUDMixin, db.Model):
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Database connection pool configuration for gevent workers.
+
+psycopg2 blocks in libpq by default, which stalls every greenlet of a gevent
+worker while a query runs. :func:`make_psycopg2_green` installs a wait callback
+that yields to the gevent hub instead. :func:`init_pool` builds the engine
+options from ``DB_POOL_*`` settings and uses :class:`TimedQueuePool`, which
+counts checkouts and the time spent waiting for a connection.
+"""
+import time
+import weakref
+
+from sqlalchemy import exc
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+from .utils import gevent_patched
+
+#: Process-wide pool counters
+pool_stats = {"checkouts": 0, "wait_seconds": 0.0, "timeouts": 0}
+
+_pools = weakref.WeakSet()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait.
+
+    The wait includes opening a new connection when the pool has none idle.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Create instance."""
+        super(TimedQueuePool, self).__init__(*args, **kwargs)
+        _pools.add(self)
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            pool_stats["timeouts"] += 1
+            raise
+        finally:
+            pool_stats["checkouts"] += 1
+            pool_stats["wait_seconds"] += time.perf_counter() - start
+
+
+def pool_metrics():
+    """Return pool counters and gauges for :mod:`app.metrics`."""
+    return {
+        ("rype_db_pool_checkouts_total", ()): pool_stats["checkouts"],
+        ("rype_db_pool_wait_seconds_total", ()): pool_stats["wait_seconds"],
+        ("rype_db_pool_timeouts_total", ()): pool_stats["timeouts"],
+        ("rype_db_pool_checked_out", ()): sum(pool.checkedout() for pool in _pools),
+        ("rype_db_pool_size", ()): sum(pool.size() for pool in _pools),
+    }
+
+
+def gevent_wait_callback(conn, timeout=None):
+    """Wait for a psycopg2 connection without blocking the gevent hub."""
+    from gevent.socket import wait_read, wait_write
+    from psycopg2 import OperationalError, extensions
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise OperationalError(f"Bad result from poll: {state!r}")
+
+
+def make_psycopg2_green():
+    """Make psycopg2 cooperative if gevent is active; returns whether it did."""
+    if not gevent_patched():
+        return False
+    try:
+        from psycopg2 import extensions
+    except ImportError:
+        return False
+    extensions.set_wait_callback(gevent_wait_callback)
+    return True
+
+
+def init_pool(app):
+    """Configure the engine pool from the ``DB_POOL_*`` settings.
+
+    Must run before ``db.init_app``. SQLite keeps SQLAlchemy's default pool.
+    """
+    app.config.setdefault("DB_POOL_SIZE", 10)
+    app.config.setdefault("DB_MAX_OVERFLOW", 10)
+    app.config.setdefault("DB_POOL_TIMEOUT", 10)
+    app.config.setdefault("DB_POOL_RECYCLE", 1800)
+    app.config.setdefault("DB_POOL_PRE_PING", True)
+    make_psycopg2_green()
+    url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+    if url.drivername.startswith("sqlite"):
+        return None
+    options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+    options.setdefault("poolclass", TimedQueuePool)
+    options.setdefault("pool_size", app.config["DB_POOL_SIZE"])
+    options.setdefault("max_overflow", app.config["DB_MAX_OVERFLOW"])
+    options.setdefault("pool_timeout", app.config["DB_POOL_TIMEOUT"])
+    options.setdefault("pool_recycle", app.config["DB_POOL_RECYCLE"])
+    options.setdefault("pool_pre_ping", app.config["DB_POOL_PRE_PING"])
+    return None
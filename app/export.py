@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Streaming exports of whole tables as CSV or JSON Lines.
+
+Rows are read with ``yield_per``, which also asks the driver for a server-side
+cursor (``stream_results``), so only ``EXPORT_BATCH_SIZE`` rows are in memory
+at a time. Each batch is formatted and, optionally, gzipped before the next is
+fetched, and the output is produced as a generator of byte chunks. Memory use
+therefore stays the same however large the table is, whether the chunks go to
+a file (``flask export``) or to an HTTP response.
+"""
+import csv
+import datetime as dt
+import io
+import json
+import zlib
+
+from flask import current_app
+
+from app.database import db
+from app.shop.models import Order
+from app.user.models import User
+
+#: Columns of each exportable table. Password hashes are never exported.
+TABLES = {
+    "users": (
+        User.id,
+        User.username,
+        User.email,
+        User.first_name,
+        User.last_name,
+        User.active,
+        User.is_admin,
+        User.created_at,
+    ),
+    "orders": (
+        Order.id,
+        Order.user_id,
+        Order.restaurant_id,
+        Order.courier_id,
+        Order.status,
+        Order.subtotal_cents,
+        Order.discount_cents,
+        Order.total_cents,
+        Order.promo_code,
+        Order.created_at,
+        Order.dispatched_at,
+        Order.paid_at,
+    ),
+}
+
+FORMATS = ("csv", "jsonl")
+
+MIMETYPES = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+
+def _batches(table, batch_size):
+    """Yield lists of at most ``batch_size`` rows of ``table``, in ID order."""
+    columns = TABLES[table]
+    rows = db.session.query(*columns).order_by(columns[0]).yield_per(batch_size)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _value(value):
+    if isinstance(value, (dt.datetime, dt.date)):
+        return value.isoformat()
+    return value
+
+
+def _csv(names, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    for batch in batches:
+        writer.writerows([_value(value) for value in row] for row in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _jsonl(names, batches):
+    for batch in batches:
+        yield "".join(
+            json.dumps(dict(zip(names, map(_value, row)))) + "\n" for row in batch
+        )
+
+
+def gzip_chunks(chunks, level=6):
+    """Compress byte ``chunks`` into a gzip stream as they come."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export(table, fmt="csv", compress=False, progress=None):
+    """Yield ``table`` in ``fmt`` as byte chunks, gzipped if ``compress``.
+
+    :param progress: Called with the number of rows exported so far after each
+        batch.
+    :raises ValueError: if the table or format is unknown.
+    """
+    if table not in TABLES:
+        raise ValueError(f"Unknown table {table!r}")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}")
+    batch_size = current_app.config.get("EXPORT_BATCH_SIZE", 1000)
+    names = [column.key for column in TABLES[table]]
+
+    def counted(batches):
+        count = 0
+        for batch in batches:
+            count += len(batch)
+            yield batch
+            if progress is not None:
+                progress(count)
+
+    formatter = _csv if fmt == "csv" else _jsonl
+    chunks = (
+        text.encode("utf-8")
+        for text in formatter(names, counted(_batches(table, batch_size)))
+        if text
+    )
+    return gzip_chunks(chunks) if compress else chunks
+
+
+def filename(table, fmt, compress=False):
+    """Return the download file name of an export."""
+    return f"{table}.{fmt}" + (".gz" if compress else "")
@@ -5,14 +5,41 @@ from flask_caching import Cache
 from flask_debugtoolbar import DebugToolbarExtension
 from flask_login import LoginManager
 from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
 from flask_webpack import Webpack
 from flask_wtf.csrf import CSRFProtect
+from sqlalchemy import orm
+
+
+class RoutingSession(SignallingSession):
+    """Session that lets the replica router pick the engine for a statement.
+
+    The router is :class:`app.database.ReplicaRouter`; without one (or when it
+    declines) binds are chosen as usual.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        """Return the engine for ``mapper`` and ``clause``."""
+        router = self.app.extensions.get("replica_router")
+        if router is not None:
+            bind = router.get_bind(self, mapper, clause)
+            if bind is not None:
+                return bind
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with :class:`RoutingSession` sessions."""
+
+    def create_session(self, options):
+        """Create the session factory."""
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
 
 bcrypt = Bcrypt()
 csrf_protect = CSRFProtect()
 login_manager = LoginManager()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 migrate = Migrate()
 cache = Cache()
 debug_toolbar = DebugToolbarExtension()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Password hashing service.
+
+bcrypt is slow on purpose, so hashing inline on a gevent worker stalls every
+other greenlet in that worker for the duration of the hash. This service hands
+the work to a small pool of native threads (bcrypt releases the GIL) and turns
+callers away immediately once too much work is already queued.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .extensions import bcrypt
+from .utils import gevent_patched
+
+
+class HashingBusyError(RuntimeError):
+    """Raised when the hashing queue is full and the work was not accepted."""
+
+
+class PasswordHasher(object):
+    """Bounded thread pool for bcrypt work.
+
+    Under gevent the pool is a :class:`gevent.threadpool.ThreadPool`, so the
+    calling greenlet yields to the hub while a real thread does the hashing.
+    Otherwise a plain :class:`~concurrent.futures.ThreadPoolExecutor` is used.
+    """
+
+    def __init__(self, app=None):
+        """Create instance."""
+        self.pool_size = 0
+        self.queue_depth = 0
+        self.pending = 0
+        self.rejected = 0
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Read pool settings from the app config."""
+        app.config.setdefault("HASHING_POOL_SIZE", 4)
+        app.config.setdefault("HASHING_QUEUE_DEPTH", 64)
+        self.pool_size = app.config["HASHING_POOL_SIZE"]
+        self.queue_depth = app.config["HASHING_QUEUE_DEPTH"]
+        app.extensions["password_hasher"] = self
+
+    def _get_pool(self):
+        """Return the pool for this process, creating it after a fork."""
+        pid = os.getpid()
+        if self._pool is None or self._pid != pid:
+            if gevent_patched():
+                from gevent.threadpool import ThreadPool
+
+                self._pool = ThreadPool(self.pool_size)
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.pool_size)
+            self._pid = pid
+        return self._pool
+
+    def run(self, func, *args):
+        """Run ``func(*args)`` on the pool and wait for the result.
+
+        :raises HashingBusyError: if ``queue_depth`` calls are already pending.
+        """
+        if self.pool_size <= 0:
+            return func(*args)
+        with self._lock:
+            if self.pending >= self.queue_depth:
+                self.rejected += 1
+                raise HashingBusyError("Password hashing queue is full")
+            self.pending += 1
+        try:
+            pool = self._get_pool()
+            if isinstance(pool, ThreadPoolExecutor):
+                return pool.submit(func, *args).result()
+            return pool.spawn(func, *args).get()
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def generate_password_hash(self, password):
+        """Hash ``password`` on the pool."""
+        return self.run(bcrypt.generate_password_hash, password)
+
+    def check_password_hash(self, pw_hash, password):
+        """Check ``password`` against ``pw_hash`` on the pool."""
+        return self.run(bcrypt.check_password_hash, pw_hash, password)
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+"""Per-request performance metrics, exposed in Prometheus text format.
+
+Each worker aggregates its measurements in memory and periodically writes a
+snapshot to ``METRICS_DIR/<pid>.json``. ``/metrics`` sums the snapshots of all
+workers on the host, so any worker can answer a scrape. Snapshots of workers
+that have exited are folded into ``archive.json`` to keep counters monotonic
+and the number of files bounded.
+"""
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from flask import Response, current_app, g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .database import unit_of_work_stats
+from .dbpool import pool_metrics
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+HISTOGRAMS = {
+    "rype_http_request_duration_seconds": (
+        "Request latency by endpoint.",
+        LATENCY_BUCKETS,
+    ),
+    "rype_http_response_size_bytes": ("Response body size by endpoint.", SIZE_BUCKETS),
+    "rype_db_statements_per_request": ("SQL statements per request.", COUNT_BUCKETS),
+    "rype_template_render_seconds": ("Template render time.", LATENCY_BUCKETS),
+}
+COUNTERS = {
+    "rype_http_requests_total": "Requests by endpoint and status.",
+    "rype_db_statements_total": "SQL statements executed during requests.",
+    "rype_db_statement_seconds_total": "Time spent in SQL statements.",
+    "rype_db_pool_checkouts_total": "Connections checked out of the pool.",
+    "rype_db_pool_wait_seconds_total": "Time spent waiting for a pooled connection.",
+    "rype_db_pool_timeouts_total": "Checkouts that gave up waiting for a connection.",
+}
+
+
+def default_metrics_dir():
+    """Return ``METRICS_DIR`` from the environment or a temporary directory."""
+    return os.environ.get(
+        "METRICS_DIR", os.path.join(tempfile.gettempdir(), "rype-metrics")
+    )
+
+
+def clear_store(directory):
+    """Remove all snapshots, e.g. when the server (re)starts."""
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.endswith(".json"):
+                os.remove(os.path.join(directory, name))
+
+
+class MetricsRegistry(object):
+    """In-process counters and histograms."""
+
+    def __init__(self):
+        """Create instance."""
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels, value=1):
+        """Increment a counter."""
+        with self._lock:
+            self.counters[(name, labels)] += value
+
+    def observe(self, name, labels, value):
+        """Record ``value`` in a histogram."""
+        buckets = HISTOGRAMS[name][1]
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = [
+                    [0] * (len(buckets) + 1),
+                    0.0,
+                ]
+            histogram[0][bisect_left(buckets, value)] += 1
+            histogram[1] += value
+
+    def register_collector(self, collector):
+        """Add a callable returning ``{(name, labels): value}``.
+
+        Collectors report values kept elsewhere, e.g. cache hits. Names ending
+        in ``_total`` are exposed as counters, anything else as a gauge; both
+        are summed over all workers.
+        """
+        if collector not in self.collectors:
+            self.collectors.append(collector)
+
+    def snapshot(self):
+        """Return the current values as JSON-serializable data."""
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {
+                key: (list(counts), total)
+                for key, (counts, total) in self.histograms.items()
+            }
+        for collector in self.collectors:
+            counters.update(collector())
+        return {
+            "counters": [
+                [name, list(labels), value]
+                for (name, labels), value in counters.items()
+            ],
+            "histograms": [
+                [name, list(labels), counts, total]
+                for (name, labels), (counts, total) in histograms.items()
+            ],
+        }
+
+
+def merge_snapshots(snapshots):
+    """Sum a list of snapshots into ``(counters, histograms)`` dicts."""
+    counters = defaultdict(float)
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot.get("counters", ()):
+            counters[(name, tuple(tuple(pair) for pair in labels))] += value
+        for name, labels, counts, total in snapshot.get("histograms", ()):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            if key in histograms:
+                merged = histograms[key]
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+            else:
+                histograms[key] = [list(counts), total]
+    return counters, histograms
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in pairs
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def render_prometheus(counters, histograms):
+    """Render merged metrics in the Prometheus text exposition format."""
+    lines = []
+    by_name = defaultdict(list)
+    for (name, labels), value in counters.items():
+        by_name[name].append((labels, value))
+    for name in sorted(by_name):
+        kind = "counter" if name.endswith("_total") else "gauge"
+        lines.append(f"# HELP {name} {COUNTERS.get(name, name)}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(by_name[name]):
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+
+    by_name = defaultdict(list)
+    for (name, labels), value in histograms.items():
+        by_name[name].append((labels, value))
+    for name in sorted(by_name):
+        help_text, buckets = HISTOGRAMS[name]
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, (counts, total) in sorted(by_name[name]):
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ["+Inf"], counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else f"{bound:g}"
+                lines.append(
+                    f"{name}_bucket{_format_labels(labels, [('le', le)])} {cumulative}"
+                )
+            lines.append(f"{name}_sum{_format_labels(labels)} {total:g}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Metrics(object):
+    """Instrument an app and serve ``/metrics``."""
+
+    def __init__(self, app=None):
+        """Create instance."""
+        self.registry = MetricsRegistry()
+        self.directory = None
+        self.flush_interval = 0
+        self.scrape_interval = 0
+        self._last_flush = 0.0
+        self._scrape = (0.0, "")
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Register request hooks, template signals and the ``/metrics`` view."""
+        app.config.setdefault("METRICS_ENABLED", True)
+        app.config.setdefault("METRICS_DIR", default_metrics_dir())
+        app.config.setdefault("METRICS_FLUSH_INTERVAL", 5)
+        app.config.setdefault("METRICS_SCRAPE_INTERVAL", 1)
+        if not app.config["METRICS_ENABLED"]:
+            return None
+        self.directory = app.config["METRICS_DIR"]
+        self.flush_interval = app.config["METRICS_FLUSH_INTERVAL"]
+        self.scrape_interval = app.config["METRICS_SCRAPE_INTERVAL"]
+        os.makedirs(self.directory, exist_ok=True)
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._before_render, app, weak=False)
+        template_rendered.connect(self._after_render, app, weak=False)
+        _listen_to_engines()
+        self.registry.register_collector(extension_stats)
+        self.registry.register_collector(pool_metrics)
+        app.add_url_rule("/metrics", "metrics", self.view)
+        app.extensions["metrics"] = self
+        return None
+
+    def _before_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_sql = [0, 0.0]
+        g.metrics_templates = []
+
+    def _after_request(self, response):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = (("endpoint", request.endpoint or "unmatched"),)
+        status = endpoint + (("status", str(response.status_code)),)
+        statements, sql_seconds = g.pop("metrics_sql", (0, 0.0))
+        registry = self.registry
+        registry.inc("rype_http_requests_total", status)
+        registry.observe("rype_http_request_duration_seconds", endpoint, elapsed)
+        registry.observe("rype_db_statements_per_request", endpoint, statements)
+        registry.inc("rype_db_statements_total", endpoint, statements)
+        registry.inc("rype_db_statement_seconds_total", endpoint, sql_seconds)
+        # Measuring a streamed response would buffer all of it.
+        if not response.direct_passthrough and not response.is_streamed:
+            size = response.calculate_content_length() or 0
+            registry.observe("rype_http_response_size_bytes", endpoint, size)
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+        return response
+
+    def _before_render(self, sender, template, context, **extra):
+        if has_request_context() and "metrics_templates" in g:
+            g.metrics_templates.append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra):
+        if has_request_context() and g.get("metrics_templates"):
+            elapsed = time.perf_counter() - g.metrics_templates.pop()
+            labels = (("template", template.name or "string"),)
+            self.registry.observe("rype_template_render_seconds", labels, elapsed)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def flush(self):
+        """Write this worker's snapshot."""
+        self._last_flush = time.monotonic()
+        path = self._path(f"{os.getpid()}.json")
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as snapshot_file:
+            json.dump(self.registry.snapshot(), snapshot_file)
+        os.replace(temp_path, path)
+
+    def collect(self):
+        """Return merged metrics of every worker on this host."""
+        with open(self._path("lock"), "a") as lock_file:
+            fcntl.lockf(lock_file, fcntl.LOCK_EX)
+            try:
+                snapshots, dead = self._read_snapshots()
+                if dead:
+                    self._archive(snapshots, dead)
+            finally:
+                fcntl.lockf(lock_file, fcntl.LOCK_UN)
+        return merge_snapshots(snapshots.values())
+
+    def _read_snapshots(self):
+        snapshots = {}
+        dead = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(self._path(name)) as snapshot_file:
+                    snapshots[name] = json.load(snapshot_file)
+            except (OSError, ValueError):
+                continue
+            pid = name[: -len(".json")]
+            if pid.isdigit() and not _pid_alive(int(pid)):
+                dead.append(name)
+        return snapshots, dead
+
+    def _archive(self, snapshots, dead):
+        """Fold snapshots of exited workers into ``archive.json``."""
+        names = dead + (["archive.json"] if "archive.json" in snapshots else [])
+        counters, histograms = merge_snapshots(snapshots[name] for name in names)
+        # Gauges describe live processes only, so they are not archived
+        archive = {
+            "counters": [
+                [name, list(labels), value]
+                for (name, labels), value in counters.items()
+                if name.endswith("_total")
+            ],
+            "histograms": [
+                [name, list(labels), counts, total]
+                for (name, labels), (counts, total) in histograms.items()
+            ],
+        }
+        temp_path = self._path("archive.json.tmp")
+        with open(temp_path, "w") as archive_file:
+            json.dump(archive, archive_file)
+        os.replace(temp_path, self._path("archive.json"))
+        for name in dead:
+            os.remove(self._path(name))
+            del snapshots[name]
+        snapshots["archive.json"] = archive
+
+    def view(self):
+        """Serve the merged metrics; rendered at most once per scrape interval."""
+        rendered_at, text = self._scrape
+        if time.monotonic() - rendered_at >= self.scrape_interval:
+            self.flush()
+            text = render_prometheus(*self.collect())
+            self._scrape = (time.monotonic(), text)
+        return Response(text, mimetype="text/plain; version=0.0.4")
+
+
+def extension_stats():
+    """Collect the ``stats()`` of the app's caches and the unit-of-work counters."""
+    values = {}
+    for name in ("identity_cache", "page_cache"):
+        extension = current_app.extensions.get(name)
+        if extension is not None:
+            for key, value in extension.stats().items():
+                suffix = "_total" if key in ("hits", "misses") else ""
+                values[(f"rype_{name}_{key}{suffix}", ())] = value
+    hasher = current_app.extensions.get("password_hasher")
+    if hasher is not None:
+        values[("rype_hashing_rejected_total", ())] = hasher.rejected
+        values[("rype_hashing_pending", ())] = hasher.pending
+    router = current_app.extensions.get("replica_router")
+    if router is not None:
+        stats = router.stats()
+        values[("rype_db_replica_reads_total", ())] = stats["replica_reads"]
+        values[("rype_db_primary_reads_total", ())] = stats["primary_reads"]
+        values[("rype_db_replicas_down", ())] = stats["replicas_down"]
+    for key, value in unit_of_work_stats.items():
+        values[(f"rype_unit_of_work_{key}_total", ())] = value
+    return values
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("metrics_query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    if has_request_context():
+        sql = g.get("metrics_sql")
+        if sql is not None:
+            sql[0] += 1
+            sql[1] += elapsed
+
+
+def _listen_to_engines():
+    """Time SQL statements on every engine, once per process."""
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+metrics = Metrics()
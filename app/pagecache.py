@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""Full-page response cache for pages that only vary by route and login state.
+
+Cached bodies are rendered with a placeholder in place of the CSRF token, and
+each response gets the token of the requesting session substituted back in, so
+a cached page never leaks one visitor's token to another.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+
+from flask import current_app, g, make_response, request, session
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+
+CSRF_PLACEHOLDER = "__page_cache_csrf_token__"
+
+CachedPage = namedtuple(
+    "CachedPage", ["expires", "body", "status", "mimetype", "digest", "has_csrf"]
+)
+
+
+class PageCache(object):
+    """Byte-bounded LRU cache of rendered pages with ETag support."""
+
+    def __init__(self, app=None):
+        """Create instance."""
+        self.enabled = False
+        self.max_bytes = 0
+        self.timeout = 0
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        #: Every view decorated with :meth:`cached`
+        self.views = set()
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Read cache settings from the app config."""
+        app.config.setdefault("PAGE_CACHE_ENABLED", True)
+        app.config.setdefault("PAGE_CACHE_MAX_BYTES", 16 * 1024 * 1024)
+        app.config.setdefault("PAGE_CACHE_TIMEOUT", 300)
+        self.enabled = app.config["PAGE_CACHE_ENABLED"]
+        self.max_bytes = app.config["PAGE_CACHE_MAX_BYTES"]
+        self.timeout = app.config["PAGE_CACHE_TIMEOUT"]
+        self.clear()
+        app.extensions["page_cache"] = self
+
+    def cached(self, timeout=None, vary=None):
+        """Cache the decorated view's response.
+
+        The key is the endpoint, the logged in user (or anonymous), the query
+        string and the return value of ``vary()`` if given. Requests that have
+        flashed messages pending bypass the cache.
+        """
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if (
+                    not self.enabled
+                    or request.method not in ("GET", "HEAD")
+                    or session.get("_flashes")
+                ):
+                    return view(*args, **kwargs)
+                key = self._make_key(vary)
+                page = self._get(key)
+                if page is None:
+                    page = self._render(view, args, kwargs, timeout)
+                    if not isinstance(page, CachedPage):
+                        return page
+                    self._set(key, page)
+                return self._respond(page)
+
+            self.views.add(wrapper)
+            return wrapper
+
+        return decorator
+
+    def _make_key(self, vary):
+        if current_user.is_authenticated:
+            user_key = current_user.get_id()
+        else:
+            user_key = "anonymous"
+        query = "&".join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)))
+        extra = vary() if vary is not None else ""
+        return f"{request.endpoint}|{user_key}|{query}|{extra}"
+
+    def _render(self, view, args, kwargs, timeout):
+        """Render the view with a CSRF placeholder.
+
+        Returns a :class:`CachedPage`, or the finished response if it must not
+        be cached.
+        """
+        field_name = current_app.config.get("WTF_CSRF_FIELD_NAME", "csrf_token")
+        setattr(g, field_name, CSRF_PLACEHOLDER)
+        try:
+            response = make_response(view(*args, **kwargs))
+        finally:
+            g.pop(field_name, None)
+        body = response.get_data()
+        has_csrf = CSRF_PLACEHOLDER.encode() in body
+        if response.status_code != 200 or session.get("_flashes"):
+            if has_csrf:
+                response.set_data(_insert_csrf(body))
+            return response
+        timeout = self.timeout if timeout is None else timeout
+        return CachedPage(
+            expires=time.monotonic() + timeout,
+            body=body,
+            status=response.status_code,
+            mimetype=response.mimetype,
+            digest=hashlib.sha1(body).hexdigest(),
+            has_csrf=has_csrf,
+        )
+
+    def _respond(self, page):
+        body = page.body
+        etag = page.digest
+        if page.has_csrf:
+            body = _insert_csrf(body)
+            etag = f"{etag}-{_csrf_epoch()}"
+        response = current_app.response_class(
+            body, status=page.status, mimetype=page.mimetype
+        )
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    def _get(self, key):
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None and page.expires > time.monotonic():
+                self._pages.move_to_end(key)
+                self.hits += 1
+                return page
+            if page is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def _set(self, key, page):
+        if len(page.body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._pages:
+                self._remove(key)
+            self._pages[key] = page
+            self.size += len(page.body)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._pages)))
+
+    def _remove(self, key):
+        self.size -= len(self._pages.pop(key).body)
+
+    def clear(self):
+        """Drop every page and reset the counters."""
+        with self._lock:
+            self._pages.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return hit/miss counters and the memory in use."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "pages": len(self._pages),
+            "bytes": self.size,
+        }
+
+
+def _insert_csrf(body):
+    """Replace the CSRF placeholder with the token of the current session."""
+    return body.replace(CSRF_PLACEHOLDER.encode(), generate_csrf().encode())
+
+
+def _csrf_epoch():
+    """Return a tag that changes well before a cached CSRF token expires.
+
+    Mixing it into the ETag keeps a client from revalidating a page whose
+    embedded token is older than half of ``WTF_CSRF_TIME_LIMIT``.
+    """
+    field_name = current_app.config.get("WTF_CSRF_FIELD_NAME", "csrf_token")
+    time_limit = current_app.config.get("WTF_CSRF_TIME_LIMIT") or 3600
+    epoch = int(time.time() // max(1, time_limit // 2))
+    raw = f"{session.get(field_name)}:{epoch}".encode()
+    return hashlib.sha1(raw).hexdigest()[:12]
+
+
+page_cache = PageCache()
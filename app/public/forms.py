@@ -4,6 +4,7 @@ from flask_wtf import FlaskForm
 from wtforms import PasswordField, StringField
 from wtforms.validators import DataRequired
 
+from app.hashing import HashingBusyError
 from app.user.models import User
 
 
@@ -29,7 +30,12 @@ class LoginForm(FlaskForm):
             self.username.errors.append("Unknown username")
             return False
 
-        if not self.user.check_password(self.password.data):
+        try:
+            valid_password = self.user.check_password(self.password.data)
+        except HashingBusyError:
+            self.password.errors.append("Server is busy, please try again")
+            return False
+        if not valid_password:
             self.password.errors.append("Invalid password")
             return False
 
@@ -9,12 +9,20 @@ from flask import (
     request,
     url_for,
 )
-from flask_login import login_required, login_user, logout_user
+from flask_login import current_user, login_required, login_user, logout_user
+from sqlalchemy.orm import joinedload
 
 from app.extensions import login_manager
+from app.pagecache import page_cache
 from app.public.forms import LoginForm
+from app.shop import inventory, ratings
+from app.shop.cart import current_cart
+from app.shop.forms import CartItemForm, CheckoutForm, PromoForm, RatingForm
+from app.shop.models import MenuItem, Order, OrderItem
+from app.shop.popularity import popular_items
 from app.user.forms import RegisterForm
-from app.user.models import User
+from app.user.identity import identity_cache
+from app.user.models import User, UserAlreadyExists
 from app.utils import flash_errors
 
 blueprint = Blueprint("public", __name__, static_folder="../static")
@@ -22,8 +30,8 @@ blueprint = Blueprint("public", __name__, static_folder="../static")
 
 @login_manager.user_loader
 def load_user(user_id):
-    """Load user by ID."""
-    return User.get_by_id(int(user_id))
+    """Load a cached snapshot of the user by ID."""
+    return identity_cache.get(int(user_id))
 
 
 @blueprint.route("/", methods=["GET", "POST"])
@@ -57,56 +65,115 @@ def register():
     """Register new user."""
     form = RegisterForm(request.form)
     if form.validate_on_submit():
-        User.create(
-            username=form.username.data,
-            email=form.email.data,
-            password=form.password.data,
-            active=True,
-        )
-        flash("Thank you for registering. You can now log in.", "success")
-        return redirect(url_for("public.home"))
-    else:
-        flash_errors(form)
+        try:
+            User.create(
+                username=form.username.data,
+                email=form.email.data,
+                password_hash=form.password_hash,
+                active=True,
+            )
+        except UserAlreadyExists as error:
+            form.report_taken(error.fields)
+        else:
+            flash("Thank you for registering. You can now log in.", "success")
+            return redirect(url_for("public.home"))
+    flash_errors(form)
     return render_template("public/register.html", form=form)
 
 
 @blueprint.route("/about/")
+@page_cache.cached()
 def about():
     """About page."""
     form = LoginForm(request.form)
     return render_template("public/about.html", form=form)
 
 @blueprint.route("/customerHome/")
+@page_cache.cached()
 def customerHome():
     """Customer Home."""
     form = LoginForm(request.form)
-    return render_template("public/customerHome.html", form=form)
+    return render_template(
+        "public/customerHome.html", form=form, popular=popular_items()
+    )
 
 
 @blueprint.route("/customerShoppingCart/")
 def customerShoppingCart():
     """Customer Shopping Cart."""
     form = LoginForm(request.form)
-    return render_template("public/customerShoppingCart.html", form=form)
-
+    menu = MenuItem.query.filter_by(active=True).order_by(MenuItem.name).all()
+    return render_template(
+        "public/customerShoppingCart.html",
+        form=form,
+        cart=current_cart(),
+        menu=menu,
+        sold_out=inventory.sold_out(item.id for item in menu),
+        item_form=CartItemForm(),
+    )
+
+
+def latest_order():
+    """Return the current user's most recent order, if logged in."""
+    if not current_user.is_authenticated:
+        return None
+    return (
+        Order.query.filter_by(user_id=current_user.id)
+        .order_by(Order.created_at.desc())
+        .first()
+    )
 
 
 @blueprint.route("/customerDeliveryRating/")
 def customerDeliveryRating():
     """Customer Delivery Rating."""
     form = LoginForm(request.form)
-    return render_template("public/customerDeliveryRating.html", form=form)
+    order = latest_order()
+    summary = None
+    if order is not None and order.courier_id is not None:
+        summary = ratings.summary("courier", order.courier_id)
+    return render_template(
+        "public/customerDeliveryRating.html",
+        form=form,
+        order=order,
+        summary=summary,
+        rating_form=RatingForm(),
+    )
 
 
 @blueprint.route("/customerFoodRating/")
 def customerFoodRating():
     """Customer Food Rating."""
     form = LoginForm(request.form)
-    return render_template("public/customerFoodRating.html", form=form)
+    order = latest_order()
+    items = []
+    if order is not None:
+        order_items = (
+            OrderItem.query.options(joinedload(OrderItem.menu_item))
+            .filter_by(order_id=order.id)
+            .all()
+        )
+        summaries = ratings.summaries(
+            "item", [item.menu_item_id for item in order_items]
+        )
+        items = [(item.menu_item, summaries[item.menu_item_id]) for item in order_items]
+    return render_template(
+        "public/customerFoodRating.html",
+        form=form,
+        order=order,
+        items=items,
+        rating_form=RatingForm(),
+    )
 
 
 @blueprint.route("/customerPay/")
 def customerPay():
     """Customer Pay."""
     form = LoginForm(request.form)
-    return render_template("public/customerPay.html", form=form)
\ No newline at end of file
+    return render_template(
+        "public/customerPay.html",
+        form=form,
+        cart=current_cart(),
+        promo_form=PromoForm(),
+        checkout_form=CheckoutForm(),
+    )
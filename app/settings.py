@@ -6,6 +6,9 @@ Most configuration is set via environment variables.
 For local development, use a .env file to set
 environment variables.
 """
+import os
+import tempfile
+
 from environs import Env
 
 env = Env()
@@ -14,10 +17,80 @@ env.read_env()
 ENV = env.str("FLASK_ENV", default="production")
 DEBUG = ENV == "development"
 SQLALCHEMY_DATABASE_URI = env.str("DATABASE_URL")
+SQLALCHEMY_REPLICA_URIS = env.list("DATABASE_REPLICA_URLS", default=[])
+DATABASE_REPLICA_STICKY_SECONDS = env.float(
+    "DATABASE_REPLICA_STICKY_SECONDS", default=5
+)
+DATABASE_REPLICA_RETRY_SECONDS = env.float(
+    "DATABASE_REPLICA_RETRY_SECONDS", default=30
+)
+DATABASE_REPLICA_CHECK_INTERVAL = env.float(
+    "DATABASE_REPLICA_CHECK_INTERVAL", default=10
+)
 SECRET_KEY = env.str("SECRET_KEY")
 BCRYPT_LOG_ROUNDS = env.int("BCRYPT_LOG_ROUNDS", default=13)
 DEBUG_TB_ENABLED = DEBUG
 DEBUG_TB_INTERCEPT_REDIRECTS = False
-CACHE_TYPE = "simple"  # Can be "memcached", "redis", etc.
+# Shared by all workers on the host; can also be "simple", "memcached", "redis", etc.
+CACHE_TYPE = env.str("CACHE_TYPE", default="app.sharedcache.shared_memory")
+CACHE_SHARED_PATH = env.str("CACHE_SHARED_PATH", default=None)
+CACHE_SHARED_SLOTS = env.int("CACHE_SHARED_SLOTS", default=8192)
+CACHE_SHARED_SLOT_SIZE = env.int("CACHE_SHARED_SLOT_SIZE", default=2048)
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+DB_POOL_SIZE = env.int("DB_POOL_SIZE", default=10)
+DB_MAX_OVERFLOW = env.int("DB_MAX_OVERFLOW", default=10)
+DB_POOL_TIMEOUT = env.int("DB_POOL_TIMEOUT", default=10)
+DB_POOL_RECYCLE = env.int("DB_POOL_RECYCLE", default=1800)
+DB_POOL_PRE_PING = env.bool("DB_POOL_PRE_PING", default=True)
 WEBPACK_MANIFEST_PATH = "webpack/manifest.json"
+HASHING_POOL_SIZE = env.int("HASHING_POOL_SIZE", default=4)
+HASHING_QUEUE_DEPTH = env.int("HASHING_QUEUE_DEPTH", default=64)
+IDENTITY_CACHE_SIZE = env.int("IDENTITY_CACHE_SIZE", default=1024)
+IDENTITY_CACHE_TTL = env.int("IDENTITY_CACHE_TTL", default=300)
+USER_DIRECTORY_PAGE_SIZE = env.int("USER_DIRECTORY_PAGE_SIZE", default=50)
+EXPORT_BATCH_SIZE = env.int("EXPORT_BATCH_SIZE", default=1000)
+UNIT_OF_WORK_REQUESTS = env.bool("UNIT_OF_WORK_REQUESTS", default=False)
+PAGE_CACHE_ENABLED = env.bool("PAGE_CACHE_ENABLED", default=True)
+PAGE_CACHE_MAX_BYTES = env.int("PAGE_CACHE_MAX_BYTES", default=16 * 1024 * 1024)
+PAGE_CACHE_TIMEOUT = env.int("PAGE_CACHE_TIMEOUT", default=300)
+CART_TIMEOUT = env.int("CART_TIMEOUT", default=7 * 24 * 3600)
+CART_MAX_LINES = env.int("CART_MAX_LINES", default=50)
+CART_MAX_QUANTITY = env.int("CART_MAX_QUANTITY", default=99)
+PROMO_INDEX_TTL = env.int("PROMO_INDEX_TTL", default=60)
+PROMO_COUNTER_TTL = env.int("PROMO_COUNTER_TTL", default=24 * 3600)
+POPULARITY_HALF_LIFE_DAYS = env.float("POPULARITY_HALF_LIFE_DAYS", default=7)
+POPULAR_ITEMS = env.int("POPULAR_ITEMS", default=3)
+RATINGS_BUFFER_SIZE = env.int("RATINGS_BUFFER_SIZE", default=500)
+RATINGS_FLUSH_INTERVAL = env.float("RATINGS_FLUSH_INTERVAL", default=5)
+RATINGS_MAX_PENDING = env.int("RATINGS_MAX_PENDING", default=10000)
+NEARBY_CELL_DEGREES = env.float("NEARBY_CELL_DEGREES", default=0.01)
+NEARBY_MAX_RESULTS = env.int("NEARBY_MAX_RESULTS", default=20)
+NEARBY_SYNC_INTERVAL = env.float("NEARBY_SYNC_INTERVAL", default=30)
+NEARBY_SYNC_OVERLAP = env.float("NEARBY_SYNC_OVERLAP", default=60)
+DISPATCH_INTERVAL = env.float("DISPATCH_INTERVAL", default=5)
+DISPATCH_BATCH_SIZE = env.int("DISPATCH_BATCH_SIZE", default=1000)
+DISPATCH_OPTIMAL_LIMIT = env.int("DISPATCH_OPTIMAL_LIMIT", default=300)
+DISPATCH_CANDIDATES = env.int("DISPATCH_CANDIDATES", default=8)
+DISPATCH_SPEED_KMH = env.float("DISPATCH_SPEED_KMH", default=15)
+DISPATCH_MAX_PICKUP_KM = env.float("DISPATCH_MAX_PICKUP_KM", default=5)
+DISPATCH_WAIT_WEIGHT = env.float("DISPATCH_WAIT_WEIGHT", default=1.0)
+CHECKOUT_POLL_INTERVAL = env.float("CHECKOUT_POLL_INTERVAL", default=0.5)
+CHECKOUT_MAX_ATTEMPTS = env.int("CHECKOUT_MAX_ATTEMPTS", default=5)
+CHECKOUT_RETRY_SECONDS = env.float("CHECKOUT_RETRY_SECONDS", default=5)
+INVENTORY_SHARDS = env.int("INVENTORY_SHARDS", default=8)
+INVENTORY_SOLD_OUT_TTL = env.int("INVENTORY_SOLD_OUT_TTL", default=300)
+ORDER_EVENTS_POLL_INTERVAL = env.float("ORDER_EVENTS_POLL_INTERVAL", default=1.0)
+ORDER_EVENTS_BUFFER = env.int("ORDER_EVENTS_BUFFER", default=16)
+ORDER_EVENTS_KEEPALIVE = env.float("ORDER_EVENTS_KEEPALIVE", default=15)
+ORDER_EVENTS_MAX_CLIENTS = env.int("ORDER_EVENTS_MAX_CLIENTS", default=10000)
+TEMPLATE_BYTECODE_CACHE_DIR = env.str(
+    "TEMPLATE_BYTECODE_CACHE_DIR",
+    default=os.path.join(tempfile.gettempdir(), "rype-jinja-cache"),
+)
+WARMUP_DB_CONNECTIONS = env.int("WARMUP_DB_CONNECTIONS", default=1)
+METRICS_ENABLED = env.bool("METRICS_ENABLED", default=True)
+METRICS_DIR = env.str(
+    "METRICS_DIR", default=os.path.join(tempfile.gettempdir(), "rype-metrics")
+)
+METRICS_FLUSH_INTERVAL = env.float("METRICS_FLUSH_INTERVAL", default=5)
+METRICS_SCRAPE_INTERVAL = env.float("METRICS_SCRAPE_INTERVAL", default=1)
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""Cache backend shared by every worker process on a host.
+
+Entries live in a memory-mapped file (``/dev/shm`` by default) that is split
+into fixed-size slots, so the cache never grows beyond the file it was created
+with. Slots are grouped into stripes, each guarded by an ``fcntl`` byte-range
+lock, which makes the cache safe to use from several processes at once without
+an external server. Select it with::
+
+    CACHE_TYPE = "app.sharedcache.shared_memory"
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+
+from flask_caching.backends.base import BaseCache
+
+_MAGIC = b"RYPECSH1"
+#: magic, slot count, slot size, stripe size
+_HEADER = struct.Struct("<8sIII")
+_HEADER_SIZE = 64
+#: key hash, expiry time (0 = never), last use, value length, key length
+_SLOT = struct.Struct("<QddIH")
+_PROBES = 16
+
+
+def _default_path():
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, "rype-cache")
+
+
+class SharedMemoryCache(BaseCache):
+    """Fixed-size, multi-process cache backed by a memory-mapped file.
+
+    :param path: File backing the cache. Processes using the same path share
+        the same entries.
+    :param slots: Number of entries the cache can hold.
+    :param slot_size: Bytes per entry, including the key and the pickled value.
+        Values that do not fit are not cached.
+    :param stripe_size: Slots per lock stripe.
+
+    Keys hash to a stripe and are probed within it; when no slot is free the
+    least recently used entry among the probed slots is evicted.
+    """
+
+    def __init__(
+        self,
+        path=None,
+        slots=8192,
+        slot_size=2048,
+        stripe_size=64,
+        default_timeout=300,
+        key_prefix="",
+    ):
+        """Create instance, creating or attaching to the backing file."""
+        super(SharedMemoryCache, self).__init__(default_timeout=default_timeout)
+        self.path = path or _default_path()
+        self.slots = slots
+        self.slot_size = slot_size
+        self.stripe_size = min(stripe_size, slots)
+        self.key_prefix = key_prefix
+        self._lock = threading.Lock()
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = _HEADER_SIZE + slots * slot_size
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+            self._mm = mmap.mmap(self._fd, size)
+            header = _HEADER.pack(_MAGIC, slots, slot_size, self.stripe_size)
+            if self._mm[: _HEADER.size] != header:
+                self._mm[:size] = bytes(size)
+                self._mm[: _HEADER.size] = header
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def _locked(self, stripe=None):
+        """Return a context manager holding the lock for ``stripe`` (all if None)."""
+        return _StripeLock(self, stripe)
+
+    def _hash(self, key):
+        digest = hashlib.blake2b(key, digest_size=8).digest()
+        return struct.unpack("<Q", digest)[0] | 1
+
+    def _offset(self, index):
+        return _HEADER_SIZE + index * self.slot_size
+
+    def _probe(self, key_hash):
+        stripes = self.slots // self.stripe_size
+        stripe = key_hash % stripes
+        start = stripe * self.stripe_size
+        first = (key_hash // stripes) % self.stripe_size
+        probes = min(_PROBES, self.stripe_size)
+        return stripe, [
+            start + (first + i) % self.stripe_size for i in range(probes)
+        ]
+
+    def _find(self, key, key_hash, indexes, now):
+        """Return ``(match, spare)`` slot indexes for ``key``.
+
+        ``match`` is the live slot holding ``key`` or None. ``spare`` is where a
+        new entry should go: a free or expired slot, else the least recently
+        used one.
+        """
+        spare = None
+        spare_used = float("inf")
+        for index in indexes:
+            offset = self._offset(index)
+            slot_hash, expires, used, _, key_len = _SLOT.unpack_from(self._mm, offset)
+            expired = slot_hash == 0 or (expires and expires <= now)
+            if slot_hash == key_hash and not expired:
+                key_start = offset + _SLOT.size
+                if self._mm[key_start : key_start + key_len] == key:
+                    return index, index
+            if expired:
+                used = -1.0
+            if used < spare_used:
+                spare, spare_used = index, used
+        return None, spare
+
+    def _read(self, index):
+        offset = self._offset(index)
+        _, expires, _, value_len, key_len = _SLOT.unpack_from(self._mm, offset)
+        start = offset + _SLOT.size + key_len
+        return expires, self._mm[start : start + value_len]
+
+    def _write(self, index, key, key_hash, expires, data, now):
+        offset = self._offset(index)
+        _SLOT.pack_into(self._mm, offset, key_hash, expires, now, len(data), len(key))
+        start = offset + _SLOT.size
+        self._mm[start : start + len(key)] = key
+        self._mm[start + len(key) : start + len(key) + len(data)] = data
+
+    def _touch(self, index, now):
+        struct.pack_into("<d", self._mm, self._offset(index) + 16, now)
+
+    def _expiry(self, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        return time.time() + timeout if timeout > 0 else 0.0
+
+    def _key(self, key):
+        return (self.key_prefix + key).encode("utf-8")
+
+    def get(self, key):
+        """Return the value for ``key`` or None."""
+        key = self._key(key)
+        key_hash = self._hash(key)
+        stripe, indexes = self._probe(key_hash)
+        now = time.time()
+        with self._locked(stripe):
+            match, _ = self._find(key, key_hash, indexes, now)
+            if match is None:
+                return None
+            self._touch(match, now)
+            _, data = self._read(match)
+        return pickle.loads(data)
+
+    def has(self, key):
+        """Return whether ``key`` is cached."""
+        key = self._key(key)
+        key_hash = self._hash(key)
+        stripe, indexes = self._probe(key_hash)
+        with self._locked(stripe):
+            match, _ = self._find(key, key_hash, indexes, time.time())
+        return match is not None
+
+    def set(self, key, value, timeout=None):
+        """Store ``value``; returns False if it is too large for a slot."""
+        return self._store(key, value, timeout, overwrite=True)
+
+    def add(self, key, value, timeout=None):
+        """Store ``value`` only if ``key`` is not cached yet."""
+        return self._store(key, value, timeout, overwrite=False)
+
+    def _store(self, key, value, timeout, overwrite):
+        key = self._key(key)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if _SLOT.size + len(key) + len(data) > self.slot_size:
+            return False
+        key_hash = self._hash(key)
+        stripe, indexes = self._probe(key_hash)
+        now = time.time()
+        with self._locked(stripe):
+            match, spare = self._find(key, key_hash, indexes, now)
+            if match is not None and not overwrite:
+                return False
+            self._write(spare, key, key_hash, self._expiry(timeout), data, now)
+        return True
+
+    def delete(self, key):
+        """Remove ``key``; returns whether it was cached."""
+        key = self._key(key)
+        key_hash = self._hash(key)
+        stripe, indexes = self._probe(key_hash)
+        with self._locked(stripe):
+            match, _ = self._find(key, key_hash, indexes, time.time())
+            if match is None:
+                return False
+            _SLOT.pack_into(self._mm, self._offset(match), 0, 0.0, 0.0, 0, 0)
+        return True
+
+    def inc(self, key, delta=1):
+        """Atomically add ``delta`` to an integer value; missing keys start at 0."""
+        key = self._key(key)
+        key_hash = self._hash(key)
+        stripe, indexes = self._probe(key_hash)
+        now = time.time()
+        with self._locked(stripe):
+            match, spare = self._find(key, key_hash, indexes, now)
+            if match is None:
+                value, expires = delta, self._expiry(None)
+            else:
+                expires, data = self._read(match)
+                value = pickle.loads(data) + delta
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            self._write(spare, key, key_hash, expires, data, now)
+        return value
+
+    def dec(self, key, delta=1):
+        """Atomically subtract ``delta`` from an integer value."""
+        return self.inc(key, -delta)
+
+    def clear(self):
+        """Remove every entry."""
+        with self._locked():
+            for index in range(self.slots):
+                _SLOT.pack_into(self._mm, self._offset(index), 0, 0.0, 0.0, 0, 0)
+        return True
+
+
+class _StripeLock(object):
+    """Hold the process-local lock and the ``fcntl`` lock of a stripe."""
+
+    def __init__(self, cache, stripe):
+        self.cache = cache
+        self.stripe = stripe
+
+    def __enter__(self):
+        self.cache._lock.acquire()
+        if self.stripe is None:
+            fcntl.lockf(self.cache._fd, fcntl.LOCK_EX)
+        else:
+            fcntl.lockf(self.cache._fd, fcntl.LOCK_EX, 1, self.stripe)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.stripe is None:
+            fcntl.lockf(self.cache._fd, fcntl.LOCK_UN)
+        else:
+            fcntl.lockf(self.cache._fd, fcntl.LOCK_UN, 1, self.stripe)
+        self.cache._lock.release()
+
+
+def shared_memory(app, config, args, kwargs):
+    """Flask-Caching factory for :class:`SharedMemoryCache`.
+
+    Reads ``CACHE_SHARED_PATH``, ``CACHE_SHARED_SLOTS`` and
+    ``CACHE_SHARED_SLOT_SIZE`` from the config.
+    """
+    kwargs.update(
+        path=config.get("CACHE_SHARED_PATH"),
+        slots=config.get("CACHE_SHARED_SLOTS", 8192),
+        slot_size=config.get("CACHE_SHARED_SLOT_SIZE", 2048),
+        key_prefix=config.get("CACHE_KEY_PREFIX") or "",
+    )
+    return SharedMemoryCache(*args, **kwargs)
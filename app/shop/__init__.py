@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+"""The shop module, including the menu, the cart and orders."""
+from . import views  # noqa
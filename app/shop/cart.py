@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""Server-side shopping cart.
+
+A cart is a handful of integer arrays (item IDs, quantities and unit prices in
+cents) plus running totals, stored under one cache key per visitor. Adding or
+changing a line adjusts the subtotal and discount by the difference instead of
+summing every line again, and nothing touches the database until checkout.
+Promo codes are priced from the in-memory index of :mod:`app.shop.promos`.
+An order is picked up at one restaurant, so a cart only holds items of one.
+"""
+import uuid
+from array import array
+
+from flask import current_app, session
+
+from app.database import db, unit_of_work
+from app.extensions import cache
+
+from . import inventory
+from .models import MenuItem, Order, OrderItem, order_placed
+from .promos import PromoError, promo_index, redeem
+
+SESSION_KEY = "cart_id"
+MIXED_RESTAURANTS = (
+    "Your cart has items from another restaurant, please order them separately"
+)
+
+
+class CartError(Exception):
+    """Raised when the cart cannot be changed or checked out as asked."""
+
+
+class Cart(object):
+    """A visitor's cart.
+
+    :param key: Cache key the cart is stored under.
+    """
+
+    def __init__(self, key):
+        """Create an empty cart."""
+        self.key = key
+        self.item_ids = array("i")
+        self.quantities = array("i")
+        self.prices = array("i")
+        self.subtotal = 0
+        self.discount = 0
+        self.promo_code = None
+        #: Restaurant of the items, if known
+        self.restaurant_id = None
+
+    @classmethod
+    def load(cls, key):
+        """Return the cart stored under ``key``, or an empty one."""
+        cart = cls(key)
+        state = cache.get(key)
+        if state is not None:
+            (
+                cart.item_ids,
+                cart.quantities,
+                cart.prices,
+                cart.subtotal,
+                cart.discount,
+                cart.promo_code,
+            ) = state[:6]
+            # Carts saved before the restaurant was stored are checked by reprice
+            cart.restaurant_id = state[6] if len(state) > 6 else None
+        return cart
+
+    def save(self):
+        """Store the cart.
+
+        :raises CartError: if the cart is too large for the cache.
+        """
+        state = (
+            self.item_ids,
+            self.quantities,
+            self.prices,
+            self.subtotal,
+            self.discount,
+            self.promo_code,
+            self.restaurant_id,
+        )
+        timeout = current_app.config["CART_TIMEOUT"]
+        if cache.set(self.key, state, timeout=timeout) is False:
+            raise CartError("Your cart is too large")
+
+    def clear(self):
+        """Forget the cart."""
+        cache.delete(self.key)
+        self.__init__(self.key)
+
+    @property
+    def total(self):
+        """Amount due in cents."""
+        return self.subtotal - self.discount
+
+    @property
+    def count(self):
+        """Number of units in the cart."""
+        return sum(self.quantities)
+
+    def __len__(self):
+        """Return the number of lines."""
+        return len(self.item_ids)
+
+    def add(self, item, quantity=1):
+        """Add ``quantity`` units of the :class:`MenuItem` ``item``."""
+        if inventory.is_sold_out(item.id):
+            raise CartError(f"Sorry, {item.name} is sold out")
+        if not len(self):
+            self.restaurant_id = item.restaurant_id
+        elif self.restaurant_id not in (None, item.restaurant_id):
+            raise CartError(MIXED_RESTAURANTS)
+        try:
+            index = self.item_ids.index(item.id)
+        except ValueError:
+            if len(self) >= current_app.config["CART_MAX_LINES"]:
+                raise CartError("Your cart is full")
+            self.item_ids.append(item.id)
+            self.quantities.append(0)
+            self.prices.append(item.price_cents)
+            index = len(self) - 1
+        self._set_quantity(index, self.quantities[index] + quantity)
+
+    def set_quantity(self, item_id, quantity):
+        """Change the quantity of a line; zero removes it."""
+        try:
+            index = self.item_ids.index(item_id)
+        except ValueError:
+            raise CartError("That item is not in your cart")
+        self._set_quantity(index, quantity)
+
+    def remove(self, item_id):
+        """Remove a line."""
+        self.set_quantity(item_id, 0)
+
+    def _set_quantity(self, index, quantity):
+        quantity = max(0, min(quantity, current_app.config["CART_MAX_QUANTITY"]))
+        self.subtotal += (quantity - self.quantities[index]) * self.prices[index]
+        if quantity:
+            self.quantities[index] = quantity
+        else:
+            del self.item_ids[index]
+            del self.quantities[index]
+            del self.prices[index]
+        self._update_discount()
+
+    @property
+    def promo(self):
+        """The :class:`~app.shop.promos.Promo` applied, if it is still active."""
+        return promo_index.get(self.promo_code)
+
+    def apply_promo(self, code):
+        """Apply a promo code.
+
+        :raises CartError: if the code is unknown or does not apply to the cart.
+        """
+        promo = promo_index.get(code)
+        if promo is None:
+            raise CartError("Unknown promo code")
+        reason = promo.check(self)
+        if reason is not None:
+            raise CartError(reason)
+        self.promo_code = promo.code
+        self.discount = promo.discount(self)
+
+    def remove_promo(self):
+        """Drop the promo code."""
+        self.promo_code = None
+        self.discount = 0
+
+    def _update_discount(self):
+        """Recompute the discount from the running subtotal."""
+        promo = self.promo if self.promo_code else None
+        self.discount = promo.discount(self) if promo is not None else 0
+
+    def lines(self):
+        """Return ``(MenuItem, quantity, line total)`` tuples, in one query."""
+        if not self.item_ids:
+            return []
+        items = {
+            item.id: item
+            for item in MenuItem.query.filter(MenuItem.id.in_(list(self.item_ids)))
+        }
+        return [
+            (items[item_id], quantity, quantity * price)
+            for item_id, quantity, price in zip(
+                self.item_ids, self.quantities, self.prices
+            )
+            if item_id in items
+        ]
+
+    def to_dict(self):
+        """Return the cart as JSON-serializable data, see :meth:`from_dict`."""
+        return {
+            "key": self.key,
+            "lines": [
+                [item_id, quantity, price]
+                for item_id, quantity, price in zip(
+                    self.item_ids, self.quantities, self.prices
+                )
+            ],
+            "subtotal": self.subtotal,
+            "discount": self.discount,
+            "promo_code": self.promo_code,
+            "restaurant_id": self.restaurant_id,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Return a cart from the output of :meth:`to_dict`."""
+        cart = cls(data["key"])
+        for item_id, quantity, price in data["lines"]:
+            cart.item_ids.append(item_id)
+            cart.quantities.append(quantity)
+            cart.prices.append(price)
+        cart.subtotal = data["subtotal"]
+        cart.discount = data["discount"]
+        cart.promo_code = data["promo_code"]
+        cart.restaurant_id = data.get("restaurant_id")
+        return cart
+
+    def reprice(self):
+        """Check the cart against the menu.
+
+        If an item was withdrawn or repriced, or the promo code can no longer be
+        used, the cart is updated and saved, and :class:`CartError` is raised so
+        the visitor can review it, as it is for items of several restaurants.
+        Returns the restaurant ID of each item.
+        """
+        if not self.item_ids:
+            raise CartError("Your cart is empty")
+        rows = db.session.query(
+            MenuItem.id, MenuItem.price_cents, MenuItem.restaurant_id
+        ).filter(MenuItem.id.in_(list(self.item_ids)), MenuItem.active.is_(True))
+        current = {}
+        restaurants = {}
+        for item_id, price, restaurant_id in rows:
+            current[item_id] = price
+            restaurants[item_id] = restaurant_id
+        changed = False
+        for index in reversed(range(len(self))):
+            price = current.get(self.item_ids[index])
+            if price is None:
+                self._set_quantity(index, 0)
+                changed = True
+            elif price != self.prices[index]:
+                self.subtotal += (price - self.prices[index]) * self.quantities[index]
+                self.prices[index] = price
+                changed = True
+        if self.promo_code and self._promo_changed():
+            changed = True
+        if changed:
+            self._update_discount()
+            self.save()
+            raise CartError("Your cart changed, please review it")
+        if len({restaurants[item_id] for item_id in self.item_ids}) > 1:
+            raise CartError(MIXED_RESTAURANTS)
+        return restaurants
+
+    def _promo_changed(self):
+        """Drop the promo code if it can no longer be used.
+
+        Returns whether that or the cart changes the discount.
+        """
+        promo = self.promo
+        if promo is None or promo.check(self) is not None:
+            self.remove_promo()
+            return True
+        return promo.discount(self) != self.discount
+
+    def place_order(self, user_id, status="placed"):
+        """Reprice the cart and add it to the session as an :class:`Order`.
+
+        Nothing is committed; call it inside a unit of work, which also gives
+        back the use of the promo code if it rolls back. Orders are dispatched
+        once their ``status`` is ``"placed"``.
+        """
+        restaurants = self.reprice()
+        order = Order(
+            user_id=user_id,
+            status=status,
+            restaurant_id=restaurants[self.item_ids[0]],
+            subtotal_cents=self.subtotal,
+            discount_cents=self.discount,
+            total_cents=self.total,
+            promo_code=self.promo_code,
+        )
+        order.items = [
+            OrderItem(menu_item_id=item_id, quantity=quantity, unit_price_cents=price)
+            for item_id, quantity, price in zip(
+                self.item_ids, self.quantities, self.prices
+            )
+        ]
+        if self.promo_code:
+            try:
+                redeem(self.promo, user_id, order)
+            except PromoError as error:
+                raise CartError(str(error))
+        order.save()
+        return order
+
+    def checkout(self, user_id):
+        """Write the cart to the database as an :class:`Order` and empty it.
+
+        :raises CartError: if the cart is empty or changed, see :meth:`reprice`.
+        """
+        with unit_of_work():
+            order = self.place_order(user_id)
+        self.clear()
+        order_placed.send(order)
+        return order
+
+
+def init_cart(app):
+    """Set the cart defaults on ``app``."""
+    app.config.setdefault("CART_TIMEOUT", 7 * 24 * 3600)
+    app.config.setdefault("CART_MAX_LINES", 50)
+    app.config.setdefault("CART_MAX_QUANTITY", 99)
+    return None
+
+
+def current_cart():
+    """Return the cart of the current visitor."""
+    cart_id = session.get(SESSION_KEY)
+    if cart_id is None:
+        cart_id = session[SESSION_KEY] = uuid.uuid4().hex
+    return Cart.load(f"cart:{cart_id}")
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""Batched dispatch of placed orders to available couriers.
+
+Every ``DISPATCH_INTERVAL`` seconds the dispatcher takes up to
+``DISPATCH_BATCH_SIZE`` of the oldest placed orders and every available courier
+with a known location, computes the matrix of pickup ETAs in one vectorized
+pass and solves the assignment for the whole batch at once. Matching the batch
+as a whole gives shorter pickups overall than handing each order to the nearest
+free courier in turn.
+
+Batches with at most ``DISPATCH_OPTIMAL_LIMIT`` orders and couriers are solved
+optimally, with SciPy when it is installed and with :func:`hungarian`
+otherwise. Larger batches are matched greedily over each order's
+``DISPATCH_CANDIDATES`` closest couriers. Orders waiting longer are favoured by
+``DISPATCH_WAIT_WEIGHT`` minutes of ETA per minute waited, and couriers farther
+than ``DISPATCH_MAX_PICKUP_KM`` are never assigned.
+
+The dispatcher runs in its own process, see ``flask dispatch``.
+"""
+import datetime as dt
+import time
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import bindparam, exc
+
+from app.database import db
+
+from .models import Courier, Order, Restaurant
+from .nearby import haversine_km
+from .status import record_bulk
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # pragma: no cover
+    linear_sum_assignment = None
+
+#: Cost of a pair that must not be assigned
+INFEASIBLE = 1e9
+
+
+def eta_minutes(order_lats, order_lons, courier_lats, courier_lons, speed_kmh):
+    """Return the orders x couriers matrix of pickup distances and ETAs."""
+    distances = haversine_km(
+        np.asarray(order_lats)[:, np.newaxis],
+        np.asarray(order_lons)[:, np.newaxis],
+        np.asarray(courier_lats)[np.newaxis, :],
+        np.asarray(courier_lons)[np.newaxis, :],
+    )
+    return distances, distances / speed_kmh * 60
+
+
+def hungarian(cost):
+    """Solve the rectangular assignment problem optimally in O(n²m).
+
+    Returns the assigned ``(rows, cols)`` ordered by row, like SciPy's
+    ``linear_sum_assignment``. The inner loop over columns is vectorized.
+    """
+    cost = np.asarray(cost, dtype=float)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    # Row and column potentials, and the row matched to each column; index 0
+    # is a virtual column holding the row being added.
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    match = np.zeros(m + 1, dtype=int)
+    way = np.zeros(m + 1, dtype=int)
+    for row in range(1, n + 1):
+        match[0] = row
+        column = 0
+        min_slack = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while match[column] != 0:
+            used[column] = True
+            current = match[column]
+            free = ~used[1:]
+            slack = cost[current - 1] - u[current] - v[1:]
+            better = free & (slack < min_slack[1:])
+            min_slack[1:][better] = slack[better]
+            way[1:][better] = column
+            candidates = np.where(free, min_slack[1:], np.inf)
+            nearest = int(np.argmin(candidates)) + 1
+            delta = candidates[nearest - 1]
+            used_columns = np.flatnonzero(used)
+            u[match[used_columns]] += delta
+            v[used_columns] -= delta
+            min_slack[1:][free] -= delta
+            column = nearest
+        while column:
+            previous = way[column]
+            match[column] = match[previous]
+            column = previous
+    cols = np.flatnonzero(match[1:])
+    rows = match[1:][cols] - 1
+    if transposed:
+        rows, cols = cols, rows
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+
+def greedy(cost, candidates):
+    """Match rows to columns cheapest pair first, over each row's nearest columns.
+
+    Only ``candidates`` columns per row are considered, which bounds the work
+    to sorting ``rows * candidates`` pairs. Rows whose candidates were all
+    taken are then matched among the columns left over.
+    """
+    n, m = cost.shape
+    k = min(candidates, m)
+    if k < m:
+        columns = np.argpartition(cost, k - 1, axis=1)[:, :k]
+    else:
+        columns = np.broadcast_to(np.arange(m), (n, m))
+    rows = np.repeat(np.arange(n), k)
+    columns = columns.ravel()
+    cheapest = np.argsort(cost[rows, columns], kind="stable")
+    row_used = np.zeros(n, dtype=bool)
+    column_used = np.zeros(m, dtype=bool)
+    assigned = []
+    for row, column in zip(rows[cheapest].tolist(), columns[cheapest].tolist()):
+        if row_used[row] or column_used[column]:
+            continue
+        row_used[row] = column_used[column] = True
+        assigned.append((row, column))
+        if len(assigned) == min(n, m):
+            break
+    if len(assigned) < min(n, m):
+        rest_rows = np.flatnonzero(~row_used)
+        rest_columns = np.flatnonzero(~column_used)
+        rows, columns = greedy(cost[np.ix_(rest_rows, rest_columns)], len(rest_columns))
+        assigned.extend(zip(rest_rows[rows].tolist(), rest_columns[columns].tolist()))
+    assigned.sort()
+    pairs = np.array(assigned, dtype=int).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def solve(cost, optimal_limit, candidates):
+    """Assign with the best method for the size of ``cost``; returns the solver name."""
+    if max(cost.shape) <= optimal_limit:
+        if linear_sum_assignment is not None:
+            rows, cols = linear_sum_assignment(cost)
+            return rows, cols, "scipy"
+        rows, cols = hungarian(cost)
+        return rows, cols, "hungarian"
+    rows, cols = greedy(cost, candidates)
+    return rows, cols, "greedy"
+
+
+class Dispatcher(object):
+    """Assigns placed orders to couriers in batches."""
+
+    def __init__(self, app=None):
+        """Create instance."""
+        self.batches = 0
+        self.dispatched = 0
+        self.last_solver = None
+        self.last_seconds = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Set the dispatch defaults on ``app``."""
+        app.config.setdefault("DISPATCH_INTERVAL", 5)
+        app.config.setdefault("DISPATCH_BATCH_SIZE", 1000)
+        app.config.setdefault("DISPATCH_OPTIMAL_LIMIT", 300)
+        app.config.setdefault("DISPATCH_CANDIDATES", 8)
+        app.config.setdefault("DISPATCH_SPEED_KMH", 15)
+        app.config.setdefault("DISPATCH_MAX_PICKUP_KM", 5)
+        app.config.setdefault("DISPATCH_WAIT_WEIGHT", 1.0)
+        app.extensions["dispatcher"] = self
+
+    def run_once(self, now=None):
+        """Dispatch one batch; returns the number of orders assigned."""
+        config = current_app.config
+        now = now or dt.datetime.utcnow()
+        started = time.perf_counter()
+        orders = (
+            db.session.query(
+                Order.id, Order.created_at, Restaurant.latitude, Restaurant.longitude
+            )
+            .join(Restaurant, Order.restaurant_id == Restaurant.id)
+            .filter(
+                Order.status == "placed",
+                Order.courier_id.is_(None),
+                Restaurant.latitude.isnot(None),
+                Restaurant.longitude.isnot(None),
+            )
+            .order_by(Order.created_at)
+            .limit(config["DISPATCH_BATCH_SIZE"])
+            .with_for_update(of=Order, skip_locked=True)
+            .all()
+        )
+        couriers = (
+            db.session.query(Courier.id, Courier.latitude, Courier.longitude)
+            .filter(
+                Courier.active.is_(True),
+                Courier.available.is_(True),
+                Courier.latitude.isnot(None),
+                Courier.longitude.isnot(None),
+            )
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        if not orders or not couriers:
+            db.session.commit()
+            return 0
+
+        order_ids = np.array([order[0] for order in orders])
+        waited = np.array(
+            [(now - order[1]).total_seconds() / 60 for order in orders]
+        )
+        pickups = np.array([order[2:] for order in orders], dtype=float)
+        couriers = np.array(couriers, dtype=float)
+        distances, cost = eta_minutes(
+            pickups[:, 0],
+            pickups[:, 1],
+            couriers[:, 1],
+            couriers[:, 2],
+            config["DISPATCH_SPEED_KMH"],
+        )
+        cost -= config["DISPATCH_WAIT_WEIGHT"] * waited[:, np.newaxis]
+        cost[distances > config["DISPATCH_MAX_PICKUP_KM"]] = INFEASIBLE
+        rows, cols, self.last_solver = solve(
+            cost, config["DISPATCH_OPTIMAL_LIMIT"], config["DISPATCH_CANDIDATES"]
+        )
+        feasible = cost[rows, cols] < INFEASIBLE
+        rows, cols = rows[feasible], cols[feasible]
+
+        assignments = [
+            {"order_id": int(order_id), "courier_id": int(courier_id)}
+            for order_id, courier_id in zip(
+                order_ids[rows].tolist(), couriers[cols, 0].tolist()
+            )
+        ]
+        if assignments:
+            _assign(assignments, now)
+        db.session.commit()
+        self.batches += 1
+        self.dispatched += len(assignments)
+        self.last_seconds = time.perf_counter() - started
+        return len(assignments)
+
+    def run(self):
+        """Dispatch a batch every ``DISPATCH_INTERVAL`` seconds, forever."""
+        interval = current_app.config["DISPATCH_INTERVAL"]
+        while True:
+            started = time.monotonic()
+            try:
+                count = self.run_once()
+            except exc.SQLAlchemyError:
+                db.session.rollback()
+                current_app.logger.exception("Dispatch failed, will retry")
+            else:
+                if count:
+                    current_app.logger.info(
+                        f"Dispatched {count} orders with {self.last_solver} "
+                        f"in {self.last_seconds:.3f}s"
+                    )
+            db.session.remove()
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+    def stats(self):
+        """Return the batch and order counters."""
+        return {"batches": self.batches, "dispatched": self.dispatched}
+
+
+def _assign(assignments, now):
+    orders = Order.__table__
+    couriers = Courier.__table__
+    db.session.execute(
+        orders.update()
+        .where(orders.c.id == bindparam("order_id"))
+        .values(
+            courier_id=bindparam("courier_id"), status="dispatched", dispatched_at=now
+        ),
+        assignments,
+    )
+    record_bulk([row["order_id"] for row in assignments], "dispatched", now)
+    db.session.execute(
+        couriers.update()
+        .where(couriers.c.id.in_([row["courier_id"] for row in assignments]))
+        .values(available=False)
+    )
+
+
+def complete_delivery(order):
+    """Mark ``order`` delivered and free its courier for the next batch."""
+    order.status = "delivered"
+    if order.courier is not None:
+        order.courier.available = True
+    db.session.commit()
+
+
+dispatcher = Dispatcher()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Shop forms."""
+import uuid
+
+from flask_wtf import FlaskForm
+from wtforms import HiddenField, IntegerField, StringField
+from wtforms.validators import DataRequired, InputRequired, Length, NumberRange
+from wtforms.widgets import HiddenInput
+
+
+class CartItemForm(FlaskForm):
+    """Add an item to the cart or change its quantity."""
+
+    item_id = IntegerField("Item", widget=HiddenInput(), validators=[DataRequired()])
+    quantity = IntegerField(
+        "Quantity", default=1, validators=[InputRequired(), NumberRange(min=0, max=99)]
+    )
+
+
+class PromoForm(FlaskForm):
+    """Apply a promo code to the cart."""
+
+    code = StringField("Promo code", validators=[DataRequired(), Length(max=40)])
+
+
+class CheckoutForm(FlaskForm):
+    """Place the order in the cart."""
+
+    #: Identifies this checkout so that submitting it twice places one order
+    key = HiddenField(
+        "Key",
+        default=lambda: uuid.uuid4().hex,
+        validators=[DataRequired(), Length(max=64)],
+    )
+
+
+class RatingForm(FlaskForm):
+    """Rate a menu item or a delivery of an order."""
+
+    order_id = IntegerField("Order", widget=HiddenInput(), validators=[DataRequired()])
+    subject_id = IntegerField(
+        "Subject", widget=HiddenInput(), validators=[DataRequired()]
+    )
+    stars = IntegerField("Stars", validators=[InputRequired(), NumberRange(1, 5)])
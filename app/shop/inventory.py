@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""Menu item stock, split over shard rows.
+
+The units of a stock tracked item are spread over ``INVENTORY_SHARDS`` rows of
+``stock_shards``. A checkout takes its units from one shard that has enough of
+them and that no other transaction holds (``FOR UPDATE SKIP LOCKED``), so
+concurrent checkouts of a popular item decrement different rows instead of
+queueing on one. Only when no single free shard can serve the order are all of
+the item's shards locked, in order, and drained in turn.
+
+An item found without enough units is flagged in the shared ``cache`` for
+``INVENTORY_SOLD_OUT_TTL`` seconds once the transaction commits, which lets
+menus and carts show it as sold out without a query. Setting the stock clears
+the flag. Items without shards are not tracked and never sell out.
+"""
+import random
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import bindparam, event, func
+from sqlalchemy.orm import Session
+
+from app.database import db
+from app.extensions import cache
+
+from .models import StockShard
+
+_SOLD_OUT_KEY = "inventory_sold_out"
+
+
+class SoldOut(Exception):
+    """Raised when fewer units of an item are left than were asked for."""
+
+    def __init__(self, item_id, available):
+        """Create instance."""
+        super().__init__(f"Only {available} units of item {item_id} left")
+        self.item_id = item_id
+        self.available = available
+
+
+def init_inventory(app):
+    """Set the inventory defaults on ``app``."""
+    app.config.setdefault("INVENTORY_SHARDS", 8)
+    app.config.setdefault("INVENTORY_SOLD_OUT_TTL", 300)
+    return None
+
+
+def _sold_out_key(item_id):
+    return f"sold-out:{item_id}"
+
+
+def sold_out(item_ids):
+    """Return the IDs among ``item_ids`` that are known to be sold out."""
+    item_ids = list(item_ids)
+    if not item_ids:
+        return set()
+    flags = cache.get_many(*[_sold_out_key(item_id) for item_id in item_ids])
+    return {item_id for item_id, flag in zip(item_ids, flags) if flag}
+
+
+def is_sold_out(item_id):
+    """Return whether the item is known to be sold out."""
+    return bool(cache.get(_sold_out_key(item_id)))
+
+
+def _split(quantity, shards):
+    share, extra = divmod(quantity, shards)
+    return [share + (1 if shard < extra else 0) for shard in range(shards)]
+
+
+def set_stock(item_id, quantity, shards=None):
+    """Replace the stock of an item with ``quantity`` units over ``shards`` rows.
+
+    Nothing is committed. Use :func:`untrack` to stop tracking the item.
+    """
+    shards = shards or current_app.config["INVENTORY_SHARDS"]
+    StockShard.query.filter_by(menu_item_id=item_id).delete(synchronize_session=False)
+    db.session.add_all(
+        StockShard(menu_item_id=item_id, shard=shard, quantity=units)
+        for shard, units in enumerate(_split(quantity, shards))
+    )
+    cache.delete(_sold_out_key(item_id))
+
+
+def untrack(item_id):
+    """Stop tracking the stock of an item. Nothing is committed."""
+    StockShard.query.filter_by(menu_item_id=item_id).delete(synchronize_session=False)
+    cache.delete(_sold_out_key(item_id))
+
+
+def stock_levels(item_ids):
+    """Return the units left of each tracked item among ``item_ids``."""
+    rows = (
+        db.session.query(StockShard.menu_item_id, func.sum(StockShard.quantity))
+        .filter(StockShard.menu_item_id.in_(list(item_ids)))
+        .group_by(StockShard.menu_item_id)
+    )
+    return {item_id: int(units) for item_id, units in rows}
+
+
+def _merge(lines):
+    """Sum ``(item_id, quantity)`` lines per item, in item order."""
+    merged = {}
+    for item_id, quantity in lines:
+        merged[item_id] = merged.get(item_id, 0) + quantity
+    return OrderedDict(
+        (item_id, merged[item_id]) for item_id in sorted(merged) if merged[item_id] > 0
+    )
+
+
+def _tracked(item_ids):
+    rows = (
+        db.session.query(StockShard.menu_item_id)
+        .filter(StockShard.menu_item_id.in_(item_ids))
+        .distinct()
+    )
+    return {item_id for item_id, in rows}
+
+
+def _adjust(changes, sign):
+    """Apply ``(shard id, units)`` changes, taking (-1) or giving back (+1)."""
+    if not changes:
+        return
+    shards = StockShard.__table__
+    db.session.execute(
+        shards.update()
+        .where(shards.c.id == bindparam("shard_id"))
+        .values(quantity=shards.c.quantity + sign * bindparam("units")),
+        [{"shard_id": shard_id, "units": units} for shard_id, units in changes],
+    )
+
+
+def _take(item_id, quantity, drained):
+    """Return the ``(shard id, units)`` to take ``quantity`` units of an item.
+
+    Adds the item to ``drained`` if that takes its last units.
+    """
+    shard_id = (
+        db.session.query(StockShard.id)
+        .filter(StockShard.menu_item_id == item_id, StockShard.quantity >= quantity)
+        .order_by(func.random())
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar()
+    )
+    if shard_id is not None:
+        return [(shard_id, quantity)]
+    # No free shard has enough on its own: wait for all of them.
+    rows = (
+        db.session.query(StockShard.id, StockShard.quantity)
+        .filter(StockShard.menu_item_id == item_id)
+        .order_by(StockShard.shard)
+        .with_for_update()
+        .all()
+    )
+    available = sum(units for _, units in rows)
+    if available < quantity:
+        raise SoldOut(item_id, available)
+    if available == quantity:
+        drained.add(item_id)
+    changes = []
+    for shard_id, units in rows:
+        units = min(units, quantity)
+        if units:
+            changes.append((shard_id, units))
+            quantity -= units
+        if not quantity:
+            break
+    return changes
+
+
+def reserve(lines):
+    """Take stock for ``(item_id, quantity)`` lines.
+
+    Untracked items are skipped. Nothing is committed, and rolling back returns
+    the units; :func:`release` returns them after a commit.
+
+    :raises SoldOut: if an item does not have enough units left, in which case
+        nothing was taken.
+    """
+    lines = _merge(lines)
+    tracked = _tracked(list(lines)) if lines else set()
+    taken = []
+    drained = set()
+    try:
+        for item_id, quantity in lines.items():
+            if item_id in tracked:
+                changes = _take(item_id, quantity, drained)
+                _adjust(changes, -1)
+                taken.extend(changes)
+    except SoldOut as error:
+        _adjust(taken, +1)
+        drained = {error.item_id}
+        raise
+    finally:
+        db.session.info.setdefault(_SOLD_OUT_KEY, set()).update(drained)
+
+
+def release(lines):
+    """Return the units of ``(item_id, quantity)`` lines to stock.
+
+    Each item's units go back to one of its shards at random. Nothing is
+    committed.
+    """
+    lines = _merge(lines)
+    if not lines:
+        return
+    shards = {}
+    rows = db.session.query(StockShard.menu_item_id, StockShard.id).filter(
+        StockShard.menu_item_id.in_(list(lines))
+    )
+    for item_id, shard_id in rows:
+        shards.setdefault(item_id, []).append(shard_id)
+    _adjust(
+        [
+            (random.choice(shards[item_id]), quantity)
+            for item_id, quantity in lines.items()
+            if item_id in shards
+        ],
+        +1,
+    )
+    for item_id in shards:
+        cache.delete(_sold_out_key(item_id))
+
+
+@event.listens_for(Session, "after_commit")
+def _flag_sold_out(session):
+    item_ids = session.info.pop(_SOLD_OUT_KEY, None)
+    if item_ids:
+        timeout = current_app.config["INVENTORY_SOLD_OUT_TTL"]
+        cache.set_many(
+            {_sold_out_key(item_id): True for item_id in item_ids}, timeout=timeout
+        )
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_sold_out(session):
+    session.info.pop(_SOLD_OUT_KEY, None)
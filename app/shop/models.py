@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""Shop models."""
+import datetime as dt
+
+from flask.signals import Namespace
+
+from app.database import (
+    Column,
+    Model,
+    SurrogatePK,
+    db,
+    reference_col,
+    relationship,
+)
+
+_signals = Namespace()
+
+#: Sent with ``sender=<Order>`` once an order has been committed.
+order_placed = _signals.signal("order-placed")
+
+
+class Restaurant(SurrogatePK, Model):
+    """A restaurant on the menu."""
+
+    __tablename__ = "restaurants"
+    name = Column(db.String(80), nullable=False)
+    address = Column(db.String(255), nullable=True)
+    is_open = Column(db.Boolean(), default=True)
+    latitude = Column(db.Float, nullable=True)
+    longitude = Column(db.Float, nullable=True)
+    #: Lets :mod:`app.shop.nearby` load only the rows changed since its last sync
+    updated_at = Column(
+        db.DateTime,
+        nullable=False,
+        default=dt.datetime.utcnow,
+        onupdate=dt.datetime.utcnow,
+        index=True,
+    )
+    menu_items = relationship("MenuItem", backref="restaurant")
+
+    def __init__(self, name, **kwargs):
+        """Create instance."""
+        db.Model.__init__(self, name=name, **kwargs)
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<Restaurant({self.name!r})>"
+
+
+class MenuItem(SurrogatePK, Model):
+    """A dish that can be ordered."""
+
+    __tablename__ = "menu_items"
+    name = Column(db.String(80), nullable=False)
+    description = Column(db.String(255), nullable=True)
+    image_url = Column(db.String(255), nullable=True)
+    #: Price in cents
+    price_cents = Column(db.Integer, nullable=False)
+    active = Column(db.Boolean(), default=True)
+    restaurant_id = reference_col("restaurants", nullable=True)
+    #: Forward-decayed order count, see :mod:`app.shop.popularity`
+    popularity = Column(db.Float, nullable=False, default=0.0, index=True)
+
+    def __init__(self, name, price_cents, **kwargs):
+        """Create instance."""
+        db.Model.__init__(self, name=name, price_cents=price_cents, **kwargs)
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<MenuItem({self.name!r})>"
+
+
+class PopularityEpoch(Model):
+    """The one time that menu item popularity scores are weighted against."""
+
+    __tablename__ = "popularity_epoch"
+    id = Column(db.Integer, primary_key=True, autoincrement=False)
+    epoch = Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<PopularityEpoch({self.epoch!r})>"
+
+
+class StockShard(SurrogatePK, Model):
+    """Part of the units of a menu item left in stock.
+
+    An item's stock is split over several rows so that concurrent checkouts
+    decrement different rows, see :mod:`app.shop.inventory`. Items without
+    shards are not stock tracked.
+    """
+
+    __tablename__ = "stock_shards"
+    __table_args__ = (db.UniqueConstraint("menu_item_id", "shard"),)
+    menu_item_id = reference_col("menu_items")
+    shard = Column(db.Integer, nullable=False)
+    quantity = Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<StockShard({self.menu_item_id!r}#{self.shard!r}: {self.quantity!r})>"
+
+
+class Courier(SurrogatePK, Model):
+    """A courier delivering orders."""
+
+    __tablename__ = "couriers"
+    name = Column(db.String(80), nullable=False)
+    active = Column(db.Boolean(), default=True)
+    #: Free to take an order, see :mod:`app.shop.dispatch`
+    available = Column(db.Boolean(), nullable=False, default=True)
+    latitude = Column(db.Float, nullable=True)
+    longitude = Column(db.Float, nullable=True)
+
+    def __init__(self, name, **kwargs):
+        """Create instance."""
+        db.Model.__init__(self, name=name, **kwargs)
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<Courier({self.name!r})>"
+
+
+class Order(SurrogatePK, Model):
+    """A placed order. Amounts are in cents."""
+
+    __tablename__ = "orders"
+    user_id = reference_col("users")
+    user = relationship("User")
+    courier_id = reference_col("couriers", nullable=True)
+    courier = relationship("Courier")
+    #: Where the order is picked up
+    restaurant_id = reference_col("restaurants", nullable=True)
+    status = Column(db.String(20), nullable=False, default="placed", index=True)
+    subtotal_cents = Column(db.Integer, nullable=False)
+    discount_cents = Column(db.Integer, nullable=False, default=0)
+    total_cents = Column(db.Integer, nullable=False)
+    promo_code = Column(db.String(40), nullable=True)
+    created_at = Column(db.DateTime, nullable=False, default=dt.datetime.utcnow)
+    dispatched_at = Column(db.DateTime, nullable=True)
+    paid_at = Column(db.DateTime, nullable=True)
+    items = relationship("OrderItem", backref="order")
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<Order({self.id!r})>"
+
+
+class OrderEvent(SurrogatePK, Model):
+    """A change of an order's status, streamed to its customer.
+
+    Rows are only appended, see :mod:`app.shop.status`.
+    """
+
+    __tablename__ = "order_events"
+    #: Lets a reconnecting client fetch the events it missed
+    __table_args__ = (db.Index("ix_order_events_user_id", "user_id", "id"),)
+    order_id = reference_col("orders")
+    user_id = reference_col("users")
+    status = Column(db.String(20), nullable=False)
+    created_at = Column(db.DateTime, nullable=False, default=dt.datetime.utcnow)
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<OrderEvent({self.order_id!r}: {self.status!r})>"
+
+
+class OrderIntent(SurrogatePK, Model):
+    """A submitted checkout, worked through its states by :mod:`app.shop.pipeline`.
+
+    ``key`` is chosen by the client, so submitting the same checkout twice
+    returns the first intent instead of placing a second order.
+    """
+
+    __tablename__ = "order_intents"
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "key"),
+        db.Index("ix_order_intents_queue", "status", "run_after"),
+    )
+    key = Column(db.String(64), nullable=False)
+    user_id = reference_col("users")
+    #: Snapshot of the cart, see :meth:`app.shop.cart.Cart.to_dict`
+    cart = Column(db.JSON, nullable=False)
+    status = Column(db.String(20), nullable=False, default="pending")
+    error = Column(db.String(255), nullable=True)
+    attempts = Column(db.Integer, nullable=False, default=0)
+    #: Not picked up again before this time after a failed attempt
+    run_after = Column(db.DateTime, nullable=False, default=dt.datetime.utcnow)
+    order_id = reference_col("orders", nullable=True)
+    order = relationship("Order")
+    created_at = Column(db.DateTime, nullable=False, default=dt.datetime.utcnow)
+    updated_at = Column(
+        db.DateTime,
+        nullable=False,
+        default=dt.datetime.utcnow,
+        onupdate=dt.datetime.utcnow,
+    )
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<OrderIntent({self.key!r} {self.status})>"
+
+
+class OrderItem(SurrogatePK, Model):
+    """A line of an order, priced when the order was placed."""
+
+    __tablename__ = "order_items"
+    order_id = reference_col("orders")
+    menu_item_id = reference_col("menu_items")
+    menu_item = relationship("MenuItem")
+    quantity = Column(db.Integer, nullable=False)
+    unit_price_cents = Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<OrderItem({self.menu_item_id!r} x {self.quantity!r})>"
+
+
+class PromoCode(SurrogatePK, Model):
+    """A promo code and the rules for using it.
+
+    Codes are looked up through :mod:`app.shop.promos`, which keeps the active
+    ones in memory.
+    """
+
+    __tablename__ = "promo_codes"
+    code = Column(db.String(40), unique=True, nullable=False)
+    #: ``"percent"`` or ``"fixed"``
+    kind = Column(db.String(10), nullable=False)
+    #: Percent off, or cents off
+    value = Column(db.Integer, nullable=False)
+    min_subtotal_cents = Column(db.Integer, nullable=False, default=0)
+    #: Only discount this item, or the items of this restaurant
+    menu_item_id = reference_col("menu_items", nullable=True)
+    restaurant_id = reference_col("restaurants", nullable=True)
+    starts_at = Column(db.DateTime, nullable=True)
+    expires_at = Column(db.DateTime, nullable=True)
+    max_uses = Column(db.Integer, nullable=True)
+    max_uses_per_user = Column(db.Integer, nullable=True)
+    active = Column(db.Boolean(), nullable=False, default=True)
+
+    def __init__(self, code, kind, value, **kwargs):
+        """Create instance."""
+        db.Model.__init__(self, code=code, kind=kind, value=value, **kwargs)
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<PromoCode({self.code!r})>"
+
+
+class PromoRedemption(SurrogatePK, Model):
+    """One use of a promo code by an order."""
+
+    __tablename__ = "promo_redemptions"
+    __table_args__ = (db.Index("ix_promo_redemptions_user", "promo_id", "user_id"),)
+    promo_id = reference_col("promo_codes")
+    user_id = reference_col("users")
+    order_id = reference_col("orders")
+    order = relationship("Order")
+    created_at = Column(db.DateTime, nullable=False, default=dt.datetime.utcnow)
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<PromoRedemption({self.promo_id!r} by {self.user_id!r})>"
+
+
+class Rating(SurrogatePK, Model):
+    """A star rating of a menu item or of a courier's delivery.
+
+    Ratings are written in batches by :mod:`app.shop.ratings`, which also keeps
+    :class:`RatingAggregate` up to date.
+    """
+
+    __tablename__ = "ratings"
+    #: One rating per item or courier of an order, see :func:`ratings._write`
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "order_id", "kind", "subject_id"),
+    )
+    #: ``"item"`` or ``"courier"``
+    kind = Column(db.String(10), nullable=False)
+    subject_id = Column(db.Integer, nullable=False)
+    user_id = reference_col("users")
+    order_id = reference_col("orders", nullable=True)
+    stars = Column(db.SmallInteger, nullable=False)
+    created_at = Column(db.DateTime, nullable=False, default=dt.datetime.utcnow)
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<Rating({self.kind} {self.subject_id!r}: {self.stars!r})>"
+
+
+class RatingAggregate(Model):
+    """Running count, sum and histogram of the ratings of one subject."""
+
+    __tablename__ = "rating_aggregates"
+    kind = Column(db.String(10), primary_key=True)
+    subject_id = Column(db.Integer, primary_key=True, autoincrement=False)
+    count = Column(db.Integer, nullable=False, default=0)
+    total = Column(db.Integer, nullable=False, default=0)
+    stars_1 = Column(db.Integer, nullable=False, default=0)
+    stars_2 = Column(db.Integer, nullable=False, default=0)
+    stars_3 = Column(db.Integer, nullable=False, default=0)
+    stars_4 = Column(db.Integer, nullable=False, default=0)
+    stars_5 = Column(db.Integer, nullable=False, default=0)
+
+    @property
+    def average(self):
+        """Mean number of stars, or None without ratings."""
+        return self.total / self.count if self.count else None
+
+    @property
+    def histogram(self):
+        """Number of ratings with 1 to 5 stars."""
+        return [self.stars_1, self.stars_2, self.stars_3, self.stars_4, self.stars_5]
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<RatingAggregate({self.kind} {self.subject_id!r})>"
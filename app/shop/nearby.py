@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+"""Nearest open restaurants to a point, answered from memory.
+
+Each worker keeps the coordinates of the open restaurants in a
+:class:`GridIndex`: NumPy arrays bucketed into square cells of
+``NEARBY_CELL_DEGREES``. A query scans the cells in rings around the point and
+stops as soon as no unvisited cell can hold anything closer than the K-th
+result, so it only computes distances for a few nearby cells instead of for
+every row.
+
+Writes to restaurants bump a version stamp in the shared ``cache``. A worker
+that sees a new stamp, or that has not synced for ``NEARBY_SYNC_INTERVAL``
+seconds, loads only the restaurants whose ``updated_at`` is recent. Deleting
+restaurants bumps a generation stamp instead, which makes every worker reload
+the whole index.
+"""
+import datetime as dt
+import threading
+import time
+import uuid
+from collections import defaultdict
+from itertools import chain
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.database import db
+from app.extensions import cache
+from app.metrics import metrics
+
+from .models import Restaurant
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = np.pi * EARTH_RADIUS_KM / 180
+VERSION_KEY = "nearby-restaurants-version"
+GENERATION_KEY = "nearby-restaurants-generation"
+
+_CHANGED_KEY = "nearby_restaurants_changed"
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Great-circle distances in km from one point to arrays of points."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = (
+        np.sin((lats - lat) / 2) ** 2
+        + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GridIndex(object):
+    """Points bucketed into a uniform latitude/longitude grid.
+
+    Coordinates live in NumPy arrays indexed by slot; each occupied cell holds
+    the list of its slots. Adding, moving and removing a point only touches its
+    own cell. Cells do not wrap around the antimeridian.
+    """
+
+    def __init__(self, cell_degrees=0.01):
+        """Create instance."""
+        self.cell_degrees = cell_degrees
+        self._clear()
+
+    def _clear(self):
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._lats = np.zeros(0)
+        self._lons = np.zeros(0)
+        self._live = np.zeros(0, dtype=bool)
+        self._slots = {}
+        self._free = []
+        self._cells = defaultdict(list)
+        self._bounds = None
+
+    def __len__(self):
+        """Return the number of points."""
+        return len(self._slots)
+
+    def __contains__(self, point_id):
+        """Return whether ``point_id`` is indexed."""
+        return point_id in self._slots
+
+    def _cell(self, lat, lon):
+        return (
+            int(np.floor(lat / self.cell_degrees)),
+            int(np.floor(lon / self.cell_degrees)),
+        )
+
+    def _grow(self, size):
+        capacity = max(size, 2 * len(self._ids), 64)
+        old = len(self._ids)
+        self._free.extend(range(capacity - 1, old - 1, -1))
+        for name in ("_ids", "_lats", "_lons", "_live"):
+            array = getattr(self, name)
+            grown = np.zeros(capacity, dtype=array.dtype)
+            grown[:old] = array
+            setattr(self, name, grown)
+
+    def _extend_bounds(self, cell):
+        if self._bounds is None:
+            self._bounds = [cell[0], cell[0], cell[1], cell[1]]
+        else:
+            bounds = self._bounds
+            bounds[0] = min(bounds[0], cell[0])
+            bounds[1] = max(bounds[1], cell[0])
+            bounds[2] = min(bounds[2], cell[1])
+            bounds[3] = max(bounds[3], cell[1])
+
+    def load(self, ids, lats, lons):
+        """Replace every point; the arrays are grouped into cells in one pass."""
+        ids = np.asarray(ids, dtype=np.int64)
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        size = len(ids)
+        self._clear()
+        self._grow(size)
+        self._free = list(range(len(self._ids) - 1, size - 1, -1))
+        self._ids[:size] = ids
+        self._lats[:size] = lats
+        self._lons[:size] = lons
+        self._live[:size] = True
+        self._slots = dict(zip(ids.tolist(), range(size)))
+        if not size:
+            return
+        rows = np.floor(lats / self.cell_degrees).astype(np.int64)
+        cols = np.floor(lons / self.cell_degrees).astype(np.int64)
+        order = np.lexsort((cols, rows))
+        starts = np.flatnonzero(
+            (np.diff(rows[order]) != 0) | (np.diff(cols[order]) != 0)
+        )
+        for group in np.split(order, starts + 1):
+            first = group[0]
+            self._cells[(int(rows[first]), int(cols[first]))] = group.tolist()
+        self._bounds = [
+            int(rows.min()),
+            int(rows.max()),
+            int(cols.min()),
+            int(cols.max()),
+        ]
+
+    def upsert(self, point_id, lat, lon):
+        """Add a point or move it to new coordinates."""
+        cell = self._cell(lat, lon)
+        slot = self._slots.get(point_id)
+        if slot is None:
+            if not self._free:
+                self._grow(len(self._ids) + 1)
+            slot = self._free.pop()
+            self._slots[point_id] = slot
+            self._ids[slot] = point_id
+            self._live[slot] = True
+            self._cells[cell].append(slot)
+        else:
+            old = self._cell(self._lats[slot], self._lons[slot])
+            if old != cell:
+                self._remove_from_cell(old, slot)
+                self._cells[cell].append(slot)
+        self._lats[slot] = lat
+        self._lons[slot] = lon
+        self._extend_bounds(cell)
+
+    def remove(self, point_id):
+        """Remove a point if it is indexed."""
+        slot = self._slots.pop(point_id, None)
+        if slot is None:
+            return
+        self._remove_from_cell(self._cell(self._lats[slot], self._lons[slot]), slot)
+        self._live[slot] = False
+        self._free.append(slot)
+
+    def _remove_from_cell(self, cell, slot):
+        slots = self._cells[cell]
+        slots.remove(slot)
+        if not slots:
+            del self._cells[cell]
+
+    def _ring(self, center, radius):
+        """Yield the occupied cells at Chebyshev distance ``radius`` from ``center``."""
+        row, col = center
+        cells = self._cells
+        if radius == 0:
+            if center in cells:
+                yield cells[center]
+            return
+        for c in range(col - radius, col + radius + 1):
+            for r in (row - radius, row + radius):
+                if (r, c) in cells:
+                    yield cells[(r, c)]
+        for r in range(row - radius + 1, row + radius):
+            for c in (col - radius, col + radius):
+                if (r, c) in cells:
+                    yield cells[(r, c)]
+
+    def nearest(self, lat, lon, k, max_km=None):
+        """Return up to ``k`` ``(id, distance_km)`` pairs, nearest first."""
+        if k <= 0 or not self._slots:
+            return []
+        center = self._cell(lat, lon)
+        bounds = self._bounds
+        last_ring = max(
+            abs(center[0] - bounds[0]),
+            abs(center[0] - bounds[1]),
+            abs(center[1] - bounds[2]),
+            abs(center[1] - bounds[3]),
+        )
+        slots = np.zeros(0, dtype=np.intp)
+        distances = np.zeros(0)
+        radius = 0
+        while radius <= last_ring:
+            if 8 * radius > len(self._cells):
+                # Rings now visit more cells than are occupied: scan them all.
+                slots = np.flatnonzero(self._live)
+                distances = haversine_km(lat, lon, self._lats[slots], self._lons[slots])
+                break
+            found = np.fromiter(
+                chain.from_iterable(self._ring(center, radius)), dtype=np.intp
+            )
+            if len(found):
+                slots = np.concatenate([slots, found])
+                distances = np.concatenate(
+                    [
+                        distances,
+                        haversine_km(lat, lon, self._lats[found], self._lons[found]),
+                    ]
+                )
+            # Anything outside the rings scanned so far is at least this far.
+            reach = radius * self._cell_km(lat, radius)
+            if max_km is not None and reach >= max_km:
+                break
+            if len(slots) >= k and np.partition(distances, k - 1)[k - 1] <= reach:
+                break
+            radius += 1
+        if max_km is not None:
+            within = distances <= max_km
+            slots, distances = slots[within], distances[within]
+        if len(slots) > k:
+            closest = np.argpartition(distances, k - 1)[:k]
+            slots, distances = slots[closest], distances[closest]
+        order = np.argsort(distances, kind="stable")
+        return list(
+            zip(self._ids[slots[order]].tolist(), distances[order].tolist())
+        )
+
+    def _cell_km(self, lat, radius):
+        """Shortest side in km of the cells within ``radius`` rings of ``lat``."""
+        farthest = min(90.0, abs(lat) + (radius + 1) * self.cell_degrees)
+        side = self.cell_degrees * KM_PER_DEGREE
+        return side * np.cos(np.radians(farthest))
+
+
+class NearbyIndex(object):
+    """Per-worker :class:`GridIndex` of the open restaurants with a location."""
+
+    def __init__(self, app=None):
+        """Create instance."""
+        self.cell_degrees = 0.01
+        self.sync_interval = 0
+        self.sync_overlap = 0
+        self.grid = None
+        self.syncs = 0
+        self.rebuilds = 0
+        self._version = None
+        self._generation = None
+        self._synced_at = None
+        self._next_sync = 0
+        self._syncing = False
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Read index settings from the app config."""
+        app.config.setdefault("NEARBY_CELL_DEGREES", 0.01)
+        app.config.setdefault("NEARBY_MAX_RESULTS", 20)
+        app.config.setdefault("NEARBY_SYNC_INTERVAL", 30)
+        app.config.setdefault("NEARBY_SYNC_OVERLAP", 60)
+        self.cell_degrees = app.config["NEARBY_CELL_DEGREES"]
+        self.sync_interval = app.config["NEARBY_SYNC_INTERVAL"]
+        self.sync_overlap = app.config["NEARBY_SYNC_OVERLAP"]
+        self.grid = None
+        metrics.registry.register_collector(self.collect_metrics)
+        app.extensions["nearby_index"] = self
+
+    def nearest(self, lat, lon, k, max_km=None):
+        """Return up to ``k`` ``(restaurant_id, distance_km)`` pairs, nearest first."""
+        self._sync()
+        with self._lock:
+            return self.grid.nearest(lat, lon, k, max_km=max_km)
+
+    def _sync(self):
+        """Bring the grid up to date.
+
+        The lock is only held to apply what was loaded, never while querying:
+        a green database driver yields there, and other requests would wait.
+        Requests that find a sync already running use the grid as it is.
+        """
+        stamps = cache.get_many(GENERATION_KEY, VERSION_KEY)
+        rebuild = self.grid is None or stamps[0] != self._generation
+        if not (
+            rebuild
+            or stamps[1] != self._version
+            or time.monotonic() >= self._next_sync
+        ):
+            return
+        with self._lock:
+            if self._syncing and self.grid is not None:
+                return
+            self._syncing = True
+        try:
+            if rebuild:
+                self._rebuild(stamps)
+            else:
+                self._load_changes(stamps)
+        finally:
+            self._syncing = False
+
+    def _rebuild(self, stamps):
+        started = time.time()
+        rows = db.session.query(
+            Restaurant.id, Restaurant.latitude, Restaurant.longitude
+        ).filter(
+            Restaurant.is_open.is_(True),
+            Restaurant.latitude.isnot(None),
+            Restaurant.longitude.isnot(None),
+        )
+        points = np.array(rows.all(), dtype=float).reshape(-1, 3)
+        grid = GridIndex(self.cell_degrees)
+        grid.load(points[:, 0], points[:, 1], points[:, 2])
+        with self._lock:
+            self.grid = grid
+            self.rebuilds += 1
+            self._synced(started, stamps)
+
+    def _load_changes(self, stamps):
+        started = time.time()
+        since = self._synced_at - self.sync_overlap
+        rows = (
+            db.session.query(
+                Restaurant.id,
+                Restaurant.latitude,
+                Restaurant.longitude,
+                Restaurant.is_open,
+            )
+            .filter(Restaurant.updated_at >= dt.datetime.utcfromtimestamp(since))
+            .all()
+        )
+        with self._lock:
+            for restaurant_id, lat, lon, is_open in rows:
+                if is_open and lat is not None and lon is not None:
+                    self.grid.upsert(restaurant_id, lat, lon)
+                else:
+                    self.grid.remove(restaurant_id)
+            self.syncs += 1
+            self._synced(started, stamps)
+
+    def _synced(self, started, stamps):
+        self._generation, self._version = stamps
+        self._synced_at = started
+        self._next_sync = time.monotonic() + self.sync_interval
+
+    def changed(self, deleted=False):
+        """Tell every worker that restaurants changed."""
+        cache.set(VERSION_KEY, uuid.uuid4().hex, timeout=0)
+        if deleted:
+            cache.set(GENERATION_KEY, uuid.uuid4().hex, timeout=0)
+
+    def stats(self):
+        """Return the index size and how often it was synced."""
+        return {
+            "size": len(self.grid) if self.grid is not None else 0,
+            "syncs": self.syncs,
+            "rebuilds": self.rebuilds,
+        }
+
+    def collect_metrics(self):
+        """Report :meth:`stats` to :mod:`app.metrics`."""
+        stats = self.stats()
+        return {
+            ("rype_nearby_index_size", ()): stats["size"],
+            ("rype_nearby_index_syncs_total", ()): stats["syncs"],
+            ("rype_nearby_index_rebuilds_total", ()): stats["rebuilds"],
+        }
+
+
+nearby_index = NearbyIndex()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_restaurant_changes(session, flush_context):
+    """Remember whether the transaction writes or deletes restaurants."""
+    if any(isinstance(obj, Restaurant) for obj in session.deleted):
+        session.info[_CHANGED_KEY] = "deleted"
+    elif any(isinstance(obj, Restaurant) for obj in chain(session.new, session.dirty)):
+        session.info.setdefault(_CHANGED_KEY, "written")
+
+
+@event.listens_for(Session, "after_bulk_update")
+def _collect_bulk_update(update_context):
+    if update_context.mapper.class_ is Restaurant:
+        update_context.session.info.setdefault(_CHANGED_KEY, "written")
+
+
+@event.listens_for(Session, "after_bulk_delete")
+def _collect_bulk_delete(delete_context):
+    if delete_context.mapper.class_ is Restaurant:
+        delete_context.session.info[_CHANGED_KEY] = "deleted"
+
+
+@event.listens_for(Session, "after_commit")
+def _restaurants_committed(session):
+    change = session.info.pop(_CHANGED_KEY, None)
+    if change is not None:
+        nearby_index.changed(deleted=change == "deleted")
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_restaurant_changes(session):
+    session.info.pop(_CHANGED_KEY, None)
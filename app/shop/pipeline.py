@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""Asynchronous checkout.
+
+The checkout view only stores an :class:`OrderIntent` holding a snapshot of
+the cart and returns. Worker processes (``flask checkout-worker``) take intents
+from the ``order_intents`` table with ``SELECT ... FOR UPDATE SKIP LOCKED`` and
+advance each one state per transaction::
+
+    pending -> validated -> reserved -> ordered -> paid
+
+A step and its state change commit together, so a worker that dies in the
+middle of a step leaves the intent unlocked in its last committed state for the
+next worker to pick up. A cart that changed since it was submitted, or that
+holds a sold out item, ends the intent in ``failed``; other errors are retried
+after ``CHECKOUT_RETRY_SECONDS``, at most ``CHECKOUT_MAX_ATTEMPTS`` times. An
+intent that fails after ``reserved`` gives its stock back.
+
+The order is written as ``pending_payment``, which the dispatcher ignores, and
+only becomes ``placed`` once it is paid. If the intent fails after that, the
+order is cancelled and the use of its promo code given back.
+"""
+import datetime as dt
+import time
+
+from flask import current_app
+from sqlalchemy import exc
+
+from app.database import db, unit_of_work
+
+from . import inventory, promos
+from .cart import Cart, CartError
+from .models import MenuItem, OrderIntent, order_placed
+
+OPEN = ("pending", "validated", "reserved", "ordered")
+#: States in which the intent holds stock
+HOLDING = ("reserved", "ordered")
+PAID = "paid"
+FAILED = "failed"
+#: Status of an order written but not paid for yet
+UNPAID_ORDER = "pending_payment"
+
+
+def init_pipeline(app):
+    """Set the checkout worker defaults on ``app``."""
+    app.config.setdefault("CHECKOUT_POLL_INTERVAL", 0.5)
+    app.config.setdefault("CHECKOUT_MAX_ATTEMPTS", 5)
+    app.config.setdefault("CHECKOUT_RETRY_SECONDS", 5)
+    return None
+
+
+def submit(cart, user_id, key):
+    """Store an intent to check out ``cart`` and return it.
+
+    If ``user_id`` already submitted ``key`` the existing intent is returned.
+    """
+    intent = OrderIntent.query.filter_by(user_id=user_id, key=key).first()
+    if intent is not None:
+        return intent
+    if not len(cart):
+        raise CartError("Your cart is empty")
+    try:
+        return OrderIntent.create(key=key, user_id=user_id, cart=cart.to_dict())
+    except exc.IntegrityError:
+        # The same key was submitted concurrently.
+        db.session.rollback()
+        return OrderIntent.query.filter_by(user_id=user_id, key=key).one()
+
+
+def _validate(intent, cart):
+    cart.reprice()
+
+
+def _reserve(intent, cart):
+    try:
+        inventory.reserve(zip(cart.item_ids, cart.quantities))
+    except inventory.SoldOut as error:
+        name = MenuItem.get_by_id(error.item_id).name
+        if error.available:
+            raise CartError(f"Sorry, only {error.available} {name} left")
+        raise CartError(f"Sorry, {name} is sold out")
+
+
+def _write_order(intent, cart):
+    intent.order = cart.place_order(intent.user_id, status=UNPAID_ORDER)
+    db.session.flush()
+
+
+def _record_payment(intent, cart):
+    # There is no payment provider yet; a charge would be made here, using the
+    # intent key as its idempotency key.
+    intent.order.paid_at = dt.datetime.utcnow()
+    intent.order.status = "placed"
+
+
+#: State -> (next state, step moving the intent there)
+STEPS = {
+    "pending": ("validated", _validate),
+    "validated": ("reserved", _reserve),
+    "reserved": ("ordered", _write_order),
+    "ordered": (PAID, _record_payment),
+}
+
+
+def process_next(now=None):
+    """Advance the oldest runnable intent by one state.
+
+    Returns the intent, or None if there was nothing to do.
+    """
+    now = now or dt.datetime.utcnow()
+    intent_id = None
+    try:
+        with unit_of_work():
+            intent = (
+                OrderIntent.query.filter(
+                    OrderIntent.status.in_(OPEN), OrderIntent.run_after <= now
+                )
+                .order_by(OrderIntent.id)
+                .with_for_update(skip_locked=True)
+                .first()
+            )
+            if intent is None:
+                return None
+            intent_id = intent.id
+            _advance(intent)
+    except Exception:
+        if intent_id is None:
+            raise
+        current_app.logger.exception(f"Checkout of intent {intent_id} failed")
+        return _retry_later(intent_id, now)
+    if intent.status == PAID:
+        order_placed.send(intent.order)
+    return intent
+
+
+def _advance(intent):
+    next_status, step = STEPS[intent.status]
+    try:
+        step(intent, Cart.from_dict(intent.cart))
+    except CartError as error:
+        _fail(intent, str(error))
+    else:
+        intent.status = next_status
+    intent.save()
+
+
+def _fail(intent, error):
+    if intent.status in HOLDING:
+        cart = Cart.from_dict(intent.cart)
+        inventory.release(zip(cart.item_ids, cart.quantities))
+    if intent.order is not None:
+        intent.order.status = "cancelled"
+        promos.release(intent.order)
+    intent.status = FAILED
+    intent.error = error
+
+
+def _retry_later(intent_id, now):
+    config = current_app.config
+    intent = OrderIntent.get_by_id(intent_id)
+    attempts = intent.attempts + 1
+    if attempts >= config["CHECKOUT_MAX_ATTEMPTS"]:
+        _fail(intent, "Your order could not be placed, please try again")
+        return intent.update(attempts=attempts)
+    retry_in = dt.timedelta(seconds=config["CHECKOUT_RETRY_SECONDS"] * attempts)
+    return intent.update(attempts=attempts, run_after=now + retry_in)
+
+
+def run():
+    """Work through intents until stopped, polling when there are none."""
+    interval = current_app.config["CHECKOUT_POLL_INTERVAL"]
+    while True:
+        try:
+            intent = process_next()
+        except exc.SQLAlchemyError:
+            db.session.rollback()
+            current_app.logger.exception("Could not read order intents, will retry")
+            intent = None
+        db.session.remove()
+        if intent is None:
+            time.sleep(interval)
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""Popularity ranking of menu items.
+
+Scores use forward decay: an order placed at time ``t`` adds
+``quantity * 2 ** ((t - epoch) / half_life)`` to each of its items. Every order
+is weighted relative to a stored epoch instead of to "now", so old scores never
+have to be decayed again: recording an order is one additive ``UPDATE`` and the
+ranking is an indexed ``ORDER BY popularity``.
+
+Weights grow without bound, so once an order would weigh more than
+``2 ** REBASE_AFTER`` the epoch is moved up to that order and every score is
+scaled down by the same factor, which leaves the ranking unchanged. Recording
+an order holds a shared lock on the epoch row and rebasing an exclusive one, so
+no order is added against an epoch that is being replaced.
+
+The top items are kept in the cache and refreshed whenever an order is placed,
+so pages read a ready-made list instead of aggregating orders.
+"""
+import datetime as dt
+from collections import Counter, defaultdict, namedtuple
+
+from flask import current_app
+from sqlalchemy import bindparam
+
+from app.database import db
+from app.extensions import cache
+
+from .models import (
+    MenuItem,
+    Order,
+    OrderItem,
+    PopularityEpoch,
+    Restaurant,
+    order_placed,
+)
+
+#: The epoch of a database that has never been rebased
+EPOCH = dt.datetime(2019, 11, 1)
+#: Rebase once an order would weigh more than ``2 ** REBASE_AFTER``
+REBASE_AFTER = 64
+CACHE_KEY = "popular-menu-items"
+
+PopularItem = namedtuple(
+    "PopularItem", ["id", "name", "image_url", "price_cents", "restaurant"]
+)
+
+
+def init_popularity(app):
+    """Set the ranking defaults on ``app``."""
+    app.config.setdefault("POPULARITY_HALF_LIFE_DAYS", 7)
+    app.config.setdefault("POPULAR_ITEMS", 3)
+    if not app.config["POPULARITY_HALF_LIFE_DAYS"] > 0:
+        raise ValueError("POPULARITY_HALF_LIFE_DAYS must be positive")
+    return None
+
+
+def half_lives(when, epoch):
+    """Return how many half-lives ``when`` is after ``epoch``."""
+    half_life = current_app.config["POPULARITY_HALF_LIFE_DAYS"] * 86400
+    return (when - epoch).total_seconds() / half_life
+
+
+def order_weight(when, epoch=EPOCH):
+    """Return the weight of one unit ordered at ``when``."""
+    return 2.0 ** half_lives(when, epoch)
+
+
+def current_epoch(exclusive=False):
+    """Return the epoch of the scores, locking it until the transaction ends."""
+    epoch = (
+        db.session.query(PopularityEpoch.epoch)
+        .filter(PopularityEpoch.id == 1)
+        .with_for_update(read=not exclusive)
+        .scalar()
+    )
+    if epoch is None:
+        db.session.add(PopularityEpoch(id=1, epoch=EPOCH))
+        db.session.flush()
+        epoch = EPOCH
+    return epoch
+
+
+def _set_epoch(epoch):
+    PopularityEpoch.query.filter(PopularityEpoch.id == 1).update(
+        {PopularityEpoch.epoch: epoch}, synchronize_session=False
+    )
+
+
+def rebase(when):
+    """Move the epoch up to ``when`` and scale the scores to match."""
+    epoch = current_epoch(exclusive=True)
+    if when > epoch:
+        # Very old scores underflow to 0.0, they would not rank anyway
+        factor = 2.0 ** -half_lives(when, epoch)
+        MenuItem.query.update(
+            {MenuItem.popularity: MenuItem.popularity * factor},
+            synchronize_session=False,
+        )
+        _set_epoch(when)
+    db.session.commit()
+
+
+def record_order(order):
+    """Add ``order`` to the scores of its items and refresh the top list."""
+    when = order.created_at
+    quantities = Counter()
+    for item in order.items:
+        quantities[item.menu_item_id] += item.quantity
+    epoch = current_epoch()
+    while half_lives(when, epoch) > REBASE_AFTER:
+        # Release the shared lock so that the rebase can take it exclusively
+        db.session.commit()
+        rebase(when)
+        epoch = current_epoch()
+    weight = order_weight(when, epoch)
+    table = MenuItem.__table__
+    db.session.execute(
+        table.update()
+        .where(table.c.id == bindparam("item_id"))
+        .values(popularity=table.c.popularity + bindparam("weight")),
+        [
+            {"item_id": item_id, "weight": quantity * weight}
+            for item_id, quantity in quantities.items()
+        ],
+    )
+    db.session.commit()
+    refresh_popular_items()
+
+
+def refresh_popular_items():
+    """Recompute the top items from the scores and cache them."""
+    rows = (
+        db.session.query(MenuItem, Restaurant.name)
+        .outerjoin(Restaurant)
+        .filter(
+            MenuItem.active.is_(True),
+            MenuItem.popularity > 0,
+            db.or_(Restaurant.id.is_(None), Restaurant.is_open.is_(True)),
+        )
+        .order_by(MenuItem.popularity.desc())
+        .limit(current_app.config["POPULAR_ITEMS"])
+    )
+    items = [
+        PopularItem(
+            item.id, item.name, item.image_url, item.price_cents, restaurant_name
+        )
+        for item, restaurant_name in rows
+    ]
+    cache.set(CACHE_KEY, items, timeout=0)
+    return items
+
+
+def popular_items():
+    """Return the cached list of :class:`PopularItem`, most popular first."""
+    items = cache.get(CACHE_KEY)
+    if items is None:
+        items = refresh_popular_items()
+    return items
+
+
+def rebuild():
+    """Recompute every score from the orders, e.g. after changing the half-life.
+
+    The epoch is moved to now, so this also rebases the scores. Returns the
+    number of items with a score.
+    """
+    current_epoch(exclusive=True)
+    epoch = dt.datetime.utcnow()
+    scores = defaultdict(float)
+    rows = (
+        db.session.query(OrderItem.menu_item_id, OrderItem.quantity, Order.created_at)
+        .join(Order)
+        .yield_per(1000)
+    )
+    for item_id, quantity, created_at in rows:
+        scores[item_id] += quantity * order_weight(created_at, epoch)
+    # One transaction, so the epoch row stays locked until the new scores and
+    # their epoch are committed together
+    MenuItem.query.update({MenuItem.popularity: 0.0}, synchronize_session=False)
+    db.session.bulk_update_mappings(
+        MenuItem,
+        [{"id": item_id, "popularity": score} for item_id, score in scores.items()],
+    )
+    _set_epoch(epoch)
+    db.session.commit()
+    refresh_popular_items()
+    return len(scores)
+
+
+@order_placed.connect
+def _record_placed_order(order, **extra):
+    record_order(order)
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""Promo codes, evaluated from memory.
+
+Each worker keeps the active :class:`~app.shop.models.PromoCode` rows compiled
+into :class:`Promo` tuples in a dict keyed by code, so looking a code up and
+pricing a cart with it needs no query. A restaurant scope is compiled to the set
+of that restaurant's item IDs. Committing a change to promo codes bumps a
+version stamp in the shared ``cache``; a worker that sees a new stamp, or whose
+copy is older than ``PROMO_INDEX_TTL`` seconds, reloads the index.
+
+Uses of a code are counted in the cache with atomic increments instead of by
+locking the code's row, overall and per customer: a checkout takes a use with
+:func:`redeem`, gives it back if it goes over ``max_uses`` or
+``max_uses_per_user`` and when its transaction rolls back, and an order
+cancelled later gives it back with :func:`release`. A missing counter is seeded
+from the ``promo_redemptions`` rows, which stay the record of every use.
+"""
+import datetime as dt
+import threading
+import time
+import uuid
+from collections import defaultdict, namedtuple
+from itertools import chain
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.database import db
+from app.extensions import cache
+from app.metrics import metrics
+
+from .models import MenuItem, PromoCode, PromoRedemption
+
+VERSION_KEY = "promo-codes-version"
+
+_CHANGED_KEY = "promo_codes_changed"
+_TAKEN_KEY = "promo_uses_taken"
+_RETURNED_KEY = "promo_uses_returned"
+
+
+class PromoError(Exception):
+    """Raised when a promo code cannot be used."""
+
+
+_PromoFields = namedtuple(
+    "Promo",
+    [
+        "id",
+        "code",
+        "kind",
+        "value",
+        "min_subtotal",
+        "item_ids",
+        "starts_at",
+        "expires_at",
+        "max_uses",
+        "max_uses_per_user",
+    ],
+)
+
+
+class Promo(_PromoFields):
+    """A compiled promo code.
+
+    ``item_ids`` is None when every item is discounted, else a frozenset.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def compile(cls, row, restaurant_items=None):
+        """Return the :class:`Promo` for a :class:`PromoCode` ``row``.
+
+        :param restaurant_items: Item IDs of each restaurant, for restaurant
+            scoped codes.
+        """
+        item_ids = None
+        if row.menu_item_id is not None or row.restaurant_id is not None:
+            item_ids = set()
+            if row.menu_item_id is not None:
+                item_ids.add(row.menu_item_id)
+            if row.restaurant_id is not None:
+                item_ids.update((restaurant_items or {}).get(row.restaurant_id, ()))
+            item_ids = frozenset(item_ids)
+        return cls(
+            id=row.id,
+            code=row.code,
+            kind=row.kind,
+            value=row.value,
+            min_subtotal=row.min_subtotal_cents or 0,
+            item_ids=item_ids,
+            starts_at=row.starts_at,
+            expires_at=row.expires_at,
+            max_uses=row.max_uses,
+            max_uses_per_user=row.max_uses_per_user,
+        )
+
+    def eligible_subtotal(self, cart):
+        """Return the part of the cart's subtotal the code discounts."""
+        if self.item_ids is None:
+            return cart.subtotal
+        return sum(
+            quantity * price
+            for item_id, quantity, price in zip(
+                cart.item_ids, cart.quantities, cart.prices
+            )
+            if item_id in self.item_ids
+        )
+
+    def check(self, cart, now=None):
+        """Return why the code cannot be used on ``cart``, or None if it can."""
+        now = now or dt.datetime.utcnow()
+        if self.starts_at is not None and now < self.starts_at:
+            return f"Promo code {self.code} is not valid yet"
+        if self.expires_at is not None and now >= self.expires_at:
+            return f"Promo code {self.code} has expired"
+        if cart.subtotal < self.min_subtotal:
+            return (
+                f"Promo code {self.code} needs a basket of at least "
+                f"${self.min_subtotal / 100:.2f}"
+            )
+        if self.item_ids is not None and not self.eligible_subtotal(cart):
+            return f"Promo code {self.code} does not apply to anything in your cart"
+        return None
+
+    def discount(self, cart):
+        """Return the discount in cents on ``cart``, zero if it is not eligible."""
+        if cart.subtotal < self.min_subtotal:
+            return 0
+        eligible = self.eligible_subtotal(cart)
+        if self.kind == "percent":
+            discount = eligible * self.value // 100
+        else:
+            discount = self.value
+        return max(0, min(discount, eligible))
+
+
+class PromoIndex(object):
+    """Active promo codes of this worker, by code."""
+
+    def __init__(self, app=None):
+        """Create instance."""
+        self._lock = threading.Lock()
+        self._loading = False
+        self._promos = None
+        self._version = None
+        self._expires = 0.0
+        self.ttl = 60
+        self.loads = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Set the promo defaults on ``app``."""
+        app.config.setdefault("PROMO_INDEX_TTL", 60)
+        app.config.setdefault("PROMO_COUNTER_TTL", 24 * 3600)
+        self.ttl = app.config["PROMO_INDEX_TTL"]
+        self._promos = None
+        metrics.registry.register_collector(self.collect_metrics)
+        app.extensions["promo_index"] = self
+
+    def get(self, code):
+        """Return the :class:`Promo` for ``code``, or None if it is not active."""
+        if not code:
+            return None
+        self._sync()
+        return self._promos.get(code.strip().upper())
+
+    def _sync(self):
+        """Reload the codes if they changed or expired.
+
+        The lock is only held to swap in what was loaded, never while querying;
+        requests that find a load running keep using the current codes.
+        """
+        version = cache.get(VERSION_KEY)
+        if not (
+            self._promos is None
+            or version != self._version
+            or time.monotonic() >= self._expires
+        ):
+            return
+        with self._lock:
+            if self._loading and self._promos is not None:
+                return
+            self._loading = True
+        try:
+            promos = self._load()
+            with self._lock:
+                self._promos = promos
+                self._version = version
+                self._expires = time.monotonic() + self.ttl
+                self.loads += 1
+        finally:
+            self._loading = False
+
+    def _load(self):
+        rows = PromoCode.query.filter(PromoCode.active.is_(True)).all()
+        restaurant_ids = {row.restaurant_id for row in rows if row.restaurant_id}
+        restaurant_items = defaultdict(list)
+        if restaurant_ids:
+            items = db.session.query(MenuItem.id, MenuItem.restaurant_id).filter(
+                MenuItem.restaurant_id.in_(restaurant_ids)
+            )
+            for item_id, restaurant_id in items:
+                restaurant_items[restaurant_id].append(item_id)
+        return {row.code.upper(): Promo.compile(row, restaurant_items) for row in rows}
+
+    def changed(self):
+        """Tell every worker that promo codes changed."""
+        cache.set(VERSION_KEY, uuid.uuid4().hex, timeout=0)
+
+    def stats(self):
+        """Return the number of active codes and how often they were loaded."""
+        return {"size": len(self._promos or ()), "loads": self.loads}
+
+    def collect_metrics(self):
+        """Report :meth:`stats` to :mod:`app.metrics`."""
+        stats = self.stats()
+        return {
+            ("rype_promo_codes", ()): stats["size"],
+            ("rype_promo_index_loads_total", ()): stats["loads"],
+        }
+
+
+promo_index = PromoIndex()
+
+
+def _uses_key(promo_id):
+    return f"promo-uses:{promo_id}"
+
+
+def _user_uses_key(promo_id, user_id):
+    return f"promo-uses:{promo_id}:{user_id}"
+
+
+def _take_use(key, limit, redemptions):
+    """Count one more use under ``key``; returns False if over ``limit``."""
+    if cache.get(key) is None:
+        # Start the counter from the recorded uses; if another worker beat us
+        # to it, ``add`` keeps theirs.
+        recorded = redemptions.count()
+        cache.add(key, recorded, timeout=current_app.config["PROMO_COUNTER_TTL"])
+    uses = cache.cache.inc(key)
+    if uses is None or uses > limit:
+        if uses is not None:
+            cache.cache.dec(key)
+        return False
+    db.session.info.setdefault(_TAKEN_KEY, []).append(key)
+    return True
+
+
+def _give_back_use(key):
+    cache.cache.dec(key)
+    db.session.info[_TAKEN_KEY].remove(key)
+
+
+def redeem(promo, user_id, order):
+    """Take a use of ``promo`` for ``order`` and record it in the session.
+
+    Call it inside the unit of work that writes ``order``; the use is given back
+    if that rolls back.
+
+    :raises PromoError: if the code is used up, overall or by ``user_id``.
+    """
+    redemptions = PromoRedemption.query.filter_by(promo_id=promo.id)
+    user_key = None
+    if promo.max_uses_per_user is not None:
+        user_key = _user_uses_key(promo.id, user_id)
+        if not _take_use(
+            user_key,
+            promo.max_uses_per_user,
+            redemptions.filter_by(user_id=user_id),
+        ):
+            raise PromoError(f"You have already used promo code {promo.code}")
+    if promo.max_uses is not None:
+        if not _take_use(_uses_key(promo.id), promo.max_uses, redemptions):
+            if user_key is not None:
+                _give_back_use(user_key)
+            raise PromoError(f"Promo code {promo.code} has been used up")
+    db.session.add(PromoRedemption(promo_id=promo.id, user_id=user_id, order=order))
+
+
+def release(order):
+    """Delete the redemptions of the cancelled ``order`` in the session.
+
+    Their uses are given back once the session commits.
+    """
+    rows = (
+        db.session.query(
+            PromoRedemption, PromoCode.max_uses, PromoCode.max_uses_per_user
+        )
+        .join(PromoCode, PromoRedemption.promo_id == PromoCode.id)
+        .filter(PromoRedemption.order_id == order.id)
+    )
+    returned = db.session.info.setdefault(_RETURNED_KEY, [])
+    for redemption, max_uses, max_uses_per_user in rows:
+        db.session.delete(redemption)
+        if max_uses is not None:
+            returned.append(_uses_key(redemption.promo_id))
+        if max_uses_per_user is not None:
+            returned.append(_user_uses_key(redemption.promo_id, redemption.user_id))
+
+
+def uses(promo):
+    """Return how many times ``promo`` was redeemed, as counted in the cache."""
+    value = cache.get(_uses_key(promo.id))
+    if value is None:
+        return PromoRedemption.query.filter_by(promo_id=promo.id).count()
+    return value
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_promo_changes(session, flush_context):
+    """Remember whether the transaction changes promo codes."""
+    if any(
+        isinstance(obj, PromoCode)
+        for obj in chain(session.new, session.dirty, session.deleted)
+    ):
+        session.info[_CHANGED_KEY] = True
+
+
+@event.listens_for(Session, "after_bulk_update")
+def _collect_bulk_update(update_context):
+    if update_context.mapper.class_ is PromoCode:
+        update_context.session.info[_CHANGED_KEY] = True
+
+
+@event.listens_for(Session, "after_bulk_delete")
+def _collect_bulk_delete(delete_context):
+    if delete_context.mapper.class_ is PromoCode:
+        delete_context.session.info[_CHANGED_KEY] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _promos_committed(session):
+    session.info.pop(_TAKEN_KEY, None)
+    for key in session.info.pop(_RETURNED_KEY, ()):
+        # A counter that expired is seeded again from the remaining rows
+        if cache.get(key) is not None:
+            cache.cache.dec(key)
+    if session.info.pop(_CHANGED_KEY, False):
+        promo_index.changed()
+
+
+@event.listens_for(Session, "after_rollback")
+def _give_back_uses(session):
+    session.info.pop(_CHANGED_KEY, None)
+    session.info.pop(_RETURNED_KEY, None)
+    for key in session.info.pop(_TAKEN_KEY, ()):
+        cache.cache.dec(key)
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""Rating ingestion with write-behind batching.
+
+Submitted ratings are queued in the worker and written in one transaction once
+``RATINGS_BUFFER_SIZE`` are pending or ``RATINGS_FLUSH_INTERVAL`` seconds have
+passed. The same transaction adds each batch to :class:`RatingAggregate`, so
+reading an average or a distribution is a primary key lookup that never scans
+the ratings table. Ratings still in the buffer are not visible yet, and are
+lost if the worker is killed before it flushes. Batches that fail to write are
+kept for the next flush, up to ``RATINGS_MAX_PENDING`` ratings; the oldest
+ones beyond that are dropped.
+"""
+import threading
+import time
+from collections import defaultdict, namedtuple
+
+from flask import current_app
+from sqlalchemy import and_, bindparam, exc, func, or_
+
+from app.database import db
+
+from .models import Rating, RatingAggregate
+
+KINDS = ("item", "courier")
+
+RatingSummary = namedtuple("RatingSummary", ["count", "average", "histogram"])
+EMPTY_SUMMARY = RatingSummary(0, None, [0, 0, 0, 0, 0])
+
+_STAR_COLUMNS = ["stars_1", "stars_2", "stars_3", "stars_4", "stars_5"]
+
+
+class RatingBuffer(object):
+    """Queue of ratings waiting to be written."""
+
+    def __init__(self, app=None):
+        """Create instance."""
+        self.max_size = 0
+        self.max_pending = 0
+        self.interval = 0
+        self.pending = []
+        self.flushed = 0
+        self.dropped = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Read buffer settings and flush after requests once one is due."""
+        app.config.setdefault("RATINGS_BUFFER_SIZE", 500)
+        app.config.setdefault("RATINGS_FLUSH_INTERVAL", 5)
+        app.config.setdefault("RATINGS_MAX_PENDING", 10000)
+        self.max_size = app.config["RATINGS_BUFFER_SIZE"]
+        self.max_pending = app.config["RATINGS_MAX_PENDING"]
+        self.interval = app.config["RATINGS_FLUSH_INTERVAL"]
+        self.pending = []
+        app.after_request(self._after_request)
+        app.extensions["rating_buffer"] = self
+
+    def add(self, kind, subject_id, stars, user_id, order_id=None):
+        """Queue a rating of ``stars`` (1 to 5) for ``kind`` ``subject_id``."""
+        if kind not in KINDS:
+            raise ValueError(f"Unknown rating kind {kind!r}")
+        if not 1 <= stars <= 5:
+            raise ValueError("Ratings are 1 to 5 stars")
+        with self._lock:
+            self.pending.append(
+                {
+                    "kind": kind,
+                    "subject_id": subject_id,
+                    "stars": stars,
+                    "user_id": user_id,
+                    "order_id": order_id,
+                }
+            )
+            full = len(self.pending) >= self.max_size
+        if full:
+            self._try_flush()
+
+    def _after_request(self, response):
+        if self.pending and time.monotonic() - self._last_flush >= self.interval:
+            self._try_flush()
+        return response
+
+    def _try_flush(self):
+        try:
+            self.flush()
+        except exc.SQLAlchemyError:
+            current_app.logger.exception("Could not write ratings, will retry")
+
+    def flush(self):
+        """Write the pending ratings and their aggregates; returns how many."""
+        with self._lock:
+            batch, self.pending = self.pending, []
+            self._last_flush = time.monotonic()
+        if not batch:
+            return 0
+        try:
+            try:
+                _write(batch)
+            except exc.IntegrityError:
+                # Another worker created one of the ratings or aggregate rows
+                # first; the retry finds and updates it.
+                _write(batch)
+        except Exception:
+            with self._lock:
+                self.pending[:0] = batch
+                dropped = len(self.pending) - self.max_pending
+                if dropped > 0:
+                    del self.pending[:dropped]
+                    self.dropped += dropped
+            if dropped > 0:
+                current_app.logger.error(f"Dropped {dropped} unwritten ratings")
+            raise
+        self.flushed += len(batch)
+        return len(batch)
+
+
+def _write(batch):
+    """Write ``batch`` and add it to the aggregates in one transaction.
+
+    A user rates each item or courier of an order once: rating it again
+    replaces the stars, and the aggregate moves by the difference. Ratings
+    without an order are always added.
+    """
+    latest, unordered = {}, []
+    for rating in batch:
+        if rating["order_id"] is None:
+            unordered.append(rating)
+        else:
+            latest[_rating_key(rating)] = rating
+    deltas = defaultdict(lambda: [0, 0, 0, 0, 0, 0, 0])
+    aggregates = RatingAggregate.__table__
+    ratings = Rating.__table__
+    with db.engine.begin() as connection:
+        previous = _previous_ratings(connection, latest) if latest else {}
+        inserted, replaced = [], []
+        for rating in unordered + list(latest.values()):
+            delta = deltas[(rating["kind"], rating["subject_id"])]
+            delta[1] += rating["stars"]
+            delta[1 + rating["stars"]] += 1
+            old = previous.get(_rating_key(rating))
+            if old is None:
+                delta[0] += 1
+                inserted.append(rating)
+            else:
+                delta[1] -= old.stars
+                delta[1 + old.stars] -= 1
+                replaced.append({"r_id": old.id, "r_stars": rating["stars"]})
+        if inserted:
+            connection.execute(ratings.insert(), inserted)
+        if replaced:
+            connection.execute(
+                ratings.update()
+                .where(ratings.c.id == bindparam("r_id"))
+                .values(stars=bindparam("r_stars")),
+                replaced,
+            )
+        ids_by_kind = defaultdict(list)
+        for kind, subject_id in deltas:
+            ids_by_kind[kind].append(subject_id)
+        existing = set(
+            tuple(row)
+            for row in connection.execute(
+                db.select([aggregates.c.kind, aggregates.c.subject_id]).where(
+                    or_(
+                        *[
+                            and_(
+                                aggregates.c.kind == kind,
+                                aggregates.c.subject_id.in_(subject_ids),
+                            )
+                            for kind, subject_ids in ids_by_kind.items()
+                        ]
+                    )
+                )
+            )
+        )
+        updates = [
+            _delta_params(key, delta)
+            for key, delta in deltas.items()
+            if key in existing
+        ]
+        inserts = [
+            _delta_params(key, delta, prefix="")
+            for key, delta in deltas.items()
+            if key not in existing
+        ]
+        if updates:
+            values = {
+                name: aggregates.c[name] + bindparam(f"d_{name}")
+                for name in ["count", "total"] + _STAR_COLUMNS
+            }
+            connection.execute(
+                aggregates.update()
+                .where(
+                    and_(
+                        aggregates.c.kind == bindparam("d_kind"),
+                        aggregates.c.subject_id == bindparam("d_subject_id"),
+                    )
+                )
+                .values(**values),
+                updates,
+            )
+        if inserts:
+            connection.execute(aggregates.insert(), inserts)
+
+
+def _previous_ratings(connection, keys):
+    """Return the stored ratings with ``keys`` by key, locked for update."""
+    ratings = Rating.__table__
+    rows = connection.execute(
+        db.select(
+            [
+                ratings.c.id,
+                ratings.c.user_id,
+                ratings.c.order_id,
+                ratings.c.kind,
+                ratings.c.subject_id,
+                ratings.c.stars,
+            ]
+        )
+        .where(
+            or_(
+                *[
+                    and_(
+                        ratings.c.user_id == user_id,
+                        ratings.c.order_id == order_id,
+                        ratings.c.kind == kind,
+                        ratings.c.subject_id == subject_id,
+                    )
+                    for user_id, order_id, kind, subject_id in keys
+                ]
+            )
+        )
+        .with_for_update()
+    )
+    return {_rating_key(row): row for row in rows}
+
+
+def _rating_key(rating):
+    return (
+        rating["user_id"],
+        rating["order_id"],
+        rating["kind"],
+        rating["subject_id"],
+    )
+
+
+def _delta_params(key, delta, prefix="d_"):
+    names = ["kind", "subject_id", "count", "total"] + _STAR_COLUMNS
+    return {f"{prefix}{name}": value for name, value in zip(names, list(key) + delta)}
+
+
+def summary(kind, subject_id):
+    """Return the :class:`RatingSummary` of one subject."""
+    aggregate = RatingAggregate.query.get((kind, subject_id))
+    if aggregate is None or not aggregate.count:
+        return EMPTY_SUMMARY
+    return RatingSummary(aggregate.count, aggregate.average, aggregate.histogram)
+
+
+def summaries(kind, subject_ids):
+    """Return ``{subject_id: RatingSummary}`` for several subjects in one query."""
+    found = {
+        aggregate.subject_id: RatingSummary(
+            aggregate.count, aggregate.average, aggregate.histogram
+        )
+        for aggregate in RatingAggregate.query.filter(
+            RatingAggregate.kind == kind,
+            RatingAggregate.subject_id.in_(list(subject_ids)),
+        )
+    }
+    return {
+        subject_id: found.get(subject_id, EMPTY_SUMMARY) for subject_id in subject_ids
+    }
+
+
+def rebuild(fix=True):
+    """Recompute the aggregates from the ratings table.
+
+    Returns the ``(kind, subject_id)`` keys whose stored aggregate had drifted.
+    With ``fix`` the aggregates are replaced by the recomputed ones.
+    """
+    expected = defaultdict(lambda: [0, 0, 0, 0, 0, 0, 0])
+    rows = db.session.query(
+        Rating.kind, Rating.subject_id, Rating.stars, func.count()
+    ).group_by(Rating.kind, Rating.subject_id, Rating.stars)
+    for kind, subject_id, stars, count in rows:
+        delta = expected[(kind, subject_id)]
+        delta[0] += count
+        delta[1] += stars * count
+        delta[1 + stars] += count
+    stored = {
+        (aggregate.kind, aggregate.subject_id): [
+            aggregate.count,
+            aggregate.total,
+        ]
+        + aggregate.histogram
+        for aggregate in RatingAggregate.query
+    }
+    zero = [0, 0, 0, 0, 0, 0, 0]
+    drifted = sorted(
+        key
+        for key in set(expected) | set(stored)
+        if expected.get(key, zero) != stored.get(key, zero)
+    )
+    if fix and drifted:
+        RatingAggregate.query.filter(
+            or_(
+                *[
+                    and_(
+                        RatingAggregate.kind == kind,
+                        RatingAggregate.subject_id == subject_id,
+                    )
+                    for kind, subject_id in drifted
+                ]
+            )
+        ).delete(synchronize_session=False)
+        db.session.bulk_insert_mappings(
+            RatingAggregate,
+            [
+                _delta_params(key, expected[key], prefix="")
+                for key in drifted
+                if key in expected
+            ],
+        )
+        db.session.commit()
+    return drifted
+
+
+rating_buffer = RatingBuffer()
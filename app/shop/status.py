@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""Order status pushed to customers as Server-Sent Events.
+
+Every change of an order's status appends a row to ``order_events`` in the
+transaction that makes it. Each worker runs one :class:`StatusHub`, which polls
+that table every ``ORDER_EVENTS_POLL_INTERVAL`` seconds while clients are
+connected, and hands each new event to the connections of the order's customer.
+The database sees one query per worker and interval however many customers are
+watching.
+
+Every connection has a buffer of at most ``ORDER_EVENTS_BUFFER`` events. A
+client that falls that far behind is dropped rather than buffered without limit;
+its browser reconnects with ``Last-Event-ID`` and is sent what it missed from
+the table. Idle connections get a comment every ``ORDER_EVENTS_KEEPALIVE``
+seconds. On gevent workers each connection is a greenlet blocked on an event,
+so thousands of them cost little more than their buffers.
+"""
+import datetime as dt
+import json
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque, namedtuple
+
+from flask import current_app
+from sqlalchemy import event, exc, literal, select
+from sqlalchemy.orm import Session, attributes
+
+from app.database import db
+from app.metrics import metrics
+
+from .models import Order, OrderEvent
+
+StatusEvent = namedtuple(
+    "StatusEvent", ["id", "order_id", "user_id", "status", "created_at"]
+)
+
+_COLUMNS = (
+    OrderEvent.id,
+    OrderEvent.order_id,
+    OrderEvent.user_id,
+    OrderEvent.status,
+    OrderEvent.created_at,
+)
+
+
+class HubFull(Exception):
+    """Raised when a worker already has ``ORDER_EVENTS_MAX_CLIENTS`` clients."""
+
+
+class Subscriber(object):
+    """A connected client: its customer and buffer of undelivered events."""
+
+    __slots__ = ("user_id", "size", "events", "ready", "dropped")
+
+    def __init__(self, user_id, size):
+        """Create instance."""
+        self.user_id = user_id
+        self.size = size
+        self.events = deque()
+        self.ready = threading.Event()
+        self.dropped = False
+
+    def push(self, status_event):
+        """Buffer ``status_event``; returns False if the buffer is full."""
+        if len(self.events) >= self.size:
+            return False
+        self.events.append(status_event)
+        self.ready.set()
+        return True
+
+    def wait(self, timeout):
+        """Return the buffered events, waiting up to ``timeout`` seconds for one."""
+        self.ready.wait(timeout)
+        self.ready.clear()
+        events = []
+        while self.events:
+            events.append(self.events.popleft())
+        return events
+
+
+def format_event(status_event):
+    """Return ``status_event`` in the Server-Sent Events wire format."""
+    data = json.dumps(
+        {
+            "order_id": status_event.order_id,
+            "status": status_event.status,
+            "at": status_event.created_at.isoformat(),
+        }
+    )
+    return f"id: {status_event.id}\nevent: status\ndata: {data}\n\n"
+
+
+class StatusHub(object):
+    """Fans the order events out to this worker's connected clients."""
+
+    def __init__(self, app=None):
+        """Create instance."""
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+        self._poller = None
+        self._last_id = None
+        self._seen = OrderedDict()
+        self.app = None
+        self.clients = 0
+        self.published = 0
+        self.dropped = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Set the order event defaults on ``app``."""
+        app.config.setdefault("ORDER_EVENTS_POLL_INTERVAL", 1.0)
+        app.config.setdefault("ORDER_EVENTS_BATCH", 1000)
+        app.config.setdefault("ORDER_EVENTS_REORDER_WINDOW", 100)
+        app.config.setdefault("ORDER_EVENTS_BUFFER", 16)
+        app.config.setdefault("ORDER_EVENTS_KEEPALIVE", 15)
+        app.config.setdefault("ORDER_EVENTS_MAX_CLIENTS", 10000)
+        app.config.setdefault("ORDER_EVENTS_BACKLOG", 100)
+        self.app = app
+        self._subscribers.clear()
+        self._last_id = None
+        self.clients = 0
+        metrics.registry.register_collector(self.collect_metrics)
+        app.extensions["status_hub"] = self
+
+    def subscribe(self, user_id, start=True):
+        """Connect a client of ``user_id``; starts polling if needed.
+
+        :raises HubFull: if the worker has no room for another client.
+        """
+        config = self.app.config
+        subscriber = Subscriber(user_id, config["ORDER_EVENTS_BUFFER"])
+        with self._lock:
+            if self.clients >= config["ORDER_EVENTS_MAX_CLIENTS"]:
+                raise HubFull("Too many clients")
+            self._subscribers[user_id].add(subscriber)
+            self.clients += 1
+        if start:
+            self.start()
+        return subscriber
+
+    def start(self):
+        """Start polling for events in the background, once per worker."""
+        with self._lock:
+            if self._poller is None:
+                self._poller = threading.Thread(
+                    target=self._run, name="order-events", daemon=True
+                )
+                self._poller.start()
+
+    def unsubscribe(self, subscriber):
+        """Disconnect a client."""
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.user_id)
+            if subscribers is None or subscriber not in subscribers:
+                return
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.user_id]
+            self.clients -= 1
+
+    def publish(self, events):
+        """Hand ``events`` to their customers' clients, dropping full ones."""
+        for status_event in events:
+            for subscriber in list(self._subscribers.get(status_event.user_id, ())):
+                if subscriber.push(status_event):
+                    self.published += 1
+                else:
+                    self._drop(subscriber)
+
+    def _drop(self, subscriber):
+        self.unsubscribe(subscriber)
+        subscriber.dropped = True
+        subscriber.events.clear()
+        subscriber.ready.set()
+        self.dropped += 1
+
+    def poll(self):
+        """Publish the events committed since the last poll; returns how many.
+
+        Rows are read again from ``ORDER_EVENTS_REORDER_WINDOW`` IDs back, so
+        that an event whose transaction committed after one with a higher ID
+        is not skipped.
+        """
+        config = self.app.config
+        window = config["ORDER_EVENTS_REORDER_WINDOW"]
+        if self._last_id is None:
+            # Start after the newest event, which clients already know about.
+            self._last_id = db.session.query(db.func.max(OrderEvent.id)).scalar() or 0
+            self._seen = OrderedDict.fromkeys(
+                range(max(1, self._last_id - window + 1), self._last_id + 1)
+            )
+        rows = (
+            db.session.query(*_COLUMNS)
+            .filter(OrderEvent.id > self._last_id - window)
+            .order_by(OrderEvent.id)
+            .limit(config["ORDER_EVENTS_BATCH"] + window)
+            .all()
+        )
+        events = []
+        for row in rows:
+            if row.id in self._seen:
+                continue
+            self._seen[row.id] = None
+            events.append(StatusEvent(*row))
+            self._last_id = max(self._last_id, row.id)
+        while len(self._seen) > 2 * window:
+            self._seen.popitem(last=False)
+        self.publish(events)
+        return len(events)
+
+    def _run(self):
+        with self.app.app_context():
+            interval = current_app.config["ORDER_EVENTS_POLL_INTERVAL"]
+            while True:
+                if not self._subscribers:
+                    # Nobody is listening; start from the newest event later.
+                    self._last_id = None
+                    self._seen.clear()
+                else:
+                    try:
+                        self.poll()
+                    except exc.SQLAlchemyError:
+                        db.session.rollback()
+                        current_app.logger.exception(
+                            "Could not read order events, will retry"
+                        )
+                    db.session.remove()
+                time.sleep(interval)
+
+    def stream(self, subscriber, backlog=()):
+        """Yield the Server-Sent Events for ``subscriber``, starting with ``backlog``.
+
+        Ends when the client is dropped; the hub forgets the client when the
+        response is closed.
+        """
+        keepalive = self.app.config["ORDER_EVENTS_KEEPALIVE"]
+        sent = set()
+        try:
+            yield "retry: 3000\n\n"
+            for status_event in backlog:
+                sent.add(status_event.id)
+                yield format_event(status_event)
+            while True:
+                events = subscriber.wait(keepalive)
+                if subscriber.dropped:
+                    return
+                if not events:
+                    yield ": keepalive\n\n"
+                for status_event in events:
+                    if status_event.id not in sent:
+                        yield format_event(status_event)
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self):
+        """Return the client, delivery and drop counters."""
+        return {
+            "clients": self.clients,
+            "published": self.published,
+            "dropped": self.dropped,
+        }
+
+    def collect_metrics(self):
+        """Report :meth:`stats` to :mod:`app.metrics`."""
+        stats = self.stats()
+        return {
+            ("rype_order_events_clients", ()): stats["clients"],
+            ("rype_order_events_published_total", ()): stats["published"],
+            ("rype_order_events_dropped_total", ()): stats["dropped"],
+        }
+
+
+status_hub = StatusHub()
+
+
+def missed_events(user_id, last_id):
+    """Return the events of ``user_id`` after ``last_id``, oldest first."""
+    limit = current_app.config["ORDER_EVENTS_BACKLOG"]
+    rows = (
+        db.session.query(*_COLUMNS)
+        .filter(OrderEvent.user_id == user_id, OrderEvent.id > last_id)
+        .order_by(OrderEvent.id.desc())
+        .limit(limit)
+    )
+    return [StatusEvent(*row) for row in reversed(rows.all())]
+
+
+def record_bulk(order_ids, status, now=None):
+    """Record a change of ``order_ids`` to ``status`` made with a Core update."""
+    now = now or dt.datetime.utcnow()
+    orders = Order.__table__
+    db.session.execute(
+        OrderEvent.__table__.insert().from_select(
+            ["order_id", "user_id", "status", "created_at"],
+            select(
+                [orders.c.id, orders.c.user_id, literal(status), literal(now)]
+            ).where(orders.c.id.in_(list(order_ids))),
+        )
+    )
+
+
+def prune(before):
+    """Delete the events created before ``before``; returns how many."""
+    count = OrderEvent.query.filter(OrderEvent.created_at < before).delete(
+        synchronize_session=False
+    )
+    db.session.commit()
+    return count
+
+
+@event.listens_for(Session, "after_flush")
+def _record_status_changes(session, flush_context):
+    """Append an event for each order created or whose status changed."""
+    now = dt.datetime.utcnow()
+    rows = [
+        {
+            "order_id": order.id,
+            "user_id": order.user_id,
+            "status": order.status,
+            "created_at": now,
+        }
+        for order in list(session.new) + list(session.dirty)
+        if isinstance(order, Order)
+        and (
+            order in session.new
+            or attributes.get_history(order, "status").has_changes()
+        )
+    ]
+    if rows:
+        session.connection().execute(OrderEvent.__table__.insert(), rows)
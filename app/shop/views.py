@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""Shop views: the cart, checking out, rating orders and finding restaurants."""
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    flash,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    url_for,
+)
+from flask_login import current_user, login_required
+
+from app.database import db
+from app.utils import flash_errors
+
+from . import pipeline
+from .cart import CartError, current_cart
+from .forms import CartItemForm, CheckoutForm, PromoForm, RatingForm
+from .models import MenuItem, Order, OrderIntent, OrderItem, Restaurant
+from .nearby import nearby_index
+from .ratings import rating_buffer
+from .status import HubFull, missed_events, status_hub
+
+blueprint = Blueprint("shop", __name__, url_prefix="/shop", static_folder="../static")
+
+
+@blueprint.app_template_filter("cents")
+def format_cents(value):
+    """Format an amount in cents as dollars, e.g. ``1253`` as ``12.53``."""
+    return f"{value // 100}.{value % 100:02d}"
+
+
+def back_to_cart():
+    """Redirect to where the form was posted from, or the cart page."""
+    return redirect(request.args.get("next") or url_for("public.customerShoppingCart"))
+
+
+@blueprint.route("/cart/add/", methods=["POST"])
+def add_to_cart():
+    """Add an item to the cart."""
+    form = CartItemForm(request.form)
+    if form.validate_on_submit():
+        item = MenuItem.get_by_id(form.item_id.data)
+        if item is None or not item.active:
+            flash("That item is not available.", "warning")
+            return back_to_cart()
+        cart = current_cart()
+        try:
+            cart.add(item, form.quantity.data)
+            cart.save()
+        except CartError as error:
+            flash(str(error), "warning")
+        else:
+            flash(f"Added {item.name} to your cart.", "success")
+    else:
+        flash_errors(form)
+    return back_to_cart()
+
+
+@blueprint.route("/cart/update/", methods=["POST"])
+def update_cart():
+    """Change the quantity of a cart line; zero removes it."""
+    form = CartItemForm(request.form)
+    if form.validate_on_submit():
+        cart = current_cart()
+        try:
+            cart.set_quantity(form.item_id.data, form.quantity.data)
+            cart.save()
+        except CartError as error:
+            flash(str(error), "warning")
+    else:
+        flash_errors(form)
+    return back_to_cart()
+
+
+@blueprint.route("/cart/promo/", methods=["POST"])
+def apply_promo():
+    """Apply a promo code to the cart."""
+    form = PromoForm(request.form)
+    if form.validate_on_submit():
+        cart = current_cart()
+        try:
+            cart.apply_promo(form.code.data)
+            cart.save()
+        except CartError as error:
+            flash(f"{error}.", "warning")
+        else:
+            flash(f"Promo code {cart.promo_code} applied.", "success")
+    else:
+        flash_errors(form)
+    return back_to_cart()
+
+
+@blueprint.route("/checkout/", methods=["POST"])
+@login_required
+def checkout():
+    """Submit the order in the cart and show its progress."""
+    form = CheckoutForm(request.form)
+    if not form.validate_on_submit():
+        flash_errors(form)
+        return redirect(url_for("public.customerPay"))
+    cart = current_cart()
+    try:
+        intent = pipeline.submit(cart, current_user.id, form.key.data)
+    except CartError as error:
+        flash(str(error), "warning")
+        return redirect(url_for("public.customerShoppingCart"))
+    cart.clear()
+    return redirect(url_for("shop.checkout_progress", key=intent.key))
+
+
+def _own_intent(key):
+    return OrderIntent.query.filter_by(key=key, user_id=current_user.id).first_or_404()
+
+
+@blueprint.route("/checkout/<key>/")
+@login_required
+def checkout_progress(key):
+    """Show the progress of a checkout, refreshing until it is done."""
+    intent = _own_intent(key)
+    if intent.status == pipeline.PAID:
+        flash(f"Thank you, your order #{intent.order_id} has been placed.", "success")
+        return redirect(url_for("public.customerHome"))
+    if intent.status == pipeline.FAILED:
+        flash(intent.error, "warning")
+        return redirect(url_for("public.customerShoppingCart"))
+    return render_template("shop/checkout.html", intent=intent)
+
+
+@blueprint.route("/checkout/<key>/status/")
+@login_required
+def checkout_status(key):
+    """Return the state of a checkout as JSON, for clients that poll."""
+    intent = _own_intent(key)
+    return jsonify(
+        key=intent.key,
+        status=intent.status,
+        order_id=intent.order_id,
+        error=intent.error,
+    )
+
+
+@blueprint.route("/orders/events/")
+@login_required
+def order_events():
+    """Stream the status changes of the user's orders as Server-Sent Events."""
+    user_id = current_user.id
+    try:
+        subscriber = status_hub.subscribe(user_id)
+    except HubFull:
+        response = jsonify(error="Too many connections, try again later")
+        response.status_code = 503
+        response.headers["Retry-After"] = "10"
+        return response
+    last_id = request.headers.get("Last-Event-ID", type=int)
+    backlog = missed_events(user_id, last_id) if last_id is not None else []
+    # Don't hold a database connection for as long as the client listens.
+    db.session.remove()
+    return Response(
+        status_hub.stream(subscriber, backlog),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@blueprint.route("/ratings/<any(item, courier):kind>/", methods=["POST"])
+@login_required
+def rate(kind):
+    """Rate an item of one of the user's orders, or the courier who delivered it."""
+    form = RatingForm(request.form)
+    if kind == "item":
+        back = url_for("public.customerFoodRating")
+    else:
+        back = url_for("public.customerDeliveryRating")
+    if not form.validate_on_submit():
+        flash_errors(form)
+        return redirect(back)
+    order = Order.query.filter_by(id=form.order_id.data, user_id=current_user.id)
+    if kind == "item":
+        rated = order.join(OrderItem).filter(
+            OrderItem.menu_item_id == form.subject_id.data
+        )
+    else:
+        rated = order.filter(Order.courier_id == form.subject_id.data)
+    if not db.session.query(rated.exists()).scalar():
+        flash("You can only rate your own orders.", "warning")
+        return redirect(back)
+    rating_buffer.add(
+        kind,
+        form.subject_id.data,
+        form.stars.data,
+        current_user.id,
+        order_id=form.order_id.data,
+    )
+    flash("Thank you for your rating.", "success")
+    return redirect(back)
+
+
+@blueprint.route("/restaurants/nearby/")
+def nearby_restaurants():
+    """Return the nearest open restaurants to ``lat`` and ``lon`` as JSON.
+
+    ``k`` limits the number of results and ``km`` the distance.
+    """
+    lat = request.args.get("lat", type=float)
+    lon = request.args.get("lon", type=float)
+    k = request.args.get("k", default=5, type=int)
+    max_km = request.args.get("km", type=float)
+    if lat is None or lon is None or not -90 <= lat <= 90 or not -180 <= lon <= 180:
+        return jsonify(error="lat and lon are required coordinates"), 400
+    k = max(1, min(k, current_app.config["NEARBY_MAX_RESULTS"]))
+    nearest = nearby_index.nearest(lat, lon, k, max_km=max_km)
+    restaurants = Restaurant.query.filter(
+        Restaurant.id.in_([restaurant_id for restaurant_id, _ in nearest])
+    ).all()
+    by_id = {restaurant.id: restaurant for restaurant in restaurants}
+    return jsonify(
+        restaurants=[
+            {
+                "id": restaurant_id,
+                "name": by_id[restaurant_id].name,
+                "address": by_id[restaurant_id].address,
+                "latitude": by_id[restaurant_id].latitude,
+                "longitude": by_id[restaurant_id].longitude,
+                "distance_km": round(distance, 3),
+            }
+            for restaurant_id, distance in nearest
+            if restaurant_id in by_id
+        ]
+    )
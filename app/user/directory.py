@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Admin directory of users, paginated by keyset.
+
+Pages never use ``OFFSET``: each one ends with a cursor holding the sort key of
+its last user, and the next page starts right after that key. Every listing is
+ordered to match one of the ``users`` indexes, so a page deep in millions of
+users costs the same index range scan as the first one:
+
+* without a search, newest first on ``(created_at, id)``, or on
+  ``(active, created_at, id)`` / ``(is_admin, created_at, id)`` when filtered;
+* with a search, alphabetically on ``(username, id)`` or ``(email, id)``. Both
+  columns compare byte by byte (``COLLATE "C"`` on PostgreSQL), so the users
+  starting with a prefix are the range from the prefix up to the prefix with
+  its last character incremented, which the same index serves along with the
+  order and the cursor.
+"""
+import base64
+import binascii
+import datetime as dt
+import json
+import sys
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import tuple_
+
+from app.database import db
+
+from .models import User
+
+SEARCH_FIELDS = ("username", "email")
+_CURSOR_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+Page = namedtuple("Page", ["users", "next_cursor"])
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor was tampered with or belongs to another listing."""
+
+
+def encode_cursor(order, value, user_id):
+    """Return the opaque cursor for the page after ``(value, user_id)``."""
+    if isinstance(value, dt.datetime):
+        value = value.strftime(_CURSOR_TIME_FORMAT)
+    data = json.dumps([order, value, user_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, order):
+    """Return the ``(value, user_id)`` key of a cursor of the ``order`` listing.
+
+    :raises InvalidCursor: if the cursor cannot be read or is for another order.
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_order, value, user_id = json.loads(data)
+        if order == "created_at":
+            value = dt.datetime.strptime(value, _CURSOR_TIME_FORMAT)
+    except (binascii.Error, ValueError, TypeError) as error:
+        raise InvalidCursor(str(error))
+    if cursor_order != order or not isinstance(user_id, int):
+        raise InvalidCursor(f"Not a cursor of the {order} listing")
+    return value, user_id
+
+
+def prefix_range(prefix):
+    """Return the ``(lower, upper)`` bounds of the strings starting with ``prefix``.
+
+    ``upper`` is None when every string from ``lower`` on matches.
+    """
+    head = prefix
+    while head and ord(head[-1]) == sys.maxunicode:
+        head = head[:-1]
+    if not head:
+        return prefix, None
+    following = ord(head[-1]) + 1
+    if 0xD800 <= following <= 0xDFFF:
+        # Surrogates cannot be stored; nothing sorts between them either
+        following = 0xE000
+    return prefix, head[:-1] + chr(following)
+
+
+def search(
+    prefix=None,
+    field="username",
+    active=None,
+    is_admin=None,
+    joined_from=None,
+    joined_to=None,
+    after=None,
+    limit=None,
+):
+    """Return a :class:`Page` of users matching the filters.
+
+    :param prefix: Only users whose ``field`` starts with it, in ``field`` order.
+    :param active: Only active (True) or inactive (False) users.
+    :param is_admin: Only admins (True) or non-admins (False).
+    :param joined_from: Only users created on or after this date.
+    :param joined_to: Only users created on or before this date.
+    :param after: The ``next_cursor`` of the previous page.
+    :raises InvalidCursor: if ``after`` is not a cursor of this listing.
+    """
+    limit = limit or current_app.config.get("USER_DIRECTORY_PAGE_SIZE", 50)
+    query = User.query.options(db.defer("password"))
+    if active is not None:
+        query = query.filter(User.active == active)
+    if is_admin is not None:
+        query = query.filter(User.is_admin == is_admin)
+    if joined_from is not None:
+        query = query.filter(User.created_at >= joined_from)
+    if joined_to is not None:
+        query = query.filter(User.created_at < joined_to + dt.timedelta(days=1))
+
+    if prefix:
+        order = field
+        column = getattr(User, field)
+        lower, upper = prefix_range(prefix)
+        query = query.filter(column >= lower)
+        if upper is not None:
+            query = query.filter(column < upper)
+        key = tuple_(column, User.id)
+        if after:
+            query = query.filter(key > tuple_(*decode_cursor(after, order)))
+        query = query.order_by(column, User.id)
+    else:
+        order = "created_at"
+        column = User.created_at
+        key = tuple_(column, User.id)
+        if after:
+            query = query.filter(key < tuple_(*decode_cursor(after, order)))
+        query = query.order_by(column.desc(), User.id.desc())
+
+    users = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        last = users[-1]
+        next_cursor = encode_cursor(order, getattr(last, order), last.id)
+    return Page(users, next_cursor)
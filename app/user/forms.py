@@ -1,11 +1,16 @@
 # -*- coding: utf-8 -*-
 """User forms."""
 from flask_wtf import FlaskForm
-from wtforms import PasswordField, StringField
-from wtforms.validators import DataRequired, Email, EqualTo, Length
+from wtforms import DateField, PasswordField, SelectField, StringField
+from wtforms.validators import DataRequired, Email, EqualTo, Length, Optional
 
+from app.hashing import HashingBusyError, hasher
+
+from .directory import SEARCH_FIELDS
 from .models import User
 
+_ANY_YES_NO = [("", "Any"), ("yes", "Yes"), ("no", "No")]
+
 
 class RegisterForm(FlaskForm):
     """Register form."""
@@ -28,18 +33,62 @@ class RegisterForm(FlaskForm):
         """Create instance."""
         super(RegisterForm, self).__init__(*args, **kwargs)
         self.user = None
+        self.password_hash = None
 
     def validate(self):
         """Validate the form."""
         initial_validation = super(RegisterForm, self).validate()
         if not initial_validation:
             return False
-        user = User.query.filter_by(username=self.username.data).first()
-        if user:
-            self.username.errors.append("Username already registered")
+        taken = User.taken_fields(self.username.data, self.email.data)
+        if taken:
+            self.report_taken(taken)
             return False
-        user = User.query.filter_by(email=self.email.data).first()
-        if user:
-            self.email.errors.append("Email already registered")
+        try:
+            self.password_hash = hasher.generate_password_hash(self.password.data)
+        except HashingBusyError:
+            self.password.errors.append("Server is busy, please try again")
             return False
         return True
+
+    def report_taken(self, fields):
+        """Add errors for the fields that are already registered."""
+        if "username" in fields:
+            self.username.errors.append("Username already registered")
+        if "email" in fields:
+            self.email.errors.append("Email already registered")
+
+
+class MemberSearchForm(FlaskForm):
+    """Search form of the admin user directory, submitted with GET."""
+
+    q = StringField("Starts with", validators=[Optional(), Length(max=80)])
+    field = SelectField(
+        "In",
+        choices=[(name, name.title()) for name in SEARCH_FIELDS],
+        default="username",
+    )
+    active = SelectField("Active", choices=_ANY_YES_NO, default="")
+    is_admin = SelectField("Admin", choices=_ANY_YES_NO, default="")
+    joined_from = DateField("Joined from", validators=[Optional()])
+    joined_to = DateField("Joined to", validators=[Optional()])
+
+    class Meta:
+        """Form configuration."""
+
+        csrf = False
+
+    @staticmethod
+    def _flag(value):
+        return {"yes": True, "no": False}.get(value)
+
+    def filters(self):
+        """Return the keyword arguments of :func:`app.user.directory.search`."""
+        return {
+            "prefix": (self.q.data or "").strip() or None,
+            "field": self.field.data,
+            "active": self._flag(self.active.data),
+            "is_admin": self._flag(self.is_admin.data),
+            "joined_from": self.joined_from.data,
+            "joined_to": self.joined_to.data,
+        }
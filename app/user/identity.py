@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""Per-worker cache of the user identity loaded on every authenticated request."""
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session, attributes
+
+from app.database import db, record_committed, use_primary
+from app.extensions import cache
+
+from .models import Role, User
+from .permissions import compile_permissions, mask
+
+_ROLES_CHANGED_KEY = "identity_roles_changed"
+
+
+class UserSnapshot(UserMixin):
+    """Read-only copy of the :class:`~app.user.models.User` columns a request needs.
+
+    The hashed password is never loaded. Call :meth:`load` when the full model
+    is required, e.g. to modify it. ``permissions`` holds the bits granted by
+    the user's roles, see :mod:`app.user.permissions`.
+    """
+
+    fields = (
+        "id",
+        "username",
+        "email",
+        "first_name",
+        "last_name",
+        "active",
+        "is_admin",
+        "created_at",
+    )
+
+    def __init__(self, user, permissions=0):
+        """Create instance from a loaded user."""
+        for field in self.fields:
+            setattr(self, field, getattr(user, field))
+        self.permissions = permissions
+
+    def can(self, *permissions):
+        """Return whether the user has all of ``permissions``."""
+        needed = mask(*permissions)
+        return self.permissions & needed == needed
+
+    @property
+    def full_name(self):
+        """Full user name."""
+        return f"{self.first_name} {self.last_name}"
+
+    def load(self):
+        """Load the full user model."""
+        return User.get_by_id(self.id)
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<UserSnapshot({self.username!r})>"
+
+
+class IdentityCache(object):
+    """LRU + TTL cache of :class:`UserSnapshot` objects, keyed by user ID.
+
+    Each entry remembers the version stamp that was current in the shared
+    ``cache`` when it was loaded. Writes bump the stamp, so other workers drop
+    their copy on the next lookup; staleness is otherwise bounded by the TTL.
+    """
+
+    def __init__(self, app=None):
+        """Create instance."""
+        self.maxsize = 0
+        self.ttl = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Read cache settings from the app config."""
+        app.config.setdefault("IDENTITY_CACHE_SIZE", 1024)
+        app.config.setdefault("IDENTITY_CACHE_TTL", 300)
+        self.maxsize = app.config["IDENTITY_CACHE_SIZE"]
+        self.ttl = app.config["IDENTITY_CACHE_TTL"]
+        self.clear()
+        app.extensions["identity_cache"] = self
+
+    @staticmethod
+    def _stamp_key(user_id):
+        return f"identity-version:{user_id}"
+
+    def get(self, user_id):
+        """Return the snapshot for ``user_id``, loading it on a miss."""
+        stamp = cache.get(self._stamp_key(user_id))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now and entry[1] == stamp:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        # A lagging replica would cache revoked permissions for the whole TTL
+        with use_primary():
+            user = User.query.options(db.defer("password")).get(user_id)
+            if user is None:
+                return None
+            snapshot = UserSnapshot(user, compile_permissions(user))
+        if self.maxsize > 0:
+            with self._lock:
+                self._entries[user_id] = (now + self.ttl, stamp, snapshot)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, user_id):
+        """Drop ``user_id`` here and bump its version stamp for other workers."""
+        with self._lock:
+            self._entries.pop(user_id, None)
+        cache.set(self._stamp_key(user_id), time.time(), timeout=0)
+
+    def clear(self):
+        """Drop every entry and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return hit/miss counters and the current size."""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+identity_cache = IdentityCache()
+
+
+@record_committed.connect_via(User)
+def _invalidate_user(sender, identity):
+    """Invalidate the cached identity of a user whose row was written."""
+    identity_cache.invalidate(identity[0])
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_role_changes(session, flush_context):
+    """Remember the users whose roles were added, changed or removed."""
+    users = session.info.setdefault(_ROLES_CHANGED_KEY, set())
+    for role in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(role, Role):
+            history = attributes.get_history(role, "user_id")
+            users.update(history.sum())
+    users.discard(None)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_role_changes(session):
+    """Invalidate the cached identity, and permissions, of those users."""
+    for user_id in session.info.pop(_ROLES_CHANGED_KEY, ()):
+        identity_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_role_changes(session):
+    session.info.pop(_ROLES_CHANGED_KEY, None)
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""Bulk import of user accounts from CSV or JSON Lines files.
+
+Creating users one :class:`~app.user.models.User` at a time costs one bcrypt
+hash and one commit each. The importer instead streams the file in batches of
+``batch_size`` rows and hashes each batch's passwords on a process pool, while
+the previous batch is being inserted. Each batch is written with
+:meth:`~app.database.CRUDMixin.create_many` and a single commit.
+
+After every commit the number of file rows done is written to a checkpoint
+file, and an interrupted import started again resumes after them. Rows whose
+username or email is already registered are skipped, so rows committed just
+before a crash are not imported twice either.
+"""
+import csv
+import gzip
+import json
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+
+from flask import current_app
+from sqlalchemy import or_
+
+from app.database import db
+from app.extensions import bcrypt
+
+from .models import User
+
+FORMATS = ("csv", "jsonl")
+
+Progress = namedtuple("Progress", ["rows", "imported", "skipped", "elapsed"])
+
+
+def detect_format(path):
+    """Return the format of ``path`` from its extension, ignoring ``.gz``."""
+    name = path[:-3] if path.endswith(".gz") else path
+    ext = os.path.splitext(name)[1].lstrip(".").lower()
+    if ext in ("json", "ndjson"):
+        ext = "jsonl"
+    if ext not in FORMATS:
+        raise ValueError(f"Cannot tell the format of {path}, pass it explicitly")
+    return ext
+
+
+def read_rows(path, fmt):
+    """Yield the rows of a CSV or JSON Lines file as dicts, one at a time."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8", newline="") as lines:
+        if fmt == "csv":
+            yield from csv.DictReader(lines)
+        else:
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _flag(value, default=True):
+    if value is None or value == "":
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "y")
+    return bool(value)
+
+
+def hash_passwords(passwords, rounds):
+    """Hash each password; runs in the pool's worker processes."""
+    return [
+        bcrypt.generate_password_hash(password, rounds) if password else None
+        for password in passwords
+    ]
+
+
+def read_checkpoint(path):
+    """Return the number of file rows already imported, from the checkpoint."""
+    try:
+        with open(path) as checkpoint:
+            return json.load(checkpoint)["rows"]
+    except FileNotFoundError:
+        return 0
+
+
+def write_checkpoint(path, rows):
+    """Record that the first ``rows`` rows of the file are imported."""
+    partial = f"{path}.tmp"
+    with open(partial, "w") as checkpoint:
+        json.dump({"rows": rows}, checkpoint)
+    os.replace(partial, path)
+
+
+def _new_users(batch, seen):
+    """Return the rows of ``batch`` that are valid and not registered yet.
+
+    Rows whose username or email is in ``seen`` are skipped too; the usernames
+    and emails of the rows returned are added to it.
+    """
+    rows = []
+    for row in batch:
+        username = (row.get("username") or "").strip()
+        email = (row.get("email") or "").strip()
+        if username and email and username not in seen and email not in seen:
+            seen.update((username, email))
+            rows.append(dict(row, username=username, email=email))
+    if not rows:
+        return []
+    usernames = [row["username"] for row in rows]
+    emails = [row["email"] for row in rows]
+    taken = set()
+    for username, email in db.session.query(User.username, User.email).filter(
+        or_(User.username.in_(usernames), User.email.in_(emails))
+    ):
+        taken.update((username, email))
+    return [
+        row
+        for row in rows
+        if row["username"] not in taken and row["email"] not in taken
+    ]
+
+
+def _chunks(items, size):
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+def import_users(
+    path,
+    fmt=None,
+    checkpoint=None,
+    batch_size=1000,
+    workers=None,
+    progress=None,
+):
+    """Import the users of a file; returns the final :class:`Progress`.
+
+    :param checkpoint: File that records how far the import got; defaults to
+        ``<path>.checkpoint``. It is removed once the whole file is imported.
+    :param workers: Processes hashing passwords; defaults to the CPU count.
+    :param progress: Called with a :class:`Progress` after each batch.
+    """
+    fmt = fmt or detect_format(path)
+    checkpoint = checkpoint or f"{path}.checkpoint"
+    rounds = current_app.config["BCRYPT_LOG_ROUNDS"]
+    done = read_checkpoint(checkpoint)
+    rows = islice(read_rows(path, fmt), done, None)
+    # A few chunks per process keeps them all busy without much overhead.
+    chunk_size = max(1, batch_size // (4 * (workers or os.cpu_count() or 1)))
+    imported = skipped = 0
+    start = time.perf_counter()
+
+    def submit(pool, seen):
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return None
+        new = _new_users(batch, seen)
+        passwords = [row.get("password") for row in new]
+        hashes = pool.map(
+            hash_passwords, _chunks(passwords, chunk_size), repeat(rounds)
+        )
+        return batch, new, hashes
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = submit(pool, set())
+        while pending is not None:
+            batch, new, hashes = pending
+            # Hash the next batch while this one is inserted. Its rows are not
+            # in the database yet, so they are passed on as already seen.
+            seen = {row[key] for row in new for key in ("username", "email")}
+            pending = submit(pool, seen)
+            passwords = [password for chunk in hashes for password in chunk]
+            User.create_many(
+                (
+                    {
+                        "username": row["username"],
+                        "email": row["email"],
+                        "password": password,
+                        "first_name": row.get("first_name") or None,
+                        "last_name": row.get("last_name") or None,
+                        "active": _flag(row.get("active")),
+                    }
+                    for row, password in zip(new, passwords)
+                ),
+                batch_size=batch_size,
+            )
+            done += len(batch)
+            imported += len(new)
+            skipped += len(batch) - len(new)
+            write_checkpoint(checkpoint, done)
+            if progress is not None:
+                progress(
+                    Progress(done, imported, skipped, time.perf_counter() - start)
+                )
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return Progress(done, imported, skipped, time.perf_counter() - start)
@@ -3,6 +3,8 @@
 import datetime as dt
 
 from flask_login import UserMixin
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
 
 from app.database import (
     Column,
@@ -12,7 +14,19 @@ from app.database import (
     reference_col,
     relationship,
 )
-from app.extensions import bcrypt
+from app.hashing import hasher
+
+
+class UserAlreadyExists(Exception):
+    """Raised when a new user clashes with an existing username or email."""
+
+    def __init__(self, fields):
+        """Create instance.
+
+        :param fields: Set of the field names that are already taken.
+        """
+        super(UserAlreadyExists, self).__init__(", ".join(sorted(fields)))
+        self.fields = fields
 
 
 class Role(SurrogatePK, Model):
@@ -20,7 +34,12 @@ class Role(SurrogatePK, Model):
 
     __tablename__ = "roles"
     name = Column(db.String(80), unique=True, nullable=False)
-    user_id = reference_col("users", nullable=True)
+    #: Bits of :class:`app.user.permissions.Permission` the role grants
+    permissions = Column(db.Integer, nullable=False, default=0)
+    #: Loads the previous owner when changed, whose permissions must be dropped
+    user_id = db.column_property(
+        reference_col("users", nullable=True), active_history=True
+    )
     user = relationship("User", backref="roles")
 
     def __init__(self, name, **kwargs):
@@ -32,12 +51,27 @@ class Role(SurrogatePK, Model):
         return f"<Role({self.name})>"
 
 
+#: Compared byte by byte on PostgreSQL as on SQLite, so that the users starting
+#: with a prefix are one range of a plain index, sorted as the directory pages
+BytewiseString = db.String(80).with_variant(
+    db.String(80, collation="C"), "postgresql"
+)
+
+
 class User(UserMixin, SurrogatePK, Model):
     """A user of the app."""
 
     __tablename__ = "users"
-    username = Column(db.String(80), unique=True, nullable=False)
-    email = Column(db.String(80), unique=True, nullable=False)
+    __table_args__ = (
+        # Keyset pagination of the admin user directory, see app.user.directory.
+        db.Index("ix_users_created_at", "created_at", "id"),
+        db.Index("ix_users_active_created_at", "active", "created_at", "id"),
+        db.Index("ix_users_is_admin_created_at", "is_admin", "created_at", "id"),
+        db.Index("ix_users_username_prefix", "username", "id"),
+        db.Index("ix_users_email_prefix", "email", "id"),
+    )
+    username = Column(BytewiseString, unique=True, nullable=False)
+    email = Column(BytewiseString, unique=True, nullable=False)
     #: The hashed password
     password = Column(db.LargeBinary(128), nullable=True)
     created_at = Column(db.DateTime, nullable=False, default=dt.datetime.utcnow)
@@ -46,21 +80,59 @@ class User(UserMixin, SurrogatePK, Model):
     active = Column(db.Boolean(), default=False)
     is_admin = Column(db.Boolean(), default=False)
 
-    def __init__(self, username, email, password=None, **kwargs):
-        """Create instance."""
+    def __init__(self, username, email, password=None, password_hash=None, **kwargs):
+        """Create instance.
+
+        Pass ``password_hash`` instead of ``password`` when the hash has
+        already been computed, e.g. by :class:`~app.user.forms.RegisterForm`.
+        """
         db.Model.__init__(self, username=username, email=email, **kwargs)
         if password:
             self.set_password(password)
         else:
-            self.password = None
+            self.password = password_hash
+
+    @classmethod
+    def create(cls, **kwargs):
+        """Create a new user and save it the database.
+
+        A unique constraint violation, e.g. from a concurrent signup, rolls the
+        session back and is raised as :class:`UserAlreadyExists`.
+        """
+        try:
+            user = super(User, cls).create(**kwargs)
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            fields = cls.taken_fields(kwargs.get("username"), kwargs.get("email"))
+            if not fields:
+                raise
+            raise UserAlreadyExists(fields)
+        return user
+
+    @classmethod
+    def taken_fields(cls, username, email):
+        """Return which of ``username`` and ``email`` are registered, in one query."""
+        rows = (
+            db.session.query(cls.username, cls.email)
+            .filter(or_(cls.username == username, cls.email == email))
+            .all()
+        )
+        fields = set()
+        for row_username, row_email in rows:
+            if row_username == username:
+                fields.add("username")
+            if row_email == email:
+                fields.add("email")
+        return fields
 
     def set_password(self, password):
         """Set password."""
-        self.password = bcrypt.generate_password_hash(password)
+        self.password = hasher.generate_password_hash(password)
 
     def check_password(self, value):
         """Check password."""
-        return bcrypt.check_password_hash(self.password, value)
+        return hasher.check_password_hash(self.password, value)
 
     @property
     def full_name(self):
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Role based permissions, checked with one bit test.
+
+Each :class:`~app.user.models.Role` grants a set of :class:`Permission` bits.
+When the identity cache loads a user it ORs the bits of all of the user's roles
+into ``UserSnapshot.permissions`` with a single query; admins get every bit.
+Views guarded by :func:`requires` then test that integer and never touch the
+database. Adding, changing or removing a role invalidates its user's cached
+identity once the transaction commits (see :mod:`app.user.identity`), so the
+new bits apply on the next request in every worker.
+"""
+import enum
+from functools import reduce, wraps
+from operator import or_
+
+from flask import abort
+from flask_login import current_user
+
+from app.database import db
+from app.extensions import login_manager
+
+from .models import Role
+
+
+class Permission(enum.IntFlag):
+    """What a role allows, one bit each. Never reuse or renumber a bit."""
+
+    VIEW_USERS = 1 << 0
+    EXPORT_DATA = 1 << 1
+    IMPORT_USERS = 1 << 2
+    MANAGE_STOCK = 1 << 3
+    MANAGE_PROMOS = 1 << 4
+    DISPATCH_ORDERS = 1 << 5
+
+
+ALL_PERMISSIONS = int(reduce(or_, Permission))
+
+
+def mask(*permissions):
+    """Return the bits of ``permissions`` as a plain integer."""
+    return int(reduce(or_, permissions, 0))
+
+
+def compile_permissions(user):
+    """Return the permission bits granted to ``user`` by its roles."""
+    if user.is_admin:
+        return ALL_PERMISSIONS
+    rows = db.session.query(Role.permissions).filter(Role.user_id == user.id)
+    return reduce(or_, (bits for bits, in rows), 0)
+
+
+def requires(*permissions):
+    """Decorate a view to need all of ``permissions``.
+
+    Anonymous users are sent to log in; others without the bits get a 403.
+    """
+    needed = mask(*permissions)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if not current_user.is_authenticated:
+                return login_manager.unauthorized()
+            if current_user.permissions & needed != needed:
+                abort(403)
+            return view(*args, **kwargs)
+
+        return wrapped
+
+    return decorator
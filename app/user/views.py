@@ -1,7 +1,22 @@
 # -*- coding: utf-8 -*-
 """User views."""
-from flask import Blueprint, render_template
-from flask_login import login_required
+from flask import (
+    Blueprint,
+    Response,
+    abort,
+    render_template,
+    request,
+    stream_with_context,
+    url_for,
+)
+from flask_login import current_user, login_required
+
+from app import export
+from app.utils import flash_errors
+
+from . import directory
+from .forms import MemberSearchForm
+from .permissions import Permission, requires
 
 blueprint = Blueprint("user", __name__, url_prefix="/users", static_folder="../static")
 
@@ -9,5 +24,52 @@ blueprint = Blueprint("user", __name__, url_prefix="/users", static_folder="../s
 @blueprint.route("/")
 @login_required
 def members():
-    """List members."""
-    return render_template("users/members.html")
+    """List members; those who may view users get a searchable directory."""
+    if not current_user.can(Permission.VIEW_USERS):
+        return render_template("users/members.html")
+    search_form = MemberSearchForm(request.args)
+    page = first_url = next_url = None
+    if search_form.validate():
+        args = request.args.to_dict()
+        after = args.pop("after", None)
+        try:
+            page = directory.search(after=after, **search_form.filters())
+        except directory.InvalidCursor:
+            abort(400)
+        if after:
+            first_url = url_for("user.members", **args)
+        if page.next_cursor:
+            next_url = url_for("user.members", after=page.next_cursor, **args)
+    else:
+        flash_errors(search_form)
+    return render_template(
+        "users/members.html",
+        search_form=search_form,
+        page=page,
+        first_url=first_url,
+        next_url=next_url,
+        can_export=current_user.can(Permission.EXPORT_DATA),
+    )
+
+
+@blueprint.route("/export/<table>")
+@requires(Permission.EXPORT_DATA)
+def export_table(table):
+    """Stream a whole table, as ``?format=csv`` or ``jsonl``.
+
+    Add ``gzip=1`` to download it gzipped.
+    """
+    fmt = request.args.get("format", "csv")
+    compress = request.args.get("gzip") == "1"
+    if table not in export.TABLES or fmt not in export.FORMATS:
+        abort(404)
+    chunks = export.export(table, fmt, compress=compress)
+    response = Response(
+        stream_with_context(chunks),
+        mimetype="application/gzip" if compress else export.MIMETYPES[fmt],
+    )
+    response.headers["Content-Disposition"] = (
+        f"attachment; filename={export.filename(table, fmt, compress)}"
+    )
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Warm-up for freshly started workers.
+
+A recycled gunicorn worker would otherwise compile templates, open its first
+database connection, start the hashing pool and fill its caches while serving
+real requests. :func:`prepare` does the work that can be shared between
+processes (and so can run in the gunicorn master before forking when the app
+is preloaded); :func:`warm_worker` does the work each worker process needs for
+itself. Both return a report of how long each step took.
+"""
+import os
+import tempfile
+import time
+from collections import OrderedDict
+
+from jinja2 import FileSystemBytecodeCache
+
+from .extensions import db
+from .hashing import hasher
+from .pagecache import page_cache
+
+
+def init_template_cache(app):
+    """Persist compiled templates so new processes skip compiling them.
+
+    Uses ``TEMPLATE_BYTECODE_CACHE_DIR``; set it to an empty value to disable.
+    """
+    default_dir = os.path.join(tempfile.gettempdir(), "rype-jinja-cache")
+    app.config.setdefault("TEMPLATE_BYTECODE_CACHE_DIR", default_dir)
+    directory = app.config["TEMPLATE_BYTECODE_CACHE_DIR"]
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+    return None
+
+
+def compile_templates(app):
+    """Load every HTML template, compiling it or reading its bytecode."""
+    env = app.jinja_env
+    names = [name for name in env.list_templates() if name.endswith(".html")]
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+def open_connections(app):
+    """Fill the connection pool with ``WARMUP_DB_CONNECTIONS`` connections."""
+    engine = db.get_engine(app)
+    connections = [
+        engine.connect() for _ in range(app.config.get("WARMUP_DB_CONNECTIONS", 1))
+    ]
+    for connection in connections:
+        connection.close()
+    return len(connections)
+
+
+def prime_page_cache(app):
+    """Render the anonymous version of every cached page without URL arguments."""
+    urls = [
+        rule.rule
+        for rule in app.url_map.iter_rules()
+        if app.view_functions.get(rule.endpoint) in page_cache.views
+        and not rule.arguments
+    ]
+    client = app.test_client()
+    for url in urls:
+        client.get(url)
+    return len(urls)
+
+
+def _run(report, name, func, app):
+    start = time.perf_counter()
+    func(app)
+    report[name] = time.perf_counter() - start
+
+
+def format_report(title, report):
+    """Format a warm-up report as a single log line."""
+    steps = ", ".join(f"{name}={seconds:.3f}s" for name, seconds in report.items())
+    return f"{title} in {sum(report.values()):.3f}s ({steps})"
+
+
+def prepare(app):
+    """Do the process-independent warm-up: compile all templates."""
+    report = OrderedDict()
+    _run(report, "templates", compile_templates, app)
+    return report
+
+
+def warm_worker(app):
+    """Do the per-process warm-up.
+
+    Connections inherited from a preloading parent are discarded first, as
+    they must not be shared between processes.
+    """
+    report = OrderedDict()
+    with app.app_context():
+        db.get_engine(app).dispose()
+        _run(report, "database", open_connections, app)
+        _run(report, "hashing", lambda app: hasher.run(int), app)
+        _run(report, "page_cache", prime_page_cache, app)
+    return report
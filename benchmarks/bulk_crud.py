@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+r"""Bulk create/update/delete against the per-row CRUD path.
+
+Defaults to SQLite; set ``BENCH_DATABASE_URL`` to run against PostgreSQL::
+
+    python -m benchmarks.bulk_crud --rows 5000
+    BENCH_DATABASE_URL=postgresql://developer@127.0.0.1:5432/rype_bench \
+        python -m benchmarks.bulk_crud --rows 5000
+"""
+import argparse
+import time
+
+from app.database import db
+from app.user.models import User
+
+from .common import make_app
+
+
+def user_rows(count, prefix):
+    """Return ``count`` user rows with unique names."""
+    return [
+        {"username": f"{prefix}{n}", "email": f"{prefix}{n}@example.com"}
+        for n in range(count)
+    ]
+
+
+def timed(label, rows, func):
+    """Run ``func`` and print rows per second."""
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {elapsed:8.3f}s {rows / elapsed:10.0f} rows/s")
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    app = make_app()
+    print(f"{app.config['SQLALCHEMY_DATABASE_URI']}, {args.rows} rows")
+    with app.app_context():
+
+        def per_row_create():
+            for row in user_rows(args.rows, "row"):
+                User.create(**row)
+
+        def per_row_update():
+            for user in User.query.filter(User.username.like("row%")):
+                user.update(active=True)
+
+        def per_row_delete():
+            for user in User.query.filter(User.username.like("row%")):
+                user.delete()
+
+        timed("per-row create", args.rows, per_row_create)
+        timed("per-row update", args.rows, per_row_update)
+        timed("per-row delete", args.rows, per_row_delete)
+        db.session.remove()
+
+        ids = []
+
+        def bulk_create():
+            ids.extend(
+                User.create_many(
+                    user_rows(args.rows, "bulk"),
+                    batch_size=args.batch_size,
+                    return_ids=True,
+                )
+            )
+
+        timed("create_many (ids)", args.rows, bulk_create)
+        timed(
+            "update_many",
+            args.rows,
+            lambda: User.update_many(
+                [{"id": pk, "active": True} for pk in ids], batch_size=args.batch_size
+            ),
+        )
+        timed(
+            "delete_many",
+            args.rows,
+            lambda: User.delete_many(ids, batch_size=args.batch_size),
+        )
+        timed(
+            "create_many (no ids)",
+            args.rows,
+            lambda: User.create_many(
+                user_rows(args.rows, "fast"), batch_size=args.batch_size
+            ),
+        )
+
+
+if __name__ == "__main__":
+    main()
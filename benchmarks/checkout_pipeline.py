@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+r"""Throughput of the asynchronous checkout pipeline.
+
+Times submitting checkouts (what the request now waits for) against the old
+synchronous checkout, then drains the queue with ``--workers`` worker threads
+and reports orders per second. Several workers need PostgreSQL, where
+``SKIP LOCKED`` keeps them off each other's intents::
+
+    python -m benchmarks.checkout_pipeline --orders 500
+    BENCH_DATABASE_URL=postgresql://developer@127.0.0.1:5432/rype_bench \
+        python -m benchmarks.checkout_pipeline --orders 2000 --workers 4
+"""
+import argparse
+import sys
+import threading
+import time
+
+from app.database import db
+from app.shop import pipeline
+from app.shop.cart import Cart
+from app.shop.models import MenuItem, OrderIntent
+from app.user.models import User
+
+from .common import make_app, print_summary, summarize
+
+
+def fill(key, items):
+    """A saved cart holding one of each item."""
+    cart = Cart(key)
+    for item in items:
+        cart.add(item)
+    cart.save()
+    return cart
+
+
+def work(app, processed):
+    """Run worker steps until the queue is empty."""
+    with app.app_context():
+        steps = 0
+        while pipeline.process_next() is not None:
+            steps += 1
+        db.session.remove()
+    processed.append(steps)
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=500)
+    parser.add_argument("--items", type=int, default=3, help="items per order")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    app = make_app()
+    url = app.config["SQLALCHEMY_DATABASE_URI"]
+    if args.workers > 1 and url.startswith("sqlite"):
+        sys.exit("SQLite has no row locks; use one worker or PostgreSQL")
+    print(f"{url}, {args.orders} orders, {args.workers} workers")
+    with app.app_context():
+        user = User.create(username="bench", email="bench@example.com")
+        for n in range(args.items):
+            MenuItem.create(name=f"dish{n}", price_cents=100 + n)
+        items = MenuItem.query.all()
+
+        latencies = []
+        for n in range(args.orders):
+            cart = fill(f"cart:sync{n}", items)
+            start = time.perf_counter()
+            cart.checkout(user.id)
+            latencies.append(time.perf_counter() - start)
+        print_summary("synchronous checkout", summarize(latencies))
+
+        latencies = []
+        for n in range(args.orders):
+            cart = fill(f"cart:async{n}", items)
+            start = time.perf_counter()
+            pipeline.submit(cart, user.id, f"key{n}")
+            latencies.append(time.perf_counter() - start)
+        print_summary("submit intent", summarize(latencies))
+        db.session.remove()
+
+    processed = []
+    workers = [
+        threading.Thread(target=work, args=(app, processed))
+        for _ in range(args.workers)
+    ]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    with app.app_context():
+        paid = OrderIntent.query.filter_by(status=pipeline.PAID).count()
+    print(
+        f"pipeline: {paid} orders paid in {elapsed:.2f}s, "
+        f"{paid / elapsed:.0f} orders/s, {sum(processed) / elapsed:.0f} steps/s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""Helpers shared by the benchmark scripts."""
+import logging
+
+from app.app import create_app
+from app.database import db
+
+
+def make_app(config_object="benchmarks.settings"):
+    """Create a quiet app with a freshly created schema."""
+    app = create_app(config_object)
+    app.logger.setLevel(logging.CRITICAL)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    return app
+
+
+def percentile(samples, pct):
+    """Return the ``pct`` percentile of ``samples`` (nearest rank)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def summarize(latencies):
+    """Summarize a list of latencies in seconds as milliseconds."""
+    return {
+        "count": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+def print_summary(title, summary):
+    """Print a summary produced by :func:`summarize`."""
+    print(
+        f"{title}: n={summary['count']} p50={summary['p50_ms']:.1f}ms "
+        f"p95={summary['p95_ms']:.1f}ms p99={summary['p99_ms']:.1f}ms "
+        f"max={summary['max_ms']:.1f}ms"
+    )
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""Scaling of the dispatch cost matrix and assignment solvers.
+
+For growing batches of orders and couriers scattered over Manhattan, times
+building the ETA matrix with NumPy against a per-pair Python loop, then the
+solvers: SciPy (when installed), the bundled Hungarian solver, greedy matching
+over each order's nearest couriers, and handing each order to the nearest free
+courier in turn. Reports each solver's total pickup time and how many orders
+it assigned::
+
+    python -m benchmarks.dispatch --sizes 100 300 1000
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+
+from app.shop import dispatch
+from app.shop.nearby import EARTH_RADIUS_KM
+
+LAT_RANGE = (40.70, 40.82)
+LON_RANGE = (-74.02, -73.93)
+SPEED_KMH = 15
+
+
+def per_pair_eta(orders, couriers):
+    """ETA matrix with one haversine per pair in Python."""
+    rows = []
+    for order_lat, order_lon in orders:
+        row = []
+        for courier_lat, courier_lon in couriers:
+            a = (
+                math.sin(math.radians(courier_lat - order_lat) / 2) ** 2
+                + math.cos(math.radians(order_lat))
+                * math.cos(math.radians(courier_lat))
+                * math.sin(math.radians(courier_lon - order_lon) / 2) ** 2
+            )
+            row.append(2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a)) / SPEED_KMH * 60)
+        rows.append(row)
+    return rows
+
+
+def nearest_first(cost):
+    """Give each order, oldest first, the nearest courier still free."""
+    free = np.ones(cost.shape[1], dtype=bool)
+    rows, cols = [], []
+    for row in range(cost.shape[0]):
+        if not free.any():
+            break
+        col = int(np.argmin(np.where(free, cost[row], np.inf)))
+        free[col] = False
+        rows.append(row)
+        cols.append(col)
+    return np.array(rows), np.array(cols)
+
+
+def timed(func, *args):
+    """Return ``func(*args)`` and the seconds it took."""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 300, 1000])
+    parser.add_argument("--candidates", type=int, default=8)
+    parser.add_argument(
+        "--hungarian-limit",
+        type=int,
+        default=1000,
+        help="largest size to run the bundled Hungarian solver at",
+    )
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    for size in args.sizes:
+        orders = np.column_stack(
+            [rng.uniform(*LAT_RANGE, size), rng.uniform(*LON_RANGE, size)]
+        )
+        couriers = np.column_stack(
+            [rng.uniform(*LAT_RANGE, size), rng.uniform(*LON_RANGE, size)]
+        )
+        (_, cost), vectorized = timed(
+            dispatch.eta_minutes,
+            orders[:, 0],
+            orders[:, 1],
+            couriers[:, 0],
+            couriers[:, 1],
+            SPEED_KMH,
+        )
+        _, looped = timed(per_pair_eta, orders.tolist(), couriers.tolist())
+        print(
+            f"{size}x{size}: cost matrix numpy {vectorized * 1000:.1f}ms, "
+            f"per pair {looped * 1000:.1f}ms"
+        )
+
+        solvers = [("nearest first", nearest_first)]
+        solvers.append(
+            ("greedy", lambda cost: dispatch.greedy(cost, args.candidates))
+        )
+        if size <= args.hungarian_limit:
+            solvers.append(("hungarian", dispatch.hungarian))
+        if dispatch.linear_sum_assignment is not None:
+            solvers.append(("scipy", dispatch.linear_sum_assignment))
+        for name, solver in solvers:
+            (rows, cols), seconds = timed(solver, cost)
+            print(
+                f"  {name:<14} {seconds * 1000:9.1f}ms  assigned {len(rows):5d}  "
+                f"mean pickup {cost[rows, cols].mean():5.2f}min"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Memory and throughput of streaming the users table out.
+
+Grows the table to each of ``--rows`` and exports it, as a file would be
+written, reporting rows per second and the peak Python memory allocated while
+exporting. The peak should stay flat as the table grows. Defaults to SQLite;
+set ``BENCH_DATABASE_URL`` to run against PostgreSQL, where the rows come from
+a server-side cursor::
+
+    python -m benchmarks.export
+    python -m benchmarks.export --rows 10000 100000 1000000 --format jsonl --gzip
+"""
+import argparse
+import time
+import tracemalloc
+
+from app import export
+from app.user.models import User
+
+from .common import make_app
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--format", choices=export.FORMATS, default="csv")
+    parser.add_argument("--gzip", action="store_true")
+    args = parser.parse_args()
+
+    app = make_app()
+    print(f"{app.config['SQLALCHEMY_DATABASE_URI']}, {args.format}, gzip={args.gzip}")
+    with app.app_context():
+        count = 0
+        for rows in sorted(args.rows):
+            User.create_many(
+                {"username": f"user{n}", "email": f"user{n}@example.com"}
+                for n in range(count, rows)
+            )
+            count = rows
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            size = sum(
+                len(chunk)
+                for chunk in export.export("users", args.format, compress=args.gzip)
+            )
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(
+                f"{rows:>9} rows: {rows / elapsed:8.0f} rows/s, "
+                f"{size / 2 ** 20:7.1f} MiB out, peak {peak / 2 ** 20:5.2f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Throughput of importing users from a file against creating them one by one.
+
+Writes ``--rows`` users to a CSV file, then creates a sample of them one
+``User`` at a time and imports the whole file with ``--workers`` hashing
+processes, at ``--rounds`` bcrypt rounds. Defaults to SQLite; set
+``BENCH_DATABASE_URL`` to run against PostgreSQL::
+
+    python -m benchmarks.import_users
+    python -m benchmarks.import_users --rows 100000 --rounds 12 --workers 8
+"""
+import argparse
+import csv
+import os
+import tempfile
+import time
+
+from app.extensions import bcrypt
+from app.user import importer
+from app.user.models import User
+
+from .common import make_app
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--per-row", type=int, default=200, help="rows created singly")
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    app = make_app()
+    app.config["BCRYPT_LOG_ROUNDS"] = args.rounds
+    bcrypt.init_app(app)
+    print(
+        f"{app.config['SQLALCHEMY_DATABASE_URI']}, {args.rows} rows, "
+        f"{args.rounds} rounds, {args.workers} workers"
+    )
+    with tempfile.TemporaryDirectory() as tmp, app.app_context():
+        path = os.path.join(tmp, "users.csv")
+        with open(path, "w", newline="") as out:
+            writer = csv.writer(out)
+            writer.writerow(["username", "email", "password"])
+            for n in range(args.rows):
+                writer.writerow([f"user{n}", f"user{n}@example.com", f"secret{n}"])
+
+        start = time.perf_counter()
+        for n in range(args.per_row):
+            User.create(
+                username=f"single{n}",
+                email=f"single{n}@example.com",
+                password=f"secret{n}",
+            )
+        elapsed = time.perf_counter() - start
+        print(f"{'per-row create':<16} {args.per_row / elapsed:8.0f} users/s")
+
+        result = importer.import_users(
+            path, batch_size=args.batch_size, workers=args.workers
+        )
+        print(
+            f"{'import-users':<16} {result.imported / result.elapsed:8.0f} users/s "
+            f"({result.imported} in {result.elapsed:.1f}s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
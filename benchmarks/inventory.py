@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+r"""Contention of concurrent checkouts of one item on its stock rows.
+
+Spawns ``--greenlets`` greenlets that each take one unit of the same menu item
+``--orders`` times, one transaction per unit, first with the stock in a single
+row (every checkout queues on the same row lock) and then split over each of
+``--shards`` rows. Reports checkouts per second and the latency percentiles.
+Needs PostgreSQL, as SQLite locks the whole database::
+
+    BENCH_DATABASE_URL=postgresql://... python -m benchmarks.inventory
+    BENCH_DATABASE_URL=postgresql://... python -m benchmarks.inventory \
+        --greenlets 500 --shards 1 8 32
+"""
+# Patch before anything imports the stdlib modules gevent replaces
+# isort:skip_file
+from gevent import monkey
+
+monkey.patch_all()  # noqa: E402
+
+import argparse  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+
+import gevent  # noqa: E402
+
+from app.database import db  # noqa: E402
+from app.shop import inventory  # noqa: E402
+from app.shop.models import MenuItem  # noqa: E402
+
+from .common import make_app, print_summary, summarize  # noqa: E402
+
+
+def checkout(app, item_id, orders, latencies):
+    """Take one unit of the item ``orders`` times, committing each."""
+    with app.app_context():
+        for _ in range(orders):
+            start = time.perf_counter()
+            inventory.reserve([(item_id, 1)])
+            db.session.commit()
+            latencies.append(time.perf_counter() - start)
+        db.session.remove()
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--greenlets", type=int, default=300)
+    parser.add_argument("--orders", type=int, default=10, help="per greenlet")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 8, 32])
+    args = parser.parse_args()
+
+    app = make_app()
+    if db.get_engine(app).dialect.name != "postgresql":
+        sys.exit("inventory needs BENCH_DATABASE_URL to point at PostgreSQL")
+    with app.app_context():
+        item_id = MenuItem.create(name="hot dish", price_cents=500).id
+        pool = db.get_engine(app).pool.size()
+        overflow = app.config["DB_MAX_OVERFLOW"]
+    print(
+        f"{args.greenlets} greenlets x {args.orders} checkouts of one item, "
+        f"pool {pool}+{overflow}"
+    )
+
+    total = args.greenlets * args.orders
+    for shards in args.shards:
+        with app.app_context():
+            inventory.set_stock(item_id, total, shards=shards)
+            db.session.commit()
+        latencies = []
+        start = time.perf_counter()
+        gevent.joinall(
+            [
+                gevent.spawn(checkout, app, item_id, args.orders, latencies)
+                for _ in range(args.greenlets)
+            ],
+            raise_error=True,
+        )
+        elapsed = time.perf_counter() - start
+        with app.app_context():
+            left = inventory.stock_levels([item_id])[item_id]
+        print_summary(
+            f"{shards:3d} shards: {len(latencies) / elapsed:7.0f} checkouts/s, "
+            f"{left} left",
+            summarize(latencies),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Latency of other routes while a burst of logins is being hashed.
+
+Serves the app from a single gevent WSGI server (like one gunicorn ``-k gevent``
+worker), fires a burst of concurrent logins and probes ``/about/`` throughout.
+Run it with and without ``--inline`` to compare the hashing pool against
+hashing on the event loop::
+
+    python -m benchmarks.login_burst --logins 100
+    python -m benchmarks.login_burst --logins 100 --inline
+"""
+# Patch before anything imports the stdlib modules gevent replaces
+# isort:skip_file
+from gevent import monkey
+
+monkey.patch_all()  # noqa: E402
+
+import argparse  # noqa: E402
+import time  # noqa: E402
+from urllib.error import HTTPError  # noqa: E402
+from urllib.parse import urlencode  # noqa: E402
+from urllib.request import urlopen  # noqa: E402
+
+import gevent  # noqa: E402
+from gevent.pywsgi import WSGIServer  # noqa: E402
+
+from app.hashing import hasher  # noqa: E402
+from app.user.models import User  # noqa: E402
+
+from .common import make_app, print_summary, summarize  # noqa: E402
+
+
+def fetch(url, data=None):
+    """Request ``url`` and read the body, ignoring HTTP error statuses."""
+    try:
+        with urlopen(url, data=data) as response:
+            response.read()
+    except HTTPError as error:
+        error.read()
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--probe-interval", type=float, default=0.01)
+    parser.add_argument(
+        "--inline", action="store_true", help="hash on the event loop (no pool)"
+    )
+    args = parser.parse_args()
+
+    app = make_app()
+    if args.inline:
+        hasher.pool_size = 0
+    with app.app_context():
+        User.create(
+            username="bench",
+            email="bench@example.com",
+            password="benchmark",
+            active=True,
+        )
+
+    server = WSGIServer(("127.0.0.1", 0), app, log=None)
+    server.start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    probe_latencies = []
+    login_latencies = []
+    done = []
+
+    def probe():
+        while not done:
+            start = time.perf_counter()
+            fetch(f"{base_url}/about/")
+            probe_latencies.append(time.perf_counter() - start)
+            gevent.sleep(args.probe_interval)
+
+    def login():
+        body = urlencode({"username": "bench", "password": "benchmark"}).encode()
+        start = time.perf_counter()
+        fetch(f"{base_url}/", data=body)
+        login_latencies.append(time.perf_counter() - start)
+
+    prober = gevent.spawn(probe)
+    started = time.perf_counter()
+    gevent.joinall([gevent.spawn(login) for _ in range(args.logins)])
+    elapsed = time.perf_counter() - started
+    done.append(True)
+    prober.join()
+    server.stop()
+
+    mode = "inline" if args.inline else f"pool({hasher.pool_size})"
+    print(f"{args.logins} logins in {elapsed:.2f}s, hashing {mode}")
+    print_summary("login", summarize(login_latencies))
+    print_summary("/about/ during burst", summarize(probe_latencies))
+
+
+if __name__ == "__main__":
+    main()
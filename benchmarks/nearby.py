@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Nearest-restaurant queries against the grid index and a full scan.
+
+Loads random restaurants around Manhattan into a :class:`GridIndex` and times
+K-nearest queries, single-point updates, and the two full-scan alternatives: a
+vectorized haversine over every row and the per-row loop it replaces::
+
+    python -m benchmarks.nearby --restaurants 100000 --k 10
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+
+from app.shop.nearby import EARTH_RADIUS_KM, GridIndex, haversine_km
+
+from .common import print_summary, summarize
+
+#: Roughly Manhattan and the surrounding boroughs
+LAT_RANGE = (40.55, 40.92)
+LON_RANGE = (-74.10, -73.75)
+
+
+def per_row_nearest(rows, lat, lon, k):
+    """Haversine on every row in Python, then sort."""
+    distances = []
+    for restaurant_id, row_lat, row_lon in rows:
+        dlat = math.radians(row_lat - lat)
+        dlon = math.radians(row_lon - lon)
+        a = (
+            math.sin(dlat / 2) ** 2
+            + math.cos(math.radians(lat))
+            * math.cos(math.radians(row_lat))
+            * math.sin(dlon / 2) ** 2
+        )
+        distances.append((2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a)), restaurant_id))
+    distances.sort()
+    return distances[:k]
+
+
+def vectorized_nearest(ids, lats, lons, lat, lon, k):
+    """Haversine on every row with NumPy, then partition."""
+    distances = haversine_km(lat, lon, lats, lons)
+    closest = np.argpartition(distances, k - 1)[:k]
+    return ids[closest[np.argsort(distances[closest])]]
+
+
+def timed(func, queries):
+    """Run ``func(lat, lon)`` for each query; return the latencies."""
+    latencies = []
+    for lat, lon in queries:
+        start = time.perf_counter()
+        func(lat, lon)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--restaurants", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--cell-degrees", type=float, default=0.01)
+    parser.add_argument(
+        "--per-row-queries",
+        type=int,
+        default=20,
+        help="queries for the slow per-row scan",
+    )
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    ids = np.arange(1, args.restaurants + 1)
+    lats = rng.uniform(*LAT_RANGE, size=args.restaurants)
+    lons = rng.uniform(*LON_RANGE, size=args.restaurants)
+    queries = list(
+        zip(
+            rng.uniform(*LAT_RANGE, size=args.queries),
+            rng.uniform(*LON_RANGE, size=args.queries),
+        )
+    )
+    print(f"{args.restaurants} restaurants, k={args.k}")
+
+    grid = GridIndex(args.cell_degrees)
+    start = time.perf_counter()
+    grid.load(ids, lats, lons)
+    print(f"load: {time.perf_counter() - start:.3f}s")
+
+    print_summary(
+        "grid", summarize(timed(lambda a, b: grid.nearest(a, b, args.k), queries))
+    )
+    print_summary(
+        "vectorized scan",
+        summarize(
+            timed(
+                lambda a, b: vectorized_nearest(ids, lats, lons, a, b, args.k),
+                queries,
+            )
+        ),
+    )
+    rows = list(zip(ids.tolist(), lats.tolist(), lons.tolist()))
+    print_summary(
+        "per-row scan",
+        summarize(
+            timed(
+                lambda a, b: per_row_nearest(rows, a, b, args.k),
+                queries[: args.per_row_queries],
+            )
+        ),
+    )
+
+    moves = rng.randint(1, args.restaurants + 1, size=args.queries)
+    start = time.perf_counter()
+    for restaurant_id, (lat, lon) in zip(moves.tolist(), queries):
+        grid.upsert(restaurant_id, lat, lon)
+    elapsed = time.perf_counter() - start
+    print(f"upsert: {elapsed / len(moves) * 1e6:.1f}us per restaurant")
+
+    for restaurant_id, lat, lon in zip(moves.tolist(), *zip(*queries)):
+        lats[restaurant_id - 1], lons[restaurant_id - 1] = lat, lon
+    mismatches = sum(
+        [found for found, _ in grid.nearest(lat, lon, args.k)]
+        != vectorized_nearest(ids, lats, lons, lat, lon, args.k).tolist()
+        for lat, lon in queries[:100]
+    )
+    print(f"mismatches against a full scan: {mismatches}/100")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Fanning order status events out to idle Server-Sent Events connections.
+
+Opens ``--clients`` event streams in one gevent worker, one greenlet each, and
+measures the memory they hold while idle. Then publishes ``--rounds`` batches
+of events to ``--active`` of the customers and reports the delay from publish
+to the event being written to the stream. ``--slow`` of the clients never read
+and are dropped once their buffers fill::
+
+    python -m benchmarks.order_events
+    python -m benchmarks.order_events --clients 20000 --active 2000
+"""
+# Patch before anything imports the stdlib modules gevent replaces
+# isort:skip_file
+from gevent import monkey
+
+monkey.patch_all()  # noqa: E402
+
+import argparse  # noqa: E402
+import datetime as dt  # noqa: E402
+import time  # noqa: E402
+import tracemalloc  # noqa: E402
+
+import gevent  # noqa: E402
+
+from app.shop.status import StatusEvent, status_hub  # noqa: E402
+
+from .common import make_app, print_summary, summarize  # noqa: E402
+
+
+def listen(subscriber, published, latencies):
+    """Read the stream of ``subscriber`` like a connected browser would."""
+    for chunk in status_hub.stream(subscriber):
+        if chunk.startswith("id: "):
+            event_id = int(chunk[4 : chunk.index("\n")])
+            latencies.append(time.perf_counter() - published[event_id])
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=10000)
+    parser.add_argument("--active", type=int, default=1000, help="customers")
+    parser.add_argument("--slow", type=int, default=100, help="clients")
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    app = make_app()
+    app.config["ORDER_EVENTS_MAX_CLIENTS"] = args.clients
+    with app.app_context():
+        buffer = app.config["ORDER_EVENTS_BUFFER"]
+        latencies = []
+        published = {}
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        greenlets = []
+        slow = []
+        for user_id in range(1, args.clients + 1):
+            subscriber = status_hub.subscribe(user_id, start=False)
+            if user_id <= args.slow:
+                slow.append(subscriber)
+            else:
+                greenlets.append(
+                    gevent.spawn(listen, subscriber, published, latencies)
+                )
+        gevent.sleep(0.5)
+        idle = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        print(
+            f"{args.clients} idle clients: {idle / 2 ** 20:.1f} MiB, "
+            f"{idle / args.clients / 1024:.1f} KiB each"
+        )
+
+        event_id = 0
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            events = []
+            for user_id in range(1, args.active + 1):
+                event_id += 1
+                now = dt.datetime.utcnow()
+                events.append(StatusEvent(event_id, event_id, user_id, "placed", now))
+                published[event_id] = time.perf_counter()
+            status_hub.publish(events)
+            gevent.sleep(0)
+        while len(latencies) < status_hub.published - len(slow) * buffer:
+            gevent.sleep(0.01)
+        elapsed = time.perf_counter() - start
+
+        print_summary(
+            f"{args.active} customers x {args.rounds} rounds, "
+            f"{len(latencies) / elapsed:.0f} events/s",
+            summarize(latencies),
+        )
+        stats = status_hub.stats()
+        print(
+            f"{stats['dropped']} of {len(slow)} slow clients dropped, "
+            f"{stats['clients']} still connected"
+        )
+        gevent.killall(greenlets)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""Requests per second of the cached public pages, with and without the cache.
+
+Run with::
+
+    python -m benchmarks.page_cache --requests 2000
+"""
+import argparse
+import time
+
+from app.pagecache import page_cache
+
+from .common import make_app
+
+PAGES = [
+    "/about/",
+    "/customerHome/",
+    "/customerShoppingCart/",
+    "/customerDeliveryRating/",
+    "/customerFoodRating/",
+    "/customerPay/",
+]
+
+
+def requests_per_second(client, url, count):
+    """Issue ``count`` GETs to ``url`` and return the rate."""
+    client.get(url)
+    start = time.perf_counter()
+    for _ in range(count):
+        client.get(url)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args()
+
+    app = make_app()
+    client = app.test_client()
+    print(f"{'page':<28}{'uncached':>12}{'cached':>12}{'speedup':>10}")
+    for url in PAGES:
+        page_cache.enabled = False
+        uncached = requests_per_second(client, url, args.requests)
+        page_cache.enabled = True
+        cached = requests_per_second(client, url, args.requests)
+        print(
+            f"{url:<28}{uncached:>10.0f}/s{cached:>10.0f}/s{cached / uncached:>9.1f}x"
+        )
+    print(page_cache.stats())
+
+
+if __name__ == "__main__":
+    main()
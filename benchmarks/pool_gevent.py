@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Progress of concurrent greenlets while slow queries hold pooled connections.
+
+Spawns greenlets that each run ``SELECT pg_sleep(...)`` through the app's
+engine, while a ticker greenlet counts how often it gets to run. With the green
+psycopg2 wait callback the ticker keeps ticking and the queries overlap; run
+with ``--blocking`` to see the whole worker stall instead. Needs PostgreSQL::
+
+    BENCH_DATABASE_URL=postgresql://... python -m benchmarks.pool_gevent
+    BENCH_DATABASE_URL=postgresql://... python -m benchmarks.pool_gevent --blocking
+"""
+# Patch before anything imports the stdlib modules gevent replaces
+# isort:skip_file
+from gevent import monkey
+
+monkey.patch_all()  # noqa: E402
+
+import argparse  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+
+import gevent  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+from app.database import db  # noqa: E402
+from app.dbpool import pool_stats  # noqa: E402
+
+from .common import make_app  # noqa: E402
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--greenlets", type=int, default=50)
+    parser.add_argument("--sleep", type=float, default=0.5)
+    parser.add_argument("--tick", type=float, default=0.01)
+    parser.add_argument(
+        "--blocking", action="store_true", help="remove the green wait callback"
+    )
+    args = parser.parse_args()
+
+    app = make_app()
+    if db.get_engine(app).dialect.name != "postgresql":
+        sys.exit("pool_gevent needs BENCH_DATABASE_URL to point at PostgreSQL")
+    if args.blocking:
+        from psycopg2 import extensions
+
+        extensions.set_wait_callback(None)
+
+    ticks = []
+    done = []
+
+    def ticker():
+        while not done:
+            ticks.append(time.perf_counter())
+            gevent.sleep(args.tick)
+
+    def query():
+        with app.app_context():
+            db.session.execute(text("SELECT pg_sleep(:s)"), {"s": args.sleep})
+            db.session.remove()
+
+    with app.app_context():
+        pool = db.get_engine(app).pool
+        pool_size = pool.size()
+        overflow = app.config["DB_MAX_OVERFLOW"]
+    ticking = gevent.spawn(ticker)
+    started = time.perf_counter()
+    gevent.joinall([gevent.spawn(query) for _ in range(args.greenlets)])
+    elapsed = time.perf_counter() - started
+    done.append(True)
+    ticking.join()
+
+    gaps = [b - a for a, b in zip(ticks, ticks[1:])]
+    mode = "blocking" if args.blocking else "green"
+    print(
+        f"{args.greenlets} x pg_sleep({args.sleep}) in {elapsed:.2f}s, {mode}, "
+        f"pool {pool_size}+{overflow}"
+    )
+    print(
+        f"ticker: {len(ticks)} ticks, longest stall {max(gaps or [0]) * 1000:.1f}ms"
+    )
+    print(
+        f"pool: {pool_stats['checkouts']} checkouts, "
+        f"{pool_stats['wait_seconds']:.2f}s waiting, {pool_stats['timeouts']} timeouts"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""Promo code lookup and evaluation, and concurrent redemptions.
+
+Prices a full cart with a code looked up in the in-memory index against
+querying the code (and, for restaurant scoped codes, the restaurant's items)
+per request. Then redeems a capped code from ``--threads`` threads at once and
+checks that exactly ``max_uses`` checkouts got it. Runs on the shared memory
+cache, whose increments are atomic::
+
+    python -m benchmarks.promos --codes 10000 --lookups 2000
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from app.database import db, unit_of_work
+from app.extensions import cache
+from app.shop import promos
+from app.shop.cart import Cart, CartError
+from app.shop.models import MenuItem, PromoCode, PromoRedemption, Restaurant
+from app.user.models import User
+
+from .common import make_app, print_summary, summarize
+
+
+def query_promo(code):
+    """Load and compile a code from the database, as a per-request lookup would."""
+    row = PromoCode.query.filter_by(code=code, active=True).first()
+    items = {}
+    if row is not None and row.restaurant_id is not None:
+        items[row.restaurant_id] = [
+            item_id
+            for item_id, in db.session.query(MenuItem.id).filter_by(
+                restaurant_id=row.restaurant_id
+            )
+        ]
+    return promos.Promo.compile(row, items)
+
+
+def timed_pricing(lookup, cart, codes, lookups):
+    """Latencies of looking up a random code and pricing ``cart`` with it."""
+    latencies = []
+    for _ in range(lookups):
+        code = random.choice(codes)
+        start = time.perf_counter()
+        promo = lookup(code)
+        if promo.check(cart) is None:
+            promo.discount(cart)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def redeem_all(app, cart, user_ids, results):
+    """Check out ``cart`` once for each user, recording who got the code."""
+    with app.app_context():
+        for user_id in user_ids:
+            try:
+                with unit_of_work():
+                    cart.place_order(user_id)
+                results.append(user_id)
+            except CartError:
+                pass
+        db.session.remove()
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--codes", type=int, default=10000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--max-uses", type=int, default=50)
+    args = parser.parse_args()
+
+    app = make_app()
+    cache_dir = tempfile.mkdtemp()
+    cache.init_app(
+        app,
+        config={
+            "CACHE_TYPE": "app.sharedcache.shared_memory",
+            "CACHE_SHARED_PATH": os.path.join(cache_dir, "cache"),
+        },
+    )
+    with app.app_context():
+        restaurants = [Restaurant.create(name=f"r{n}") for n in range(20)]
+        items = [
+            MenuItem(
+                name=f"dish{n}",
+                price_cents=100 + n,
+                restaurant=restaurants[n % len(restaurants)],
+            )
+            for n in range(400)
+        ]
+        db.session.add_all(items)
+        db.session.commit()
+        db.session.bulk_insert_mappings(
+            PromoCode,
+            [
+                {
+                    "code": f"CODE{n}",
+                    "kind": "percent" if n % 2 else "fixed",
+                    "value": 10 if n % 2 else 500,
+                    "min_subtotal_cents": 1000,
+                    "restaurant_id": restaurants[n % 20].id if n % 3 == 0 else None,
+                    "active": True,
+                }
+                for n in range(args.codes)
+            ],
+        )
+        db.session.commit()
+        promos.promo_index.changed()
+        codes = [f"CODE{n}" for n in range(args.codes)]
+        cart = Cart("cart:bench")
+        # A cart holds the items of one restaurant
+        for item in items[:: len(restaurants)]:
+            cart.add(item, 2)
+
+        start = time.perf_counter()
+        promos.promo_index.get(codes[0])
+        print(f"index load of {args.codes} codes: {time.perf_counter() - start:.2f}s")
+        print_summary(
+            "in-memory index",
+            summarize(
+                timed_pricing(promos.promo_index.get, cart, codes, args.lookups)
+            ),
+        )
+        print_summary(
+            "query per lookup",
+            summarize(timed_pricing(query_promo, cart, codes, args.lookups)),
+        )
+
+        capped = PromoCode.create(code="CAPPED", kind="fixed", value=100)
+        capped.update(max_uses=args.max_uses)
+        capped_id = capped.id
+        cart.apply_promo("CAPPED")
+        cart.save()
+        users = [
+            User(username=f"u{n}", email=f"u{n}@example.com", active=True)
+            for n in range(args.threads * args.max_uses // 2)
+        ]
+        db.session.add_all(users)
+        db.session.commit()
+        user_ids = [user.id for user in users]
+        db.session.remove()
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=redeem_all,
+            args=(app, cart, user_ids[n :: args.threads], results),
+        )
+        for n in range(args.threads)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    with app.app_context():
+        recorded = PromoRedemption.query.filter_by(promo_id=capped_id).count()
+    print(
+        f"redemptions: {len(user_ids)} checkouts on {args.threads} threads in "
+        f"{elapsed:.2f}s, {len(results)} got the code, {recorded} recorded, "
+        f"cap {args.max_uses}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+"""Settings module for benchmark runs.
+
+Point ``BENCH_DATABASE_URL`` at a PostgreSQL database to benchmark against the
+production engine; the default is a throwaway SQLite file.
+"""
+import os
+
+ENV = "production"
+SQLALCHEMY_DATABASE_URI = os.environ.get(
+    "BENCH_DATABASE_URL", "sqlite:////tmp/rype-bench.db"
+)
+SECRET_KEY = "not-so-secret-in-benchmarks"
+BCRYPT_LOG_ROUNDS = int(os.environ.get("BENCH_BCRYPT_LOG_ROUNDS", 13))
+DEBUG_TB_ENABLED = False
+CACHE_TYPE = "simple"
+SQLALCHEMY_TRACK_MODIFICATIONS = False
+WEBPACK_MANIFEST_PATH = "webpack/manifest.json"
+WTF_CSRF_ENABLED = False
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""Reproducible in-process benchmark suite, run by ``flask bench``.
+
+Each scenario drives the real app through WebTest against a freshly seeded
+database and records latency and the number of SQL statements per request.
+"""
+import logging
+import tempfile
+import time
+
+from sqlalchemy import event
+from webtest import TestApp
+
+from app.app import create_app
+from app.database import db
+from app.hashing import hasher
+from app.user.models import User
+
+from . import settings
+from .common import summarize
+
+#: Metrics compared against the baseline, and whether higher is better
+COMPARED = {
+    "ops_per_sec": True,
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+    "queries_per_request": False,
+}
+
+CUSTOMER_PAGES = [
+    "/about/",
+    "/customerHome/",
+    "/customerShoppingCart/",
+    "/customerDeliveryRating/",
+    "/customerFoodRating/",
+    "/customerPay/",
+]
+
+
+class _Config(object):
+    """Benchmark settings with command line overrides."""
+
+    def __init__(self, **overrides):
+        for name in dir(settings):
+            if name.isupper():
+                setattr(self, name, getattr(settings, name))
+        for name, value in overrides.items():
+            setattr(self, name, value)
+
+
+def make_app(database_url=None, bcrypt_rounds=4):
+    """Create the app on a fresh schema seeded with ``seed_users`` users."""
+    overrides = {
+        "BCRYPT_LOG_ROUNDS": bcrypt_rounds,
+        "METRICS_DIR": tempfile.mkdtemp(prefix="rype-bench-metrics-"),
+    }
+    if database_url:
+        overrides["SQLALCHEMY_DATABASE_URI"] = database_url
+    app = create_app(_Config(**overrides))
+    app.logger.setLevel(logging.CRITICAL)
+    return app
+
+
+def seed(app, users):
+    """Create the schema, ``users`` filler users, the ``bench`` user and an admin."""
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        password_hash = hasher.generate_password_hash("benchmark")
+        User.create_many(
+            {
+                "username": f"seed{n}",
+                "email": f"seed{n}@example.com",
+                "password": password_hash,
+                "active": True,
+            }
+            for n in range(users)
+        )
+        User.create_many(
+            [
+                {
+                    "username": "bench",
+                    "email": "bench@example.com",
+                    "password": password_hash,
+                    "active": True,
+                },
+                {
+                    "username": "admin",
+                    "email": "admin@example.com",
+                    "password": password_hash,
+                    "active": True,
+                    "is_admin": True,
+                },
+            ]
+        )
+
+
+def _login(testapp, username="bench"):
+    testapp.post("/", {"username": username, "password": "benchmark"}, status=302)
+
+
+def scenarios(testapp):
+    """Return ``(name, setup, operation)`` tuples; ``operation`` takes the run index."""
+
+    def login(i):
+        testapp.reset()
+        _login(testapp)
+
+    def register(i):
+        testapp.post(
+            "/register/",
+            {
+                "username": f"new{i}",
+                "email": f"new{i}@example.com",
+                "password": "secret",
+                "confirm": "secret",
+            },
+            status=302,
+        )
+
+    def anonymous():
+        testapp.reset()
+
+    def logged_in():
+        testapp.reset()
+        _login(testapp)
+
+    def admin():
+        testapp.reset()
+        _login(testapp, "admin")
+
+    result = [
+        ("login", anonymous, login),
+        ("register", anonymous, register),
+        ("members", logged_in, lambda i: testapp.get("/users/", status=200)),
+        ("directory", admin, lambda i: testapp.get("/users/", status=200)),
+    ]
+    for url in CUSTOMER_PAGES:
+        result.append(
+            (url.strip("/"), anonymous, lambda i, url=url: testapp.get(url, status=200))
+        )
+    return result
+
+
+def run(app, requests=200, warmup=10):
+    """Run every scenario and return ``{name: summary}``."""
+    testapp = TestApp(app)
+    statements = [0]
+
+    def count(*args):
+        statements[0] += 1
+
+    results = {}
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "after_cursor_execute", count)
+    try:
+        offset = 0
+        for name, setup, operation in scenarios(testapp):
+            setup()
+            for i in range(warmup):
+                operation(offset + i)
+            offset += warmup
+            latencies = []
+            statements[0] = 0
+            started = time.perf_counter()
+            for i in range(requests):
+                start = time.perf_counter()
+                operation(offset + i)
+                latencies.append(time.perf_counter() - start)
+            elapsed = time.perf_counter() - started
+            offset += requests
+            summary = summarize(latencies)
+            summary["ops_per_sec"] = requests / elapsed
+            summary["queries_per_request"] = statements[0] / requests
+            results[name] = summary
+    finally:
+        event.remove(engine, "after_cursor_execute", count)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regression messages against ``baseline``.
+
+    Timings may be worse by ``tolerance`` (a fraction) before they count;
+    query counts are deterministic and may not grow at all. Only the metrics
+    present in the baseline are compared.
+    """
+    regressions = []
+    for name, expected in baseline.items():
+        actual = results.get(name)
+        if actual is None:
+            continue
+        for metric, higher_is_better in COMPARED.items():
+            if metric not in expected:
+                continue
+            allowed = 0 if metric == "queries_per_request" else tolerance
+            limit = expected[metric] * (
+                1 - allowed if higher_is_better else 1 + allowed
+            )
+            worse = (
+                actual[metric] < limit if higher_is_better else actual[metric] > limit
+            )
+            if worse:
+                regressions.append(
+                    f"{name}: {metric} {actual[metric]:.2f} vs baseline "
+                    f"{expected[metric]:.2f}"
+                )
+    return regressions
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Gunicorn server hooks that warm workers up before they accept requests.
+
+Set ``GUNICORN_PRELOAD=1`` to load the app once in the master before forking.
+Workers then share the compiled templates and other read-only state through
+copy-on-write memory instead of each building their own.
+
+Each gevent worker has room for ``ORDER_EVENTS_MAX_CLIENTS`` idle order
+event streams plus ``GUNICORN_REQUEST_CONNECTIONS`` ordinary requests.
+"""
+import gc
+import os
+
+preload_app = os.environ.get("GUNICORN_PRELOAD", "0") == "1"
+_event_streams = int(os.environ.get("ORDER_EVENTS_MAX_CLIENTS", 10000))
+_requests = int(os.environ.get("GUNICORN_REQUEST_CONNECTIONS", 1000))
+worker_connections = _event_streams + _requests
+
+
+def on_starting(server):
+    """Discard metrics snapshots left over from a previous run."""
+    from app import metrics
+
+    metrics.clear_store(metrics.default_metrics_dir())
+
+
+def when_ready(server):
+    """Prepare the preloaded app in the master, before any worker is forked."""
+    if server.cfg.preload_app:
+        from app import warmup
+
+        report = warmup.prepare(server.app.wsgi())
+        server.log.info(warmup.format_report("Prepared app", report))
+        # Keep the garbage collector from touching (and so copying) the
+        # objects shared with the workers. Python 3.6 has no gc.freeze().
+        if hasattr(gc, "freeze"):
+            gc.freeze()
+
+
+def post_worker_init(worker):
+    """Warm the worker up before its first request.
+
+    A failed warm-up is logged and the worker serves cold: letting the error
+    escape would make the master halt the whole server.
+    """
+    from app import dbpool, warmup
+
+    # A preloaded app was created before the gevent worker patched the
+    # standard library, so psycopg2 has to be made cooperative here.
+    dbpool.make_psycopg2_green()
+
+    report = {}
+    try:
+        if not worker.cfg.preload_app:
+            report.update(warmup.prepare(worker.wsgi))
+        report.update(warmup.warm_worker(worker.wsgi))
+    except Exception:
+        worker.log.exception(f"Warm-up of worker {worker.pid} failed, serving cold")
+        return
+    worker.log.info(warmup.format_report(f"Warmed up worker {worker.pid}", report))
+
+
+def worker_exit(server, worker):
+    """Write the ratings still buffered in the worker."""
+    from app.shop.ratings import rating_buffer
+
+    if rating_buffer.pending:
+        with worker.wsgi.app_context():
+            count = rating_buffer.flush()
+        worker.log.info(f"Wrote {count} buffered ratings on exit")
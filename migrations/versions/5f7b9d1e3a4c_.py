@@ -0,0 +1,45 @@
+"""Compare usernames and emails bytewise for the user directory
+
+Revision ID: 5f7b9d1e3a4c
+Revises: 4e6a8c0d2f3b
+Create Date: 2026-10-19 12:20:45.903118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f7b9d1e3a4c'
+down_revision = '4e6a8c0d2f3b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # A varchar_pattern_ops index serves LIKE but not the ORDER BY and cursor
+    # comparisons, which use the collation; with COLLATE "C" a plain index
+    # serves all three.
+    op.drop_index('ix_users_email_prefix', table_name='users')
+    op.drop_index('ix_users_username_prefix', table_name='users')
+    if op.get_bind().dialect.name == 'postgresql':
+        for column in ('username', 'email'):
+            op.alter_column('users', column,
+                   existing_type=sa.String(length=80),
+                   type_=sa.String(length=80, collation='C'),
+                   existing_nullable=False)
+    op.create_index('ix_users_username_prefix', 'users', ['username', 'id'], unique=False)
+    op.create_index('ix_users_email_prefix', 'users', ['email', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_users_email_prefix', table_name='users')
+    op.drop_index('ix_users_username_prefix', table_name='users')
+    if op.get_bind().dialect.name == 'postgresql':
+        for column in ('username', 'email'):
+            op.alter_column('users', column,
+                   existing_type=sa.String(length=80, collation='C'),
+                   type_=sa.String(length=80),
+                   existing_nullable=False)
+    op.create_index('ix_users_username_prefix', 'users', ['username', 'id'], unique=False, postgresql_ops={'username': 'varchar_pattern_ops'})
+    op.create_index('ix_users_email_prefix', 'users', ['email', 'id'], unique=False, postgresql_ops={'email': 'varchar_pattern_ops'})
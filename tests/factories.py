@@ -4,6 +4,7 @@ from factory import PostGenerationMethodCall, Sequence
 from factory.alchemy import SQLAlchemyModelFactory
 
 from app.database import db
+from app.shop.models import Courier, MenuItem, PromoCode, Restaurant
 from app.user.models import User
 
 
@@ -29,3 +30,55 @@ class UserFactory(BaseFactory):
         """Factory configuration."""
 
         model = User
+
+
+class RestaurantFactory(BaseFactory):
+    """Restaurant factory."""
+
+    name = Sequence(lambda n: f"restaurant{n}")
+    is_open = True
+
+    class Meta:
+        """Factory configuration."""
+
+        model = Restaurant
+
+
+class MenuItemFactory(BaseFactory):
+    """Menu item factory."""
+
+    name = Sequence(lambda n: f"dish{n}")
+    price_cents = Sequence(lambda n: 100 + n)
+    active = True
+
+    class Meta:
+        """Factory configuration."""
+
+        model = MenuItem
+
+
+class CourierFactory(BaseFactory):
+    """Courier factory."""
+
+    name = Sequence(lambda n: f"courier{n}")
+    active = True
+
+    class Meta:
+        """Factory configuration."""
+
+        model = Courier
+
+
+class PromoCodeFactory(BaseFactory):
+    """Promo code factory, 500 cents off by default."""
+
+    code = Sequence(lambda n: f"CODE{n}")
+    kind = "fixed"
+    value = 500
+    min_subtotal_cents = 0
+    active = True
+
+    class Meta:
+        """Factory configuration."""
+
+        model = PromoCode
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""Test the benchmark suite's baseline comparison."""
+from benchmarks.suite import compare
+
+
+class TestCompare:
+    """Baseline comparison."""
+
+    def test_within_tolerance(self):
+        """Small slowdowns pass."""
+        results = {"login": {"p95_ms": 11.0, "ops_per_sec": 90.0}}
+        baseline = {"login": {"p95_ms": 10.0, "ops_per_sec": 100.0}}
+        assert compare(results, baseline, tolerance=0.25) == []
+
+    def test_regressions(self):
+        """Slowdowns beyond the tolerance and extra queries fail."""
+        results = {"login": {"p95_ms": 20.0, "queries_per_request": 2.0}}
+        baseline = {"login": {"p95_ms": 10.0, "queries_per_request": 1.0}}
+        regressions = compare(results, baseline, tolerance=0.25)
+        assert len(regressions) == 2
+        assert regressions[0].startswith("login: p95_ms")
+
+    def test_only_baseline_metrics_are_compared(self):
+        """Metrics and scenarios missing from the baseline are ignored."""
+        results = {"login": {"p95_ms": 99.0}, "new": {"p95_ms": 1.0}}
+        assert compare(results, {"login": {}}, tolerance=0.25) == []
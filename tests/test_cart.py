@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""Shopping cart tests."""
+import pytest
+from flask import url_for
+
+from app.shop import pipeline
+from app.shop.cart import Cart, CartError, current_cart
+from app.shop.models import Order
+
+from .factories import MenuItemFactory, PromoCodeFactory, RestaurantFactory
+
+
+@pytest.fixture
+def dishes(db):
+    """A burger for 12.53 and a taco for 4.38."""
+    burger = MenuItemFactory(name="Burger", price_cents=1253)
+    taco = MenuItemFactory(name="Taco", price_cents=438)
+    db.session.commit()
+    return burger, taco
+
+
+@pytest.fixture
+def promos(db):
+    """EXAMPLECODE for 5.00 off and TENOFF for 10% off."""
+    PromoCodeFactory(code="EXAMPLECODE", kind="fixed", value=500)
+    PromoCodeFactory(code="TENOFF", kind="percent", value=10)
+    db.session.commit()
+
+
+@pytest.mark.usefixtures("db", "promos")
+class TestCart:
+    """Cart arithmetic and storage."""
+
+    def test_totals_follow_changes(self, dishes):
+        """Subtotal and total are kept up to date line by line."""
+        burger, taco = dishes
+        cart = Cart("cart:test")
+        cart.add(burger)
+        cart.add(taco, 2)
+        assert cart.subtotal == 1253 + 2 * 438
+        cart.add(taco)
+        cart.set_quantity(burger.id, 2)
+        assert cart.subtotal == 2 * 1253 + 3 * 438
+        assert cart.count == 5
+        cart.remove(taco.id)
+        assert cart.subtotal == cart.total == 2 * 1253
+        assert list(cart.item_ids) == [burger.id]
+
+    def test_promo_discount(self, dishes):
+        """The discount tracks the subtotal and never exceeds it."""
+        burger, taco = dishes
+        cart = Cart("cart:test")
+        cart.add(taco)
+        cart.apply_promo("EXAMPLECODE")
+        assert cart.discount == 438
+        assert cart.total == 0
+        cart.add(burger)
+        assert cart.discount == 500
+        cart.apply_promo("TENOFF")
+        assert cart.discount == (1253 + 438) // 10
+        cart.remove_promo()
+        assert cart.total == 1253 + 438
+
+    def test_save_and_load(self, dishes):
+        """A saved cart comes back unchanged."""
+        burger, _ = dishes
+        cart = Cart("cart:test")
+        cart.add(burger, 3)
+        cart.apply_promo("TENOFF")
+        cart.save()
+        loaded = Cart.load("cart:test")
+        assert list(loaded.quantities) == [3]
+        assert loaded.subtotal == 3 * 1253
+        assert loaded.discount == cart.discount
+        assert loaded.promo_code == "TENOFF"
+
+    def test_full_cart(self, app, dishes):
+        """The number of lines is capped."""
+        app.config["CART_MAX_LINES"] = 1
+        burger, taco = dishes
+        cart = Cart("cart:test")
+        cart.add(burger)
+        with pytest.raises(CartError):
+            cart.add(taco)
+
+    def test_checkout(self, user, dishes):
+        """Checkout writes the order and empties the cart."""
+        burger, taco = dishes
+        cart = current_cart()
+        cart.add(burger)
+        cart.add(taco, 2)
+        cart.apply_promo("EXAMPLECODE")
+        order = cart.checkout(user.id)
+        assert order.total_cents == 1253 + 876 - 500
+        assert order.discount_cents == 500
+        assert sorted(item.quantity for item in order.items) == [1, 2]
+        assert len(current_cart()) == 0
+
+    def test_checkout_reprices(self, user, dishes):
+        """A price change is applied to the cart instead of being ordered."""
+        burger, _ = dishes
+        cart = Cart("cart:test")
+        cart.add(burger, 2)
+        burger.update(price_cents=1500)
+        with pytest.raises(CartError):
+            cart.checkout(user.id)
+        assert cart.subtotal == 3000
+        assert Order.query.count() == 0
+
+    def test_one_restaurant(self, db, user, dishes):
+        """A cart only holds items of one restaurant, which the order is from."""
+        burger, taco = dishes
+        diner, cantina = RestaurantFactory(), RestaurantFactory()
+        burger.restaurant = diner
+        taco.restaurant = cantina
+        db.session.commit()
+        cart = Cart("cart:test")
+        cart.add(burger)
+        with pytest.raises(CartError):
+            cart.add(taco)
+        cart.remove(burger.id)
+        cart.add(taco)
+        cart.save()
+        assert Cart.load("cart:test").restaurant_id == cantina.id
+
+        burger.update(restaurant=cantina)
+        cart.add(burger)
+        burger.update(restaurant=diner)
+        with pytest.raises(CartError):
+            cart.checkout(user.id)
+        assert Order.query.count() == 0
+        cart.remove(burger.id)
+        assert cart.checkout(user.id).restaurant_id == cantina.id
+
+    def test_checkout_empty(self, user):
+        """An empty cart cannot be ordered."""
+        with pytest.raises(CartError):
+            Cart("cart:test").checkout(user.id)
+
+
+class TestCartViews:
+    """Cart pages."""
+
+    def test_add_and_checkout(self, user, testapp, dishes, promos):
+        """A logged in visitor can fill the cart and check out."""
+        burger, _ = dishes
+        res = testapp.get("/")
+        form = res.forms["loginForm"]
+        form["username"] = user.username
+        form["password"] = "myprecious"
+        form.submit()
+
+        testapp.post(url_for("shop.add_to_cart"), {"item_id": burger.id, "quantity": 2})
+        testapp.post(url_for("shop.apply_promo"), {"code": "examplecode"})
+        res = testapp.get(url_for("public.customerShoppingCart"))
+        assert "Burger" in res
+        assert "20.06" in res  # 2 x 12.53 - 5.00
+
+        res = testapp.post(url_for("shop.checkout"), {"key": "first"}).follow()
+        assert "Placing your order" in res
+        while pipeline.process_next() is not None:
+            pass
+        res = testapp.get(url_for("shop.checkout_progress", key="first")).follow()
+        assert "has been placed" in res
+        assert Order.query.one().total_cents == 2006
+
+    def test_checkout_requires_login(self, testapp, dishes):
+        """Anonymous visitors are asked to log in."""
+        res = testapp.post(url_for("shop.checkout"), expect_errors=True)
+        assert res.status_code == 401
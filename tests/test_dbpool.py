@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Database pool configuration tests."""
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine, exc
+
+from app.dbpool import (
+    TimedQueuePool,
+    init_pool,
+    make_psycopg2_green,
+    pool_metrics,
+    pool_stats,
+)
+
+
+def make_config_app(uri, **config):
+    """Return a bare app with ``uri`` and ``config`` set."""
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = uri
+    app.config.update(config)
+    return app
+
+
+class TestInitPool:
+    """Engine option tests."""
+
+    def test_postgres_options(self):
+        """Pool settings are turned into engine options."""
+        app = make_config_app(
+            "postgresql://localhost/rype", DB_POOL_SIZE=3, DB_POOL_PRE_PING=False
+        )
+        init_pool(app)
+        options = app.config["SQLALCHEMY_ENGINE_OPTIONS"]
+        assert options["poolclass"] is TimedQueuePool
+        assert options["pool_size"] == 3
+        assert options["max_overflow"] == 10
+        assert options["pool_timeout"] == 10
+        assert options["pool_recycle"] == 1800
+        assert options["pool_pre_ping"] is False
+
+    def test_explicit_engine_options_win(self):
+        """Options set explicitly are left alone."""
+        app = make_config_app(
+            "postgresql://localhost/rype",
+            SQLALCHEMY_ENGINE_OPTIONS={"pool_size": 1},
+        )
+        init_pool(app)
+        assert app.config["SQLALCHEMY_ENGINE_OPTIONS"]["pool_size"] == 1
+
+    def test_sqlite_untouched(self):
+        """An SQLite database keeps SQLAlchemy's default pool."""
+        app = make_config_app("sqlite://")
+        init_pool(app)
+        assert "SQLALCHEMY_ENGINE_OPTIONS" not in app.config
+
+    def test_not_green_without_gevent_patching(self):
+        """psycopg2 is left alone unless gevent has patched threading."""
+        assert make_psycopg2_green() is False
+
+
+class TestTimedQueuePool:
+    """Pool metrics tests."""
+
+    def test_checkouts_counted(self, tmp_path):
+        """Checkouts and the checked out gauge are reported."""
+        engine = create_engine(
+            f"sqlite:///{tmp_path / 'pool.db'}", poolclass=TimedQueuePool, pool_size=2
+        )
+        before = pool_stats["checkouts"]
+        with engine.connect():
+            values = pool_metrics()
+            assert values[("rype_db_pool_checked_out", ())] >= 1
+        assert pool_stats["checkouts"] == before + 1
+        assert values[("rype_db_pool_checkouts_total", ())] == before + 1
+        engine.dispose()
+
+    def test_timeouts_counted(self, tmp_path):
+        """A checkout that gives up waiting is counted as a timeout."""
+        engine = create_engine(
+            f"sqlite:///{tmp_path / 'pool.db'}",
+            poolclass=TimedQueuePool,
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=0.05,
+        )
+        before = pool_stats["timeouts"]
+        with engine.connect():
+            with pytest.raises(exc.TimeoutError):
+                engine.connect()
+        assert pool_stats["timeouts"] == before + 1
+        assert pool_stats["wait_seconds"] >= 0.05
+        engine.dispose()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Admin user directory tests."""
+import datetime as dt
+
+import pytest
+from flask import url_for
+
+from app.user import directory
+
+from .factories import UserFactory
+
+
+@pytest.fixture
+def users(db):
+    """Seven users who joined a day apart, every other one inactive."""
+    start = dt.datetime(2020, 1, 1)
+    users = [
+        UserFactory(
+            username=f"{name}{n}",
+            email=f"{n}{name}@example.com",
+            created_at=start + dt.timedelta(days=n),
+            active=n % 2 == 0,
+        )
+        for n, name in enumerate(["ann", "bob", "ann", "cy_", "ann", "bob", "dee"])
+    ]
+    db.session.commit()
+    return users
+
+
+def walk(limit, **filters):
+    """Page through the search, returning the usernames of each page."""
+    pages = []
+    after = None
+    while True:
+        page = directory.search(after=after, limit=limit, **filters)
+        pages.append([user.username for user in page.users])
+        after = page.next_cursor
+        if after is None:
+            return pages
+
+
+@pytest.mark.usefixtures("db")
+class TestSearch:
+    """Listing users by keyset."""
+
+    def test_newest_first(self, users):
+        """Without a search, users are listed newest first, a page at a time."""
+        assert walk(3) == [["dee6", "bob5", "ann4"], ["cy_3", "ann2", "bob1"], ["ann0"]]
+
+    def test_same_created_at(self, db, users):
+        """Users who joined at the same moment are neither skipped nor repeated."""
+        for user in users:
+            user.created_at = dt.datetime(2020, 1, 1)
+        db.session.commit()
+        assert sum(walk(2), []) == [user.username for user in users[::-1]]
+
+    def test_prefix(self, users):
+        """A search lists the matching users in order of the searched field."""
+        assert walk(2, prefix="ann") == [["ann0", "ann2"], ["ann4"]]
+        assert walk(2, prefix="2", field="email") == [["ann2"]]
+        assert walk(2, prefix="cy_") == [["cy_3"]]
+        assert walk(2, prefix="c%") == [[]]
+
+    def test_prefix_range(self):
+        """A prefix is the range up to its last character incremented."""
+        assert directory.prefix_range("ann") == ("ann", "ano")
+        assert directory.prefix_range("an\U0010ffff") == ("an\U0010ffff", "ao")
+        assert directory.prefix_range("\U0010ffff") == ("\U0010ffff", None)
+        assert directory.prefix_range("a\ud7ff")[1] == "a\ue000"
+
+    def test_filters(self, users):
+        """Filters on the flags and dates combine with the search."""
+        assert walk(10, active=False) == [["bob5", "cy_3", "bob1"]]
+        assert walk(10, prefix="ann", active=True) == [["ann0", "ann2", "ann4"]]
+        assert walk(
+            10, joined_from=dt.date(2020, 1, 3), joined_to=dt.date(2020, 1, 5)
+        ) == [["ann4", "cy_3", "ann2"]]
+        users[1].update(is_admin=True)
+        assert walk(10, is_admin=True) == [["bob1"]]
+
+    def test_cursor_of_another_listing(self, users):
+        """A cursor only continues the listing it came from."""
+        cursor = directory.search(limit=1).next_cursor
+        with pytest.raises(directory.InvalidCursor):
+            directory.search(prefix="ann", after=cursor)
+        with pytest.raises(directory.InvalidCursor):
+            directory.search(after="not a cursor")
+
+    def test_cursor_keeps_join_time(self):
+        """Join times survive the cursor, with or without microseconds."""
+        for joined in (
+            dt.datetime(2020, 1, 2, 3, 4, 5),
+            dt.datetime(2020, 1, 2, 3, 4, 5, 6),
+        ):
+            cursor = directory.encode_cursor("created_at", joined, 7)
+            assert directory.decode_cursor(cursor, "created_at") == (joined, 7)
+
+
+class TestMembersView:
+    """The members page."""
+
+    def log_in(self, testapp, user):
+        """Log ``user`` in through the navbar form."""
+        res = testapp.get("/")
+        form = res.forms["loginForm"]
+        form["username"] = user.username
+        form["password"] = "myprecious"
+        return form.submit().follow()
+
+    def test_member_sees_no_directory(self, user, testapp):
+        """Users who are not admins only get the welcome page."""
+        res = self.log_in(testapp, user)
+        assert "members-only" in res
+        assert "No users found" not in res
+        assert "Next page" not in res
+
+    def test_admin_pages_through_users(self, app, user, users, testapp):
+        """Admins search the directory and follow the next page link."""
+        user.update(is_admin=True)
+        app.config["USER_DIRECTORY_PAGE_SIZE"] = 2
+        self.log_in(testapp, user)
+        res = testapp.get(url_for("user.members"), {"q": "ann", "active": "yes"})
+        assert "ann0" in res and "ann2" in res and "ann4" not in res
+        res = res.click("Next page")
+        assert "ann4" in res and "ann0" not in res
+        assert "Next page" not in res
+        testapp.get(url_for("user.members", after="garbage"), status=400)
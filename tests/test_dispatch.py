@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Courier dispatch tests."""
+import datetime as dt
+from itertools import permutations
+
+import numpy as np
+import pytest
+
+from app.shop import dispatch
+from app.shop.cart import Cart
+from app.shop.dispatch import dispatcher
+from app.shop.models import Courier, Order
+
+from .factories import CourierFactory, MenuItemFactory, RestaurantFactory
+
+NOW = dt.datetime(2020, 1, 1, 12)
+
+
+def best_total(cost):
+    """The cheapest assignment cost, by trying every permutation."""
+    n, m = cost.shape
+    if n <= m:
+        return min(
+            cost[range(n), list(columns)].sum() for columns in permutations(range(m), n)
+        )
+    return best_total(cost.T)
+
+
+class TestSolvers:
+    """Assignment solvers."""
+
+    @pytest.mark.parametrize("shape", [(1, 1), (3, 5), (5, 3), (6, 6)])
+    def test_hungarian_is_optimal(self, shape):
+        """The Hungarian solver finds the cheapest assignment."""
+        rng = np.random.RandomState(sum(shape))
+        for _ in range(5):
+            cost = rng.uniform(-5, 20, size=shape)
+            rows, cols = dispatch.hungarian(cost)
+            assert len(rows) == min(shape)
+            assert len(set(rows)) == len(set(cols)) == min(shape)
+            assert list(rows) == sorted(rows)
+            assert cost[rows, cols].sum() == pytest.approx(best_total(cost))
+
+    def test_greedy_is_a_matching(self):
+        """Greedy matching assigns every column, each to a different row."""
+        cost = np.random.RandomState(1).uniform(0, 10, size=(40, 30))
+        for candidates in (1, 3, 30):
+            rows, cols = dispatch.greedy(cost, candidates)
+            assert len(rows) == 30
+            assert len(set(rows)) == len(set(cols)) == 30
+
+    def test_solver_choice(self):
+        """Large batches fall back to greedy matching."""
+        cost = np.ones((4, 4))
+        assert dispatch.solve(cost, 4, 2)[2] in ("scipy", "hungarian")
+        assert dispatch.solve(cost, 3, 2)[2] == "greedy"
+
+
+@pytest.fixture
+def restaurants(db):
+    """Two restaurants 1.1 km apart."""
+    uptown = RestaurantFactory(name="Uptown", latitude=40.77, longitude=-73.98)
+    downtown = RestaurantFactory(name="Downtown", latitude=40.76, longitude=-73.98)
+    db.session.commit()
+    return uptown, downtown
+
+
+def place(user, restaurant, minutes_ago=0):
+    """Write a placed order picked up at ``restaurant``."""
+    return Order.create(
+        user_id=user.id,
+        restaurant_id=restaurant.id,
+        subtotal_cents=100,
+        total_cents=100,
+        created_at=NOW - dt.timedelta(minutes=minutes_ago),
+    )
+
+
+class TestDispatcher:
+    """Dispatching batches from the database."""
+
+    def test_batch_beats_nearest_first(self, db, user, restaurants):
+        """Couriers are matched for the whole batch, not order by order."""
+        uptown, downtown = restaurants
+        first = place(user, uptown, minutes_ago=1)
+        second = place(user, downtown)
+        # The middle courier is the nearest to the first order, but sending
+        # them downtown leaves the far courier a much shorter trip uptown.
+        middle = CourierFactory(latitude=40.768, longitude=-73.98)
+        north = CourierFactory(latitude=40.78, longitude=-73.98)
+        db.session.commit()
+
+        assert dispatcher.run_once(now=NOW) == 2
+        db.session.expire_all()
+        assert first.courier_id == north.id
+        assert second.courier_id == middle.id
+        assert first.status == second.status == "dispatched"
+        assert first.dispatched_at == NOW
+        assert not middle.available and not north.available
+        assert dispatcher.run_once(now=NOW) == 0
+
+    def test_longest_waiting_first(self, db, user, restaurants):
+        """With too few couriers the order waiting longest goes first."""
+        uptown, downtown = restaurants
+        waiting = place(user, uptown, minutes_ago=30)
+        place(user, downtown)
+        courier = CourierFactory(latitude=40.76, longitude=-73.98)
+        db.session.commit()
+
+        dispatcher.run_once(now=NOW)
+        db.session.expire_all()
+        assert waiting.courier_id == courier.id
+
+    def test_unreachable_and_unavailable(self, db, user, restaurants):
+        """Far away, busy and inactive couriers are not assigned."""
+        uptown, _ = restaurants
+        order = place(user, uptown)
+        CourierFactory(latitude=41.5, longitude=-73.98)
+        CourierFactory(latitude=40.77, longitude=-73.98, available=False)
+        CourierFactory(latitude=40.77, longitude=-73.98, active=False)
+        CourierFactory()
+        db.session.commit()
+
+        assert dispatcher.run_once(now=NOW) == 0
+        db.session.expire_all()
+        assert order.status == "placed"
+
+    def test_delivery_frees_courier(self, db, user, restaurants):
+        """A delivered order makes its courier available again."""
+        order = place(user, restaurants[0])
+        courier = CourierFactory(latitude=40.77, longitude=-73.98)
+        db.session.commit()
+        dispatcher.run_once(now=NOW)
+        db.session.expire_all()
+
+        dispatch.complete_delivery(order)
+        assert order.status == "delivered"
+        assert Courier.get_by_id(courier.id).available
+
+    def test_checkout_sets_pickup(self, db, user, restaurants):
+        """Checked out orders are picked up at the restaurant of the first item."""
+        item = MenuItemFactory(restaurant=restaurants[1])
+        db.session.commit()
+        cart = Cart("cart:test")
+        cart.add(item)
+        assert cart.checkout(user.id).restaurant_id == restaurants[1].id
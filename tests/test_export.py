@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Streaming export tests."""
+import csv
+import gzip
+import io
+import json
+
+import pytest
+from flask import url_for
+
+from app import commands, export
+from app.shop.models import Order
+
+from .factories import UserFactory
+
+
+@pytest.fixture
+def people(db, app):
+    """Five users, exported in batches of two."""
+    app.config["EXPORT_BATCH_SIZE"] = 2
+    users = [UserFactory(first_name=f"Pat, {n}") for n in range(5)]
+    db.session.commit()
+    return users
+
+
+def read(chunks):
+    """Join exported chunks into text."""
+    return b"".join(chunks).decode("utf-8")
+
+
+@pytest.mark.usefixtures("db")
+class TestExport:
+    """Formatting tables."""
+
+    def test_csv(self, people):
+        """CSV has a header and one quoted row per user, and no password."""
+        seen = []
+        text = read(export.export("users", "csv", progress=seen.append))
+        rows = list(csv.reader(io.StringIO(text)))
+        assert rows[0][:3] == ["id", "username", "email"]
+        assert "password" not in rows[0]
+        assert [row[1] for row in rows[1:]] == [user.username for user in people]
+        assert rows[1][3] == "Pat, 0"
+        assert seen == [2, 4, 5]
+
+    def test_jsonl_gzip(self, people):
+        """JSON Lines can be gzipped on the fly."""
+        data = gzip.decompress(
+            b"".join(export.export("users", "jsonl", compress=True))
+        )
+        lines = [json.loads(line) for line in data.decode().splitlines()]
+        assert [line["id"] for line in lines] == [user.id for user in people]
+        assert lines[0]["created_at"] == people[0].created_at.isoformat()
+
+    def test_orders(self, user):
+        """Orders export with their amounts."""
+        Order.create(user_id=user.id, subtotal_cents=900, total_cents=800)
+        (line,) = read(export.export("orders", "jsonl")).splitlines()
+        assert json.loads(line)["total_cents"] == 800
+
+    def test_unknown(self):
+        """Unknown tables and formats are refused up front."""
+        with pytest.raises(ValueError):
+            export.export("roles")
+        with pytest.raises(ValueError):
+            export.export("users", "xml")
+
+    def test_command(self, app, people, tmpdir):
+        """The command writes the export to a file."""
+        path = tmpdir.join("users.csv.gz")
+        result = app.test_cli_runner().invoke(
+            commands.export, ["users", "--gzip", "-o", str(path)]
+        )
+        assert result.exit_code == 0, result.output
+        assert "Exported 5 users" in result.output
+        assert gzip.decompress(path.read_binary()).count(b"\n") == 6
+
+
+class TestExportView:
+    """The admin export endpoint."""
+
+    def test_admin_only(self, user, testapp):
+        """Users who are not admins are refused."""
+        testapp.post("/", {"username": user.username, "password": "myprecious"})
+        testapp.get(url_for("user.export_table", table="users"), status=403)
+
+    def test_streams_download(self, user, testapp):
+        """Admins download a gzipped export."""
+        user.update(is_admin=True)
+        testapp.post("/", {"username": user.username, "password": "myprecious"})
+        res = testapp.get(
+            url_for("user.export_table", table="users", format="jsonl", gzip=1)
+        )
+        assert res.content_type == "application/gzip"
+        assert "users.jsonl.gz" in res.headers["Content-Disposition"]
+        (line,) = gzip.decompress(res.body).decode().splitlines()
+        assert json.loads(line)["username"] == user.username
+        testapp.get(url_for("user.export_table", table="roles"), status=404)
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """Test forms."""
 
+from app.hashing import hasher
 from app.public.forms import LoginForm
 from app.user.forms import RegisterForm
 
@@ -75,3 +76,10 @@ class TestLoginForm:
         form = LoginForm(username=user.username, password="example")
         assert form.validate() is False
         assert "User not activated" in form.username.errors
+
+    def test_validate_hashing_busy(self, user, monkeypatch):
+        """Hashing queue is full."""
+        monkeypatch.setattr(hasher, "queue_depth", 0)
+        form = LoginForm(username=user.username, password="myprecious")
+        assert form.validate() is False
+        assert "Server is busy, please try again" in form.password.errors
@@ -3,6 +3,8 @@
 
 See: http://webtest.readthedocs.org/
 """
+from concurrent.futures import ThreadPoolExecutor
+
 from flask import url_for
 
 from app.user.models import User
@@ -118,3 +120,32 @@ class TestRegistering:
         res = form.submit()
         # sees error
         assert "Username already registered" in res
+
+    def test_parallel_registrations_with_same_username(self, app, db):
+        """Only one of many racing signups wins; the rest see a form error."""
+
+        register_url = url_for("public.register")
+
+        def register(n):
+            with app.test_client() as client:
+                return client.post(
+                    register_url,
+                    data={
+                        "username": "racer",
+                        "email": f"racer{n}@example.com",
+                        "password": "secret",
+                        "confirm": "secret",
+                    },
+                )
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(register, range(16)))
+
+        statuses = sorted(response.status_code for response in responses)
+        assert statuses == [200] * 15 + [302]
+        assert all(
+            b"Username already registered" in response.data
+            for response in responses
+            if response.status_code == 200
+        )
+        assert User.query.filter_by(username="racer").count() == 1
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Test the password hashing service."""
+import threading
+
+import pytest
+
+from app.hashing import HashingBusyError, PasswordHasher
+
+
+class TestPasswordHasher:
+    """Password hasher."""
+
+    def test_round_trip(self, app):
+        """Hashes made on the pool verify on the pool."""
+        hasher = PasswordHasher(app)
+        pw_hash = hasher.generate_password_hash("myprecious")
+        assert hasher.check_password_hash(pw_hash, "myprecious") is True
+        assert hasher.check_password_hash(pw_hash, "wrong") is False
+
+    def test_rejects_when_queue_is_full(self, app):
+        """Work is turned away immediately once the queue is full."""
+        app.config["HASHING_QUEUE_DEPTH"] = 1
+        hasher = PasswordHasher(app)
+        started, release = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        worker = threading.Thread(target=hasher.run, args=(block,))
+        worker.start()
+        started.wait(5)
+        try:
+            with pytest.raises(HashingBusyError):
+                hasher.run(lambda: None)
+        finally:
+            release.set()
+            worker.join()
+        assert hasher.rejected == 1
+        assert hasher.pending == 0
+        assert hasher.run(lambda: 42) == 42
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Test the identity cache used by the user loader."""
+import pytest
+
+from app.extensions import cache
+from app.user.identity import UserSnapshot, identity_cache
+
+from .factories import UserFactory
+
+
+@pytest.mark.usefixtures("db")
+class TestIdentityCache:
+    """Identity cache."""
+
+    def test_hit_after_miss(self, user):
+        """The second lookup is served from the cache."""
+        first = identity_cache.get(user.id)
+        second = identity_cache.get(user.id)
+        assert isinstance(first, UserSnapshot)
+        assert second is first
+        assert first == user
+        assert identity_cache.stats()["hits"] == 1
+        assert identity_cache.stats()["misses"] == 1
+
+    def test_password_is_not_cached(self, user):
+        """The snapshot does not carry the password hash."""
+        snapshot = identity_cache.get(user.id)
+        assert not hasattr(snapshot, "password")
+        assert snapshot.load() == user
+
+    def test_unknown_user(self):
+        """Unknown users are not cached."""
+        assert identity_cache.get(12345) is None
+
+    def test_update_invalidates(self, user):
+        """Writes through CRUDMixin drop the cached entry."""
+        identity_cache.get(user.id)
+        user.update(first_name="Changed")
+        assert identity_cache.get(user.id).first_name == "Changed"
+        assert identity_cache.stats()["misses"] == 2
+
+    def test_version_stamp_invalidates(self, user):
+        """A stamp bumped by another worker makes the entry stale."""
+        identity_cache.get(user.id)
+        cache.set(f"identity-version:{user.id}", "other-worker")
+        identity_cache.get(user.id)
+        assert identity_cache.stats()["misses"] == 2
+
+    def test_lru_eviction(self, db, monkeypatch):
+        """The least recently used entry is evicted when full."""
+        monkeypatch.setattr(identity_cache, "maxsize", 2)
+        users = [UserFactory() for _ in range(3)]
+        db.session.commit()
+        for user in users:
+            identity_cache.get(user.id)
+        assert identity_cache.stats()["size"] == 2
+        identity_cache.get(users[0].id)
+        assert identity_cache.stats()["misses"] == 4
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Bulk user import tests."""
+import gzip
+import json
+
+import pytest
+
+from app import commands
+from app.user import importer
+from app.user.models import User
+
+CSV = """username,email,password,first_name,active
+ann,ann@example.com,secret1,Ann,yes
+bob,bob@example.com,secret2,,no
+ann,ann2@example.com,secret3,,
+cy,cy@example.com,,,
+,nobody@example.com,secret4,,
+dee,dee@example.com,secret5,,1
+"""
+
+
+@pytest.fixture
+def csv_file(tmpdir):
+    """A CSV file with a duplicate, an invalid and a passwordless row."""
+    path = tmpdir.join("users.csv")
+    path.write(CSV)
+    return str(path)
+
+
+@pytest.mark.usefixtures("db")
+class TestImportUsers:
+    """Importing users in batches."""
+
+    def test_import(self, user, csv_file):
+        """Valid new users are imported with hashed passwords, the rest skipped."""
+        user.update(email="dee@example.com")
+        seen = []
+        result = importer.import_users(
+            csv_file, batch_size=2, workers=1, progress=seen.append
+        )
+        assert (result.rows, result.imported, result.skipped) == (6, 3, 3)
+        assert [(p.rows, p.imported) for p in seen] == [(2, 2), (4, 3), (6, 3)]
+        ann = User.query.filter_by(username="ann").one()
+        assert ann.check_password("secret1")
+        assert (ann.first_name, ann.active) == ("Ann", True)
+        assert User.query.filter_by(username="bob").one().active is False
+        assert User.query.filter_by(username="cy").one().password is None
+        assert not User.query.filter_by(email="ann2@example.com").count()
+
+    def test_resume(self, tmpdir, csv_file):
+        """An import resumes after the rows recorded in its checkpoint."""
+        checkpoint = str(tmpdir.join("progress"))
+        importer.write_checkpoint(checkpoint, 3)
+        result = importer.import_users(csv_file, checkpoint=checkpoint, workers=1)
+        assert result.rows == 6
+        assert {user.username for user in User.query} == {"cy", "dee"}
+        assert importer.read_checkpoint(checkpoint) == 0
+
+    def test_jsonl_gz(self, tmpdir):
+        """Gzipped JSON Lines are read too."""
+        path = tmpdir.join("users.jsonl.gz")
+        lines = [{"username": f"u{n}", "email": f"u{n}@example.com"} for n in range(3)]
+        path.write_binary(
+            gzip.compress("".join(json.dumps(line) + "\n" for line in lines).encode())
+        )
+        assert importer.import_users(str(path), workers=1).imported == 3
+
+    def test_command(self, app, csv_file):
+        """The command reports progress and the totals."""
+        result = app.test_cli_runner().invoke(
+            commands.import_users, [csv_file, "--workers", "1", "--batch-size", "4"]
+        )
+        assert result.exit_code == 0, result.output
+        assert "4 rows: 3 imported, 1 skipped" in result.output
+        assert "Imported 4 users, skipped 2" in result.output
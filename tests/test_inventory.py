@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Stock tests."""
+import pytest
+
+from app.shop import inventory, pipeline
+from app.shop.cart import Cart, CartError
+from app.shop.models import MenuItem, OrderIntent, StockShard
+
+from .factories import MenuItemFactory
+
+
+@pytest.fixture
+def dishes(db):
+    """A burger with 10 units over 4 shards, and an untracked taco."""
+    burger = MenuItemFactory(name="Burger", price_cents=1253)
+    taco = MenuItemFactory(name="Taco", price_cents=438)
+    db.session.commit()
+    inventory.set_stock(burger.id, 10, shards=4)
+    db.session.commit()
+    return burger, taco
+
+
+def shard_units(item):
+    """Units in each shard of ``item``."""
+    return [
+        row.quantity
+        for row in StockShard.query.filter_by(menu_item_id=item.id).order_by(
+            StockShard.shard
+        )
+    ]
+
+
+@pytest.mark.usefixtures("db")
+class TestInventory:
+    """Taking and giving back stock."""
+
+    def test_set_stock(self, dishes):
+        """Stock is spread evenly over the shards."""
+        burger, taco = dishes
+        assert shard_units(burger) == [3, 3, 2, 2]
+        assert inventory.stock_levels([burger.id, taco.id]) == {burger.id: 10}
+
+    def test_reserve_takes_one_shard(self, db, dishes):
+        """A small order comes out of a single shard; untracked items are skipped."""
+        burger, taco = dishes
+        inventory.reserve([(burger.id, 2), (taco.id, 50)])
+        db.session.commit()
+        units = shard_units(burger)
+        assert sum(units) == 8
+        assert sorted(units) in ([0, 2, 3, 3], [1, 2, 2, 3])
+
+    def test_reserve_across_shards(self, db, dishes):
+        """An order larger than any shard drains several; the last unit flags it."""
+        burger, _ = dishes
+        inventory.reserve([(burger.id, 6), (burger.id, 1)])
+        db.session.commit()
+        assert sum(shard_units(burger)) == 3
+        assert not inventory.is_sold_out(burger.id)
+        inventory.reserve([(burger.id, 3)])
+        assert not inventory.is_sold_out(burger.id)
+        db.session.commit()
+        assert shard_units(burger) == [0, 0, 0, 0]
+        assert inventory.sold_out([burger.id]) == {burger.id}
+
+    def test_sold_out_takes_nothing(self, db, dishes):
+        """Running short of one item leaves the others untouched."""
+        burger, _ = dishes
+        cake = MenuItemFactory(name="Cake")
+        db.session.commit()
+        inventory.set_stock(cake.id, 1)
+        db.session.commit()
+        with pytest.raises(inventory.SoldOut) as error:
+            inventory.reserve([(burger.id, 2), (cake.id, 2)])
+        assert (error.value.item_id, error.value.available) == (cake.id, 1)
+        db.session.rollback()
+        assert not inventory.is_sold_out(cake.id)
+        with pytest.raises(inventory.SoldOut):
+            inventory.reserve([(burger.id, 2), (cake.id, 2)])
+        db.session.commit()
+        assert sum(shard_units(burger)) == 10
+        assert inventory.sold_out([burger.id, cake.id]) == {cake.id}
+
+    def test_release(self, db, dishes):
+        """Released units go back and clear the sold out flag."""
+        burger, _ = dishes
+        inventory.reserve([(burger.id, 10)])
+        db.session.commit()
+        assert inventory.is_sold_out(burger.id)
+        inventory.release([(burger.id, 4)])
+        db.session.commit()
+        assert sum(shard_units(burger)) == 4
+        assert not inventory.is_sold_out(burger.id)
+
+    def test_cart_refuses_sold_out(self, db, dishes):
+        """A sold out item cannot be added until it is restocked."""
+        burger, _ = dishes
+        inventory.reserve([(burger.id, 10)])
+        db.session.commit()
+        cart = Cart("cart:test")
+        with pytest.raises(CartError, match="sold out"):
+            cart.add(burger)
+        inventory.set_stock(burger.id, 5)
+        db.session.commit()
+        cart.add(burger)
+
+
+@pytest.mark.usefixtures("db")
+class TestCheckoutStock:
+    """Stock in the checkout pipeline."""
+
+    def run_all(self):
+        """Process intents until the queue is empty."""
+        while pipeline.process_next() is not None:
+            pass
+
+    def test_checkout_takes_stock(self, user, dishes):
+        """Paid orders hold their units; short ones fail with the units left."""
+        burger, _ = dishes
+        cart = Cart("cart:test")
+        cart.add(burger, 8)
+        pipeline.submit(cart, user.id, "first")
+        pipeline.submit(cart, user.id, "second")
+        self.run_all()
+        first, second = OrderIntent.query.order_by(OrderIntent.id)
+        assert first.status == pipeline.PAID
+        assert second.status == pipeline.FAILED
+        assert second.error == "Sorry, only 2 Burger left"
+        assert inventory.stock_levels([burger.id]) == {burger.id: 2}
+
+    def test_failure_gives_stock_back(self, user, dishes):
+        """An intent failing after its stock was reserved releases it."""
+        burger, _ = dishes
+        cart = Cart("cart:test")
+        cart.add(burger, 3)
+        intent = pipeline.submit(cart, user.id, "abc")
+        pipeline.process_next()
+        pipeline.process_next()
+        assert OrderIntent.get_by_id(intent.id).status == "reserved"
+        assert inventory.stock_levels([burger.id]) == {burger.id: 7}
+        MenuItem.query.get(burger.id).update(price_cents=1300)
+        self.run_all()
+        assert OrderIntent.get_by_id(intent.id).status == pipeline.FAILED
+        assert inventory.stock_levels([burger.id]) == {burger.id: 10}
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Test the metrics endpoint."""
+import json
+import os
+
+import pytest
+from flask import url_for
+
+from app.metrics import merge_snapshots, metrics, render_prometheus
+
+
+@pytest.fixture
+def metrics_dir(tmpdir, monkeypatch):
+    """Store snapshots in a temporary directory."""
+    monkeypatch.setattr(metrics, "directory", str(tmpdir))
+    monkeypatch.setattr(metrics, "scrape_interval", 0)
+    return tmpdir
+
+
+@pytest.mark.usefixtures("db")
+class TestMetrics:
+    """Metrics."""
+
+    def test_request_metrics(self, testapp, metrics_dir):
+        """Requests, SQL statements and template renders are recorded."""
+        testapp.get(url_for("public.register"))
+        testapp.post(url_for("public.register"), {"username": "x"})
+        text = testapp.get("/metrics").text
+        assert (
+            'rype_http_requests_total{endpoint="public.register",status="200"}' in text
+        )
+        assert (
+            'rype_http_request_duration_seconds_bucket{endpoint="public.register",le="+Inf"}'
+            in text
+        )
+        assert (
+            'rype_template_render_seconds_count{template="public/register.html"}'
+            in text
+        )
+        assert "rype_db_statements_per_request_bucket" in text
+        assert "# TYPE rype_page_cache_pages gauge" in text
+        assert "# TYPE rype_promo_index_loads_total counter" in text
+
+    def test_aggregates_workers(self, testapp, metrics_dir):
+        """Snapshots of other live workers are summed; dead ones are archived."""
+        other = {"counters": [["rype_http_requests_total", [["endpoint", "x"]], 3]]}
+        metrics_dir.join(f"{os.getppid()}.json").write(json.dumps(other))
+        metrics_dir.join("999999999.json").write(json.dumps(other))
+        text = testapp.get("/metrics").text
+        assert 'rype_http_requests_total{endpoint="x"} 6' in text
+        assert not metrics_dir.join("999999999.json").exists()
+        assert metrics_dir.join("archive.json").exists()
+        text = testapp.get("/metrics").text
+        assert 'rype_http_requests_total{endpoint="x"} 6' in text
+
+
+class TestPrometheusFormat:
+    """Text exposition format."""
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Buckets accumulate and the count matches +Inf."""
+        snapshot = {
+            "histograms": [
+                ["rype_db_statements_per_request", [], [1, 2, 0, 0, 0, 0, 0, 0, 3], 30]
+            ]
+        }
+        text = render_prometheus(*merge_snapshots([snapshot, snapshot]))
+        assert 'rype_db_statements_per_request_bucket{le="1"} 6' in text
+        assert 'rype_db_statements_per_request_bucket{le="+Inf"} 12' in text
+        assert "rype_db_statements_per_request_count 12" in text
+        assert "rype_db_statements_per_request_sum 60" in text
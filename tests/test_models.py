@@ -3,8 +3,10 @@
 import datetime as dt
 
 import pytest
+from webtest import TestApp
 
-from app.user.models import Role, User
+from app.database import register_unit_of_work, unit_of_work, unit_of_work_stats
+from app.user.models import Role, User, UserAlreadyExists
 
 from .factories import UserFactory
 
@@ -51,6 +53,14 @@ class TestUser:
         assert user.check_password("foobarbaz123") is True
         assert user.check_password("barfoobaz") is False
 
+    def test_create_duplicate(self):
+        """Unique constraint violations name the clashing fields."""
+        User.create(username="foo", email="foo@bar.com")
+        with pytest.raises(UserAlreadyExists) as excinfo:
+            User.create(username="foo", email="foo@bar.com")
+        assert excinfo.value.fields == {"username", "email"}
+        assert User.query.count() == 1
+
     def test_full_name(self):
         """User full name."""
         user = UserFactory(first_name="Foo", last_name="Bar")
@@ -64,3 +74,102 @@ class TestUser:
         user.roles.append(role)
         user.save()
         assert role in user.roles
+
+
+@pytest.mark.usefixtures("db")
+class TestBulkCRUD:
+    """Bulk create/update/delete on Model."""
+
+    @staticmethod
+    def rows(count):
+        """Return user rows."""
+        return [
+            {"username": f"bulk{n}", "email": f"bulk{n}@example.com"}
+            for n in range(count)
+        ]
+
+    def test_create_many(self):
+        """Rows are inserted in batches."""
+        assert User.create_many(self.rows(5), batch_size=2) == 5
+        assert User.query.count() == 5
+        assert all(user.created_at for user in User.query)
+
+    def test_create_many_return_ids(self):
+        """Generated ids can be returned."""
+        ids = User.create_many(self.rows(3), return_ids=True)
+        assert sorted(ids) == sorted(user.id for user in User.query)
+
+    def test_update_many(self):
+        """Rows are updated by primary key."""
+        ids = User.create_many(self.rows(3), return_ids=True)
+        User.update_many([{"id": pk, "active": True} for pk in ids], batch_size=2)
+        assert User.query.filter_by(active=True).count() == 3
+
+    def test_delete_many(self):
+        """Rows are deleted by primary key."""
+        ids = User.create_many(self.rows(4), return_ids=True)
+        assert User.delete_many(ids[:3], batch_size=2) == 3
+        assert [user.id for user in User.query] == ids[3:]
+
+
+@pytest.mark.usefixtures("db")
+class TestUnitOfWork:
+    """Deferred commits."""
+
+    def test_commits_once(self, db, monkeypatch):
+        """Saves inside the unit share one commit."""
+        commits = []
+        monkeypatch.setattr(db.session, "commit", lambda: commits.append(1))
+        avoided = unit_of_work_stats["commits_avoided"]
+        with unit_of_work():
+            User.create(username="foo", email="foo@bar.com")
+            User.create(username="bar", email="bar@bar.com").update(active=True)
+            assert commits == []
+        assert commits == [1]
+        assert unit_of_work_stats["commits_avoided"] == avoided + 3
+
+    def test_rolls_back_on_error(self):
+        """An exception discards every write in the unit."""
+        with pytest.raises(ValueError):
+            with unit_of_work():
+                User.create(username="foo", email="foo@bar.com")
+                raise ValueError()
+        assert User.query.count() == 0
+
+    def test_decorator_and_nesting(self, db):
+        """Nested units commit when the outermost one exits."""
+
+        @unit_of_work()
+        def create_users():
+            with unit_of_work():
+                User.create(username="foo", email="foo@bar.com")
+            assert db.session.info["unit_of_work_depth"] == 1
+            User.create(username="bar", email="bar@bar.com")
+
+        create_users()
+        db.session.rollback()
+        assert User.query.count() == 2
+
+    def test_requests(self, app, db):
+        """Requests commit on success and roll back on errors and failed commits."""
+        app.config["UNIT_OF_WORK_REQUESTS"] = True
+        app.config["PROPAGATE_EXCEPTIONS"] = False  # Render the 500 page instead
+        register_unit_of_work(app)
+
+        def create(name, status=200):
+            User.create(username=name, email=f"{name}@bar.com")
+            if status is None:
+                raise ValueError("view failed")
+            return "", status
+
+        app.add_url_rule("/ok", "ok", lambda: create("ok"))
+        app.add_url_rule("/raises", "raises", lambda: create("raises", None))
+        app.add_url_rule("/unavailable", "unavailable", lambda: create("busy", 503))
+        app.add_url_rule("/duplicate", "duplicate", lambda: create("ok"))
+        testapp = TestApp(app)
+        testapp.get("/ok")
+        testapp.get("/raises", status=500)
+        testapp.get("/unavailable", status=503)
+        testapp.get("/duplicate", status=500)
+        db.session.rollback()
+        assert [user.username for user in User.query] == ["ok"]
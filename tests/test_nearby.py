@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Nearest restaurant tests."""
+import numpy as np
+import pytest
+from flask import url_for
+from sqlalchemy import event
+
+from app.shop.models import Restaurant
+from app.shop.nearby import GridIndex, haversine_km, nearby_index
+
+from .factories import RestaurantFactory
+
+TIMES_SQUARE = (40.758, -73.9855)
+
+
+def brute_force(ids, lats, lons, lat, lon, k):
+    """The ``k`` nearest ids by computing every distance."""
+    distances = haversine_km(lat, lon, lats, lons)
+    return [int(ids[i]) for i in np.argsort(distances, kind="stable")[:k]]
+
+
+@pytest.fixture
+def points():
+    """Random points around Manhattan."""
+    rng = np.random.RandomState(42)
+    ids = np.arange(1, 2001)
+    lats = rng.uniform(40.70, 40.82, len(ids))
+    lons = rng.uniform(-74.02, -73.93, len(ids))
+    return ids, lats, lons
+
+
+class TestGridIndex:
+    """Grid queries."""
+
+    @pytest.mark.parametrize("k", [1, 5, 50])
+    def test_matches_brute_force(self, points, k):
+        """The nearest points are the ones a full scan finds."""
+        grid = GridIndex(cell_degrees=0.005)
+        grid.load(*points)
+        for lat, lon in [TIMES_SQUARE, (40.7, -74.0), (41.5, -73.0)]:
+            found = [point_id for point_id, _ in grid.nearest(lat, lon, k)]
+            assert found == brute_force(*points, lat, lon, k)
+
+    def test_incremental_changes(self, points):
+        """Added, moved and removed points are found where they are now."""
+        ids, lats, lons = points
+        grid = GridIndex(cell_degrees=0.005)
+        grid.load(ids[:1000], lats[:1000], lons[:1000])
+        for point_id, lat, lon in zip(ids[1000:], lats[1000:], lons[1000:]):
+            grid.upsert(int(point_id), lat, lon)
+        for point_id in range(1, 301):
+            grid.remove(point_id)
+        grid.upsert(500, *TIMES_SQUARE)
+        lats[499], lons[499] = TIMES_SQUARE
+        assert len(grid) == 1700
+        assert 1 not in grid
+
+        keep = ids > 300
+        expected = brute_force(ids[keep], lats[keep], lons[keep], *TIMES_SQUARE, 20)
+        assert [point_id for point_id, _ in grid.nearest(*TIMES_SQUARE, 20)] == expected
+        assert expected[0] == 500
+
+    def test_max_distance(self, points):
+        """Points farther than ``max_km`` are left out."""
+        grid = GridIndex()
+        grid.load(*points)
+        found = grid.nearest(*TIMES_SQUARE, 2000, max_km=0.5)
+        assert found
+        assert all(distance <= 0.5 for _, distance in found)
+        assert len(found) < len(grid)
+
+    def test_empty(self):
+        """An empty grid finds nothing."""
+        assert GridIndex().nearest(*TIMES_SQUARE, 3) == []
+
+
+class TestNearbyRestaurants:
+    """The nearby endpoint and index syncing."""
+
+    def nearby(self, testapp, **params):
+        """Names of the restaurants returned by the endpoint."""
+        params.setdefault("lat", TIMES_SQUARE[0])
+        params.setdefault("lon", TIMES_SQUARE[1])
+        res = testapp.get(url_for("shop.nearby_restaurants"), params)
+        return [restaurant["name"] for restaurant in res.json["restaurants"]]
+
+    @pytest.fixture
+    def restaurants(self, db):
+        """Restaurants at increasing distances from Times Square."""
+        created = [
+            RestaurantFactory(name=name, latitude=40.758 + offset, longitude=-73.9855)
+            for name, offset in [("Near", 0.001), ("Middle", 0.01), ("Far", 0.1)]
+        ]
+        RestaurantFactory(name="Nowhere")
+        db.session.commit()
+        return created
+
+    def test_nearest_first(self, restaurants, testapp):
+        """Open restaurants with a location are returned nearest first."""
+        assert self.nearby(testapp) == ["Near", "Middle", "Far"]
+        assert self.nearby(testapp, k=2) == ["Near", "Middle"]
+        assert self.nearby(testapp, km=5) == ["Near", "Middle"]
+
+    def test_changes(self, db, restaurants, testapp):
+        """Created, closed, moved and deleted restaurants are picked up."""
+        near, middle, far = restaurants
+        self.nearby(testapp)
+        rebuilds = nearby_index.rebuilds
+
+        RestaurantFactory(name="Nearest", latitude=40.758, longitude=-73.9855)
+        db.session.commit()
+        near.update(is_open=False)
+        far.update(latitude=40.7585)
+        assert self.nearby(testapp) == ["Nearest", "Far", "Middle"]
+        assert nearby_index.rebuilds == rebuilds
+
+        middle.delete()
+        assert self.nearby(testapp) == ["Nearest", "Far"]
+        assert nearby_index.rebuilds == rebuilds + 1
+
+    def test_writes_outside_the_app(self, db, restaurants, testapp):
+        """Writes that bypass the session are loaded by the periodic sync."""
+        self.nearby(testapp)
+        table = Restaurant.__table__
+        db.session.execute(
+            table.update().where(table.c.name == "Near").values(is_open=False)
+        )
+        db.session.commit()
+        assert self.nearby(testapp) == ["Near", "Middle", "Far"]
+        nearby_index._next_sync = 0
+        assert self.nearby(testapp) == ["Middle", "Far"]
+
+    def test_lock_not_held_while_querying(self, app, db, restaurants, testapp):
+        """Syncing queries the database without blocking other requests."""
+        held = []
+
+        def check(*args):
+            held.append(nearby_index._lock.locked())
+
+        engine = db.get_engine(app)
+        event.listen(engine, "before_cursor_execute", check)
+        try:
+            self.nearby(testapp)
+            restaurants[0].update(is_open=False)
+            assert self.nearby(testapp) == ["Middle", "Far"]
+        finally:
+            event.remove(engine, "before_cursor_execute", check)
+        assert held and not any(held)
+
+    def test_bad_coordinates(self, testapp):
+        """Missing or invalid coordinates are rejected."""
+        url = url_for("shop.nearby_restaurants")
+        res = testapp.get(url, {"lat": 91, "lon": 0}, status=400)
+        assert "error" in res.json
+        testapp.get(url, status=400)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Test the full-page cache."""
+import pytest
+from flask import g, url_for
+
+from app.pagecache import CSRF_PLACEHOLDER, page_cache
+
+
+@pytest.mark.usefixtures("db")
+class TestPageCache:
+    """Page cache."""
+
+    def test_second_request_is_a_hit(self, testapp):
+        """The page is rendered once."""
+        first = testapp.get(url_for("public.about"))
+        second = testapp.get(url_for("public.about"))
+        assert first.text == second.text
+        assert page_cache.stats()["hits"] == 1
+        assert page_cache.stats()["misses"] == 1
+
+    def test_not_modified(self, testapp):
+        """A matching If-None-Match gets a 304."""
+        res = testapp.get(url_for("public.customerHome"))
+        etag = res.headers["ETag"]
+        res = testapp.get(
+            url_for("public.customerHome"), headers={"If-None-Match": etag}
+        )
+        assert res.status_code == 304
+
+    def test_csrf_token_per_session(self, app, testapp):
+        """Each session gets its own token in the cached page."""
+        other = type(testapp)(app)
+        first = testapp.get(url_for("public.about"))
+        # The test app context, and so ``g``, is shared between requests
+        g.pop("csrf_token", None)
+        second = other.get(url_for("public.about"))
+        assert CSRF_PLACEHOLDER not in second.text
+        tokens = [
+            res.forms["loginForm"]["csrf_token"].value for res in (first, second)
+        ]
+        assert tokens[0] != tokens[1]
+
+    def test_separate_entries_per_user(self, user, testapp):
+        """Logged in users do not see the anonymous page."""
+        testapp.get(url_for("public.about"))
+        res = testapp.get("/")
+        form = res.forms["loginForm"]
+        form["username"] = user.username
+        form["password"] = "myprecious"
+        form.submit().follow()
+        res = testapp.get(url_for("public.about"))
+        assert f"Logged in as {user.username}" in res
+        assert page_cache.stats()["pages"] == 2
+
+    def test_memory_cap(self, testapp, monkeypatch):
+        """Least recently used pages are evicted to stay under the cap."""
+        size = len(testapp.get(url_for("public.about")).body)
+        monkeypatch.setattr(page_cache, "max_bytes", size + 100)
+        testapp.get(url_for("public.about", page=2))
+        stats = page_cache.stats()
+        assert stats["pages"] == 1
+        assert stats["bytes"] <= size + 100
+        testapp.get(url_for("public.about"))
+        assert page_cache.stats()["misses"] == 3
+
+    def test_flashed_messages_bypass_cache(self, app):
+        """Pages showing flashed messages are never cached."""
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["_flashes"] = [("info", "Hello there")]
+        res = client.get(url_for("public.about"))
+        assert b"Hello there" in res.data
+        assert page_cache.stats()["pages"] == 0
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Role permission tests."""
+import pytest
+from flask import url_for
+from flask_login import login_user
+from sqlalchemy import event
+from werkzeug.exceptions import Forbidden, Unauthorized
+
+from app.database import db
+from app.user.identity import identity_cache
+from app.user.models import Role
+from app.user.permissions import ALL_PERMISSIONS, Permission, mask, requires
+
+from .factories import UserFactory
+
+
+@requires(Permission.EXPORT_DATA, Permission.VIEW_USERS)
+def guarded():
+    """A view needing two permissions."""
+    return "ok"
+
+
+def grant(user, name, *permissions):
+    """Commit a role of ``user`` granting ``permissions``."""
+    return Role.create(name=name, user=user, permissions=mask(*permissions))
+
+
+@pytest.mark.usefixtures("db")
+class TestCompile:
+    """Compiling roles into the cached identity."""
+
+    def test_roles_are_combined(self, user):
+        """The snapshot carries the union of the user's roles."""
+        grant(user, "support", Permission.VIEW_USERS)
+        grant(user, "analyst", Permission.EXPORT_DATA)
+        snapshot = identity_cache.get(user.id)
+        assert snapshot.permissions == mask(
+            Permission.VIEW_USERS, Permission.EXPORT_DATA
+        )
+        assert snapshot.can(Permission.VIEW_USERS, Permission.EXPORT_DATA)
+        assert not snapshot.can(Permission.MANAGE_STOCK)
+
+    def test_admins_have_everything(self, user):
+        """Admins get every permission without any role."""
+        user.update(is_admin=True)
+        assert identity_cache.get(user.id).permissions == ALL_PERMISSIONS
+
+    def test_role_changes_invalidate(self, user):
+        """Adding, changing, moving and removing roles apply right away."""
+        other = UserFactory()
+        other.save()
+        assert identity_cache.get(user.id).permissions == 0
+        role = Role(name="support", permissions=mask(Permission.VIEW_USERS))
+        user.roles.append(role)
+        user.save()
+        assert identity_cache.get(user.id).permissions == Permission.VIEW_USERS
+
+        role.update(permissions=mask(Permission.MANAGE_STOCK))
+        assert identity_cache.get(user.id).permissions == Permission.MANAGE_STOCK
+
+        identity_cache.get(other.id)
+        role.update(user_id=other.id)
+        assert identity_cache.get(user.id).permissions == 0
+        assert identity_cache.get(other.id).permissions == Permission.MANAGE_STOCK
+
+        role.delete()
+        assert identity_cache.get(other.id).permissions == 0
+
+    def test_rollback_keeps_cache(self, user):
+        """A role change rolled back invalidates nothing."""
+        identity_cache.get(user.id)
+        grant(user, "support", Permission.VIEW_USERS)
+        identity_cache.get(user.id)
+        Role.query.one().update(commit=False, permissions=0)
+        db.session.flush()
+        db.session.rollback()
+        identity_cache.get(user.id)
+        assert identity_cache.stats()["misses"] == 2
+
+
+class TestRequires:
+    """The ``@requires`` decorator."""
+
+    def test_checks_without_queries(self, app, user):
+        """Cached users are checked with no database access."""
+        grant(user, "analyst", Permission.EXPORT_DATA)
+        snapshot = identity_cache.get(user.id)
+        login_user(snapshot)
+        statements = []
+        engine = db.get_engine(app)
+
+        def count(*args):
+            statements.append(args)
+
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            with pytest.raises(Forbidden):
+                guarded()
+            snapshot.permissions |= Permission.VIEW_USERS
+            assert guarded() == "ok"
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+        assert statements == []
+
+    def test_anonymous(self, app):
+        """Anonymous users are asked to log in."""
+        with pytest.raises(Unauthorized):
+            guarded()
+
+    def test_export_needs_permission(self, user, testapp):
+        """A role with the export permission opens the export to non-admins."""
+        testapp.post("/", {"username": user.username, "password": "myprecious"})
+        testapp.get(url_for("user.export_table", table="users"), status=403)
+        grant(user, "analyst", Permission.EXPORT_DATA)
+        testapp.get(url_for("user.export_table", table="users"), status=200)
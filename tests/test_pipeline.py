@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""Asynchronous checkout tests."""
+import datetime as dt
+
+import pytest
+from flask import url_for
+from sqlalchemy import exc
+
+from app.shop import pipeline, promos
+from app.shop.cart import Cart, CartError
+from app.shop.dispatch import dispatcher
+from app.shop.models import MenuItem, Order, OrderIntent, PromoRedemption, order_placed
+
+from .factories import (
+    CourierFactory,
+    MenuItemFactory,
+    PromoCodeFactory,
+    RestaurantFactory,
+    UserFactory,
+)
+
+
+@pytest.fixture
+def cart(db):
+    """A cart with two tacos."""
+    taco = MenuItemFactory(name="Taco", price_cents=438)
+    db.session.commit()
+    cart = Cart("cart:test")
+    cart.add(taco, 2)
+    cart.save()
+    return cart
+
+
+def run_all():
+    """Process intents until the queue is empty; returns the steps taken."""
+    steps = 0
+    while pipeline.process_next() is not None:
+        steps += 1
+    return steps
+
+
+class Crash(BaseException):
+    """Stands in for the worker process being killed."""
+
+
+class TestPipeline:
+    """Intents and the worker."""
+
+    def test_submit_is_idempotent(self, user, cart):
+        """Submitting a key again returns the first intent."""
+        first = pipeline.submit(cart, user.id, "abc")
+        assert pipeline.submit(cart, user.id, "abc").id == first.id
+        other = UserFactory()
+        other.save()
+        assert pipeline.submit(cart, other.id, "abc").id != first.id
+        assert OrderIntent.query.count() == 2
+        with pytest.raises(CartError):
+            pipeline.submit(Cart("cart:empty"), user.id, "empty")
+
+    def test_states(self, user, cart):
+        """An intent moves through each state to a paid order."""
+        placed = []
+
+        def receiver(order):
+            placed.append(order)
+
+        intent = pipeline.submit(cart, user.id, "abc")
+        states = [intent.status]
+        order_states = []
+        with order_placed.connected_to(receiver):
+            while pipeline.process_next() is not None:
+                intent = OrderIntent.get_by_id(intent.id)
+                states.append(intent.status)
+                order_states.append(intent.order and intent.order.status)
+        assert states == ["pending", "validated", "reserved", "ordered", "paid"]
+        assert order_states == [None, None, pipeline.UNPAID_ORDER, "placed"]
+
+        order = Order.query.one()
+        assert intent.order_id == order.id
+        assert order.total_cents == 876
+        assert order.paid_at is not None
+        assert placed == [order]
+
+    def test_changed_cart_fails(self, user, cart):
+        """A repriced item fails the intent and gives the visitor the new cart."""
+        intent = pipeline.submit(cart, user.id, "abc")
+        cart.clear()
+        MenuItem.query.one().update(price_cents=500)
+        run_all()
+        intent = OrderIntent.get_by_id(intent.id)
+        assert intent.status == pipeline.FAILED
+        assert "changed" in intent.error
+        assert Cart.load("cart:test").subtotal == 1000
+        assert Order.query.count() == 0
+
+    def test_crash_recovery(self, user, cart, monkeypatch):
+        """A worker dying mid-step leaves no trace; the next one finishes the job."""
+        intent = pipeline.submit(cart, user.id, "abc")
+
+        def write_and_crash(intent, cart):
+            pipeline._write_order(intent, cart)
+            assert Order.query.count() == 1
+            raise Crash()
+
+        monkeypatch.setitem(pipeline.STEPS, "reserved", ("ordered", write_and_crash))
+        with pytest.raises(Crash):
+            run_all()
+        intent = OrderIntent.get_by_id(intent.id)
+        assert intent.status == "reserved"
+        assert intent.order_id is None
+        assert Order.query.count() == 0
+
+        monkeypatch.undo()
+        assert run_all() == 2
+        assert OrderIntent.get_by_id(intent.id).status == pipeline.PAID
+        assert Order.query.count() == 1
+
+    def test_errors_are_retried(self, app, user, cart, monkeypatch):
+        """Unexpected errors back off and give up after the last attempt."""
+        app.config["CHECKOUT_MAX_ATTEMPTS"] = 2
+        intent = pipeline.submit(cart, user.id, "abc")
+
+        def fail(intent, cart):
+            raise exc.OperationalError("SELECT 1", {}, Exception("connection lost"))
+
+        monkeypatch.setitem(pipeline.STEPS, "pending", ("validated", fail))
+        now = dt.datetime.utcnow()
+        assert pipeline.process_next(now).attempts == 1
+        assert pipeline.process_next(now) is None
+        later = now + dt.timedelta(seconds=app.config["CHECKOUT_RETRY_SECONDS"] + 1)
+        assert pipeline.process_next(later).status == pipeline.FAILED
+        assert OrderIntent.get_by_id(intent.id).attempts == 2
+
+    def test_failure_after_order_cancels_it(self, app, db, user, monkeypatch):
+        """An order written but never paid for is cancelled, not dispatched."""
+        app.config["CHECKOUT_MAX_ATTEMPTS"] = 1
+        diner = RestaurantFactory(latitude=40.77, longitude=-73.98)
+        taco = MenuItemFactory(price_cents=438, restaurant=diner)
+        CourierFactory(latitude=40.77, longitude=-73.98)
+        PromoCodeFactory(code="ONCE", max_uses=1)
+        db.session.commit()
+        cart = Cart("cart:test")
+        cart.add(taco, 2)
+        cart.apply_promo("ONCE")
+        intent = pipeline.submit(cart, user.id, "abc")
+
+        def declined(intent, cart):
+            raise exc.OperationalError("SELECT 1", {}, Exception("declined"))
+
+        monkeypatch.setitem(pipeline.STEPS, "ordered", (pipeline.PAID, declined))
+        for _ in range(3):
+            pipeline.process_next()
+        order = Order.query.one()
+        assert order.status == pipeline.UNPAID_ORDER
+        assert promos.uses(promos.promo_index.get("ONCE")) == 1
+        assert dispatcher.run_once() == 0
+
+        assert pipeline.process_next().status == pipeline.FAILED
+        assert OrderIntent.get_by_id(intent.id).order_id == order.id
+        assert Order.query.one().status == "cancelled"
+        assert PromoRedemption.query.count() == 0
+        assert promos.uses(promos.promo_index.get("ONCE")) == 0
+        assert dispatcher.run_once() == 0
+
+
+class TestCheckoutViews:
+    """Submitting and following a checkout."""
+
+    def login(self, testapp, user):
+        """Log ``user`` in."""
+        res = testapp.get("/")
+        form = res.forms["loginForm"]
+        form["username"] = user.username
+        form["password"] = "myprecious"
+        form.submit()
+
+    def test_double_submit(self, user, testapp):
+        """Posting the same checkout twice places one order."""
+        self.login(testapp, user)
+        item = MenuItemFactory()
+        item.save()
+        for _ in range(2):
+            testapp.post(
+                url_for("shop.add_to_cart"), {"item_id": item.id, "quantity": 1}
+            )
+            res = testapp.post(url_for("shop.checkout"), {"key": "abc"})
+            assert res.location.endswith(url_for("shop.checkout_progress", key="abc"))
+        run_all()
+        assert Order.query.count() == 1
+
+    def test_status(self, user, testapp):
+        """The status is available as JSON to its owner only."""
+        self.login(testapp, user)
+        item = MenuItemFactory()
+        item.save()
+        testapp.post(url_for("shop.add_to_cart"), {"item_id": item.id, "quantity": 1})
+        testapp.post(url_for("shop.checkout"), {"key": "abc"})
+        url = url_for("shop.checkout_status", key="abc")
+        assert testapp.get(url).json["status"] == "pending"
+        run_all()
+        assert testapp.get(url).json == {
+            "key": "abc",
+            "status": "paid",
+            "order_id": Order.query.one().id,
+            "error": None,
+        }
+        testapp.get(url_for("shop.checkout_status", key="other"), status=404)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Popularity ranking tests."""
+import datetime as dt
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.extensions import cache
+from app.shop import popularity
+from app.shop.cart import Cart
+from app.shop.models import MenuItem, Order, OrderItem
+
+from .factories import MenuItemFactory, RestaurantFactory
+
+
+def place_order(user, when, **quantities):
+    """Write an order of ``{item: quantity}`` and record it."""
+    order = Order(
+        user_id=user.id,
+        subtotal_cents=0,
+        total_cents=0,
+        created_at=when,
+        items=[
+            OrderItem(menu_item_id=item.id, quantity=quantity, unit_price_cents=0)
+            for item, quantity in quantities.values()
+        ],
+    )
+    order.save()
+    popularity.record_order(order)
+    return order
+
+
+@pytest.fixture
+def dishes(db):
+    """Three dishes."""
+    items = [MenuItemFactory(name=name) for name in ("Taco", "Burger", "Pizza")]
+    db.session.commit()
+    return items
+
+
+class TestPopularity:
+    """Ranking tests."""
+
+    def test_weight_doubles_every_half_life(self, app):
+        """An order one half-life later counts twice as much."""
+        start = dt.datetime(2020, 1, 1)
+        later = start + dt.timedelta(days=app.config["POPULARITY_HALF_LIFE_DAYS"])
+        assert popularity.order_weight(later) == pytest.approx(
+            2 * popularity.order_weight(start)
+        )
+
+    def test_ranking(self, user, dishes):
+        """Items are ranked by decayed order counts."""
+        taco, burger, pizza = dishes
+        now = dt.datetime.utcnow()
+        place_order(user, now - dt.timedelta(days=28), a=(taco, 10))
+        place_order(user, now, a=(burger, 2), b=(pizza, 1))
+        names = [item.name for item in popularity.popular_items()]
+        # 10 tacos four half-lives ago are worth 0.625 tacos today
+        assert names == ["Burger", "Pizza", "Taco"]
+
+    def test_cached_list(self, user, dishes):
+        """Pages read the cached list, which orders keep up to date."""
+        taco, burger, _ = dishes
+        assert popularity.popular_items() == []
+        place_order(user, dt.datetime.utcnow(), a=(taco, 1))
+        assert [item.name for item in cache.get(popularity.CACHE_KEY)] == ["Taco"]
+        place_order(user, dt.datetime.utcnow(), a=(burger, 3))
+        assert [item.id for item in popularity.popular_items()] == [burger.id, taco.id]
+
+    def test_closed_restaurants_excluded(self, db, user, dishes):
+        """Items of closed restaurants are not listed."""
+        taco, burger, _ = dishes
+        taco.update(restaurant=RestaurantFactory(is_open=False))
+        place_order(user, dt.datetime.utcnow(), a=(taco, 5), b=(burger, 1))
+        assert [item.name for item in popularity.popular_items()] == ["Burger"]
+
+    def test_checkout_updates_ranking(self, user, dishes):
+        """Checking out a cart records the order."""
+        _, _, pizza = dishes
+        cart = Cart("cart:test")
+        cart.add(pizza, 2)
+        cart.checkout(user.id)
+        assert [item.name for item in popularity.popular_items()] == ["Pizza"]
+
+    def test_rebuild(self, user, dishes):
+        """Rebuilding from the orders gives the same scores, rebased to now."""
+        taco, burger, _ = dishes
+        place_order(user, dt.datetime(2020, 3, 1), a=(taco, 4), b=(burger, 1))
+        place_order(user, dt.datetime(2020, 3, 9), a=(burger, 2))
+        scores = {item.id: item.popularity for item in MenuItem.query}
+        MenuItem.query.update({MenuItem.popularity: 0})
+        commits = []
+
+        def count(session):
+            commits.append(session)
+
+        event.listen(Session, "after_commit", count)
+        try:
+            assert popularity.rebuild() == 2
+        finally:
+            event.remove(Session, "after_commit", count)
+        # Scores and epoch change together, under the epoch lock
+        assert len(commits) == 1
+        factor = popularity.order_weight(popularity.EPOCH, popularity.current_epoch())
+        for item in MenuItem.query:
+            assert item.popularity == pytest.approx(scores[item.id] * factor)
+
+    def test_short_half_life(self, app, user, dishes):
+        """Orders that would overflow the scores rebase them instead."""
+        app.config["POPULARITY_HALF_LIFE_DAYS"] = 1
+        taco, burger, _ = dishes
+        now = dt.datetime.utcnow()
+        place_order(user, now - dt.timedelta(days=1), a=(taco, 3))
+        assert popularity.current_epoch() == now - dt.timedelta(days=1)
+        place_order(user, now, a=(burger, 2))
+        assert popularity.current_epoch() == now - dt.timedelta(days=1)
+        # 3 tacos a half-life ago are worth 1.5 tacos today
+        assert taco.popularity == pytest.approx(3)
+        assert burger.popularity == pytest.approx(4)
+        assert [item.name for item in popularity.popular_items()] == [
+            "Burger",
+            "Taco",
+        ]
+
+    def test_rebase_keeps_ranking(self, user, dishes):
+        """Rebasing scales every score by the same factor."""
+        taco, burger, _ = dishes
+        place_order(user, dt.datetime(2020, 3, 1), a=(taco, 4), b=(burger, 1))
+        popularity.rebase(dt.datetime(2020, 3, 15))
+        assert popularity.current_epoch() == dt.datetime(2020, 3, 15)
+        assert taco.popularity == pytest.approx(1)
+        assert burger.popularity == pytest.approx(0.25)
+
+    def test_half_life_must_be_positive(self, app):
+        """A half-life of zero or less is refused."""
+        app.config["POPULARITY_HALF_LIFE_DAYS"] = 0
+        with pytest.raises(ValueError):
+            popularity.init_popularity(app)
+
+    def test_customer_home(self, user, dishes, testapp):
+        """The customer home page lists the popular items."""
+        taco, _, _ = dishes
+        place_order(user, dt.datetime.utcnow(), a=(taco, 1))
+        res = testapp.get("/customerHome/")
+        assert "Taco" in res
+        assert "No orders yet." not in res
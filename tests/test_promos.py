@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""Promo code tests."""
+import datetime as dt
+import threading
+
+import pytest
+from flask import url_for
+from sqlalchemy import event
+
+from app.database import db, unit_of_work
+from app.extensions import cache
+from app.shop import promos
+from app.shop.cart import Cart, CartError
+from app.shop.models import PromoCode, PromoRedemption
+
+from .factories import MenuItemFactory, PromoCodeFactory, RestaurantFactory, UserFactory
+
+
+@pytest.fixture
+def dishes(db):
+    """A burger for 12.53 and a taco for 4.38 from a diner."""
+    diner = RestaurantFactory(name="Diner")
+    burger = MenuItemFactory(name="Burger", price_cents=1253, restaurant=diner)
+    taco = MenuItemFactory(name="Taco", price_cents=438, restaurant=diner)
+    db.session.commit()
+    return burger, taco
+
+
+def filled(burger, taco, key="cart:test"):
+    """A cart with one burger and two tacos."""
+    cart = Cart(key)
+    cart.add(burger)
+    cart.add(taco, 2)
+    return cart
+
+
+@pytest.mark.usefixtures("db")
+class TestRules:
+    """Evaluating codes against carts."""
+
+    def test_scopes(self, dishes):
+        """Item and restaurant scopes discount only their lines."""
+        burger, taco = dishes
+        MenuItemFactory(restaurant=RestaurantFactory())
+        PromoCodeFactory(code="TACO", kind="percent", value=50, menu_item_id=taco.id)
+        PromoCodeFactory(code="DINER", value=2000, restaurant_id=burger.restaurant_id)
+        PromoCodeFactory(code="ALL", kind="percent", value=10)
+        cart = filled(burger, taco)
+        PromoCode.query.session.commit()
+
+        cart.apply_promo("taco")
+        assert cart.discount == 438
+        cart.apply_promo("DINER")
+        assert cart.discount == 2000
+        cart.apply_promo("ALL")
+        assert cart.discount == (1253 + 876) // 10
+        assert promos.promo_index.get("DINER").item_ids == frozenset(
+            [burger.id, taco.id]
+        )
+
+    def test_conditions(self, dishes):
+        """Minimum basket, validity window and scope are checked on apply."""
+        burger, taco = dishes
+        now = dt.datetime.utcnow()
+        PromoCodeFactory(code="BIG", min_subtotal_cents=2000)
+        PromoCodeFactory(code="OLD", expires_at=now - dt.timedelta(days=1))
+        PromoCodeFactory(code="SOON", starts_at=now + dt.timedelta(days=1))
+        PromoCodeFactory(code="BURGER", menu_item_id=burger.id)
+        PromoCodeFactory(code="OFF", active=False)
+        PromoCode.query.session.commit()
+        cart = Cart("cart:test")
+        cart.add(taco)
+        for code, reason in [
+            ("BIG", r"at least \$20"),
+            ("OLD", "expired"),
+            ("SOON", "not valid yet"),
+            ("BURGER", "does not apply"),
+            ("OFF", "Unknown"),
+            ("NOPE", "Unknown"),
+        ]:
+            with pytest.raises(CartError, match=reason):
+                cart.apply_promo(code)
+        assert cart.promo_code is None
+
+        cart.add(burger, 2)
+        cart.apply_promo("BIG")
+        assert cart.discount == 500
+        cart.remove(burger.id)
+        assert cart.discount == 0
+
+    def test_index_follows_changes(self, dishes):
+        """Committed changes to codes reach the index."""
+        assert promos.promo_index.get("NEW") is None
+        promo = PromoCodeFactory(code="NEW")
+        promo.save()
+        assert promos.promo_index.get("NEW").value == 500
+        promo.update(value=700)
+        assert promos.promo_index.get("NEW").value == 700
+        PromoCode.query.filter_by(code="NEW").update({"active": False})
+        PromoCode.query.session.commit()
+        assert promos.promo_index.get("NEW") is None
+
+    def test_index_loads_without_lock(self, app, dishes):
+        """Loading the codes does not block other requests."""
+        held = []
+
+        def check(*args):
+            held.append(promos.promo_index._lock.locked())
+
+        engine = db.get_engine(app)
+        event.listen(engine, "before_cursor_execute", check)
+        try:
+            PromoCodeFactory(code="NEW").save()
+            assert promos.promo_index.get("NEW").value == 500
+        finally:
+            event.remove(engine, "before_cursor_execute", check)
+        assert held and not any(held)
+
+    def test_checkout_drops_withdrawn_code(self, user, dishes):
+        """A code withdrawn after it was applied fails the checkout once."""
+        burger, taco = dishes
+        promo = PromoCodeFactory(code="GONE")
+        promo.save()
+        cart = filled(burger, taco)
+        cart.apply_promo("GONE")
+        promo.update(active=False)
+        with pytest.raises(CartError, match="changed"):
+            cart.checkout(user.id)
+        assert cart.promo_code is None
+        assert cart.checkout(user.id).discount_cents == 0
+
+
+@pytest.mark.usefixtures("db")
+class TestRedemption:
+    """Usage caps."""
+
+    def test_max_uses(self, dishes):
+        """A code stops working once it was used ``max_uses`` times."""
+        burger, taco = dishes
+        PromoCodeFactory(code="ONCE", max_uses=2).save()
+        for n in range(2):
+            cart = filled(burger, taco, f"cart:{n}")
+            cart.apply_promo("ONCE")
+            cart.checkout(UserFactory().save().id)
+        cart = filled(burger, taco, "cart:late")
+        cart.apply_promo("ONCE")
+        with pytest.raises(CartError, match="used up"):
+            cart.checkout(UserFactory().save().id)
+        assert PromoRedemption.query.count() == 2
+        assert promos.uses(promos.promo_index.get("ONCE")) == 2
+
+    def test_rollback_gives_use_back(self, user, dishes):
+        """A checkout that fails after taking a use does not consume it."""
+        burger, taco = dishes
+        PromoCodeFactory(code="ONCE", max_uses=1).save()
+        cart = filled(burger, taco)
+        cart.apply_promo("ONCE")
+        with pytest.raises(RuntimeError):
+            with unit_of_work():
+                cart.place_order(user.id)
+                raise RuntimeError("payment declined")
+        promo = promos.promo_index.get("ONCE")
+        assert promos.uses(promo) == 0
+        assert cart.checkout(user.id).discount_cents == 500
+
+    def test_counter_is_seeded_from_redemptions(self, user, dishes):
+        """Losing the cached counter does not reset the cap."""
+        burger, taco = dishes
+        PromoCodeFactory(code="ONCE", max_uses=1).save()
+        cart = filled(burger, taco)
+        cart.apply_promo("ONCE")
+        cart.checkout(user.id)
+        cache.clear()
+        cart = filled(burger, taco)
+        cart.apply_promo("ONCE")
+        with pytest.raises(CartError, match="used up"):
+            cart.checkout(UserFactory().save().id)
+
+    def test_max_uses_per_user(self, user, dishes):
+        """Each customer may use a code ``max_uses_per_user`` times."""
+        burger, taco = dishes
+        PromoCodeFactory(code="WELCOME", max_uses_per_user=1).save()
+        cart = filled(burger, taco)
+        cart.apply_promo("WELCOME")
+        cart.checkout(user.id)
+        cart = filled(burger, taco)
+        cart.apply_promo("WELCOME")
+        with pytest.raises(CartError, match="already used"):
+            cart.checkout(user.id)
+        cart.checkout(UserFactory().save().id)
+
+    def test_max_uses_per_user_concurrently(self, app, user, dishes):
+        """Two checkouts of one customer at once share the per-customer cap."""
+        burger, taco = dishes
+        PromoCodeFactory(code="WELCOME", max_uses_per_user=1).save()
+        cart = filled(burger, taco)
+        cart.apply_promo("WELCOME")
+        errors = []
+
+        def other_checkout():
+            with app.app_context():
+                try:
+                    with unit_of_work():
+                        cart.place_order(user.id)
+                except CartError as error:
+                    errors.append(str(error))
+                db.session.remove()
+
+        with unit_of_work():
+            cart.place_order(user.id)
+            # Before this checkout commits, its redemption is not in the table
+            thread = threading.Thread(target=other_checkout)
+            thread.start()
+            thread.join()
+        assert errors == ["You have already used promo code WELCOME"]
+        assert PromoRedemption.query.count() == 1
+
+
+class TestPromoViews:
+    """Applying codes from the cart page."""
+
+    def test_apply(self, testapp, dishes):
+        """Valid codes are applied, others explained."""
+        burger, _ = dishes
+        PromoCodeFactory(code="BIG", min_subtotal_cents=5000).save()
+        testapp.post(url_for("shop.add_to_cart"), {"item_id": burger.id, "quantity": 1})
+        res = testapp.post(url_for("shop.apply_promo"), {"code": "big"}).follow()
+        assert "needs a basket of at least $50.00" in res
+        res = testapp.post(url_for("shop.apply_promo"), {"code": "nope"}).follow()
+        assert "Unknown promo code" in res
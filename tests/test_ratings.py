@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Rating ingestion tests."""
+import pytest
+from flask import url_for
+from sqlalchemy import exc
+
+from app.shop import ratings
+from app.shop.models import Order, OrderItem, Rating, RatingAggregate
+from app.shop.ratings import rating_buffer
+
+from .factories import CourierFactory, MenuItemFactory, UserFactory
+
+
+@pytest.fixture
+def order(db, user):
+    """An order of one taco, delivered by a courier."""
+    taco = MenuItemFactory(name="Taco")
+    order = Order(
+        user=user,
+        courier=CourierFactory(name="Casey"),
+        subtotal_cents=taco.price_cents,
+        total_cents=taco.price_cents,
+        items=[OrderItem(menu_item=taco, quantity=1, unit_price_cents=0)],
+    )
+    order.save()
+    return order
+
+
+def login(testapp, user):
+    """Log ``user`` in."""
+    res = testapp.get("/")
+    form = res.forms["loginForm"]
+    form["username"] = user.username
+    form["password"] = "myprecious"
+    form.submit()
+
+
+class TestRatingBuffer:
+    """Buffering and aggregates."""
+
+    def test_buffered_until_full(self, app, user, order):
+        """Ratings are written once the buffer is full."""
+        rating_buffer.max_size = 3
+        rating_buffer.add("item", 7, 5, user.id)
+        rating_buffer.add("item", 7, 4, user.id)
+        assert Rating.query.count() == 0
+        rating_buffer.add("courier", order.courier_id, 2, user.id, order.id)
+        assert Rating.query.count() == 3
+        assert rating_buffer.pending == []
+
+    def test_failed_flush_is_kept(self, user, order, monkeypatch):
+        """A failed write leaves the ratings queued, up to a cap."""
+        write = ratings._write
+
+        def fail(batch):
+            raise exc.OperationalError("INSERT", {}, Exception("database is down"))
+
+        monkeypatch.setattr(ratings, "_write", fail)
+        rating_buffer.max_size = 2
+        rating_buffer.max_pending = 3
+        dropped = rating_buffer.dropped
+        for stars in (1, 2, 3, 4):
+            rating_buffer.add("item", 7, stars, user.id)
+        assert [rating["stars"] for rating in rating_buffer.pending] == [2, 3, 4]
+        assert rating_buffer.dropped == dropped + 1
+
+        monkeypatch.setattr(ratings, "_write", write)
+        assert rating_buffer.flush() == 3
+        assert ratings.summary("item", 7).count == 3
+
+    def test_aggregates(self, user, order):
+        """Aggregates are added to batch by batch."""
+        for stars in (5, 4, 4):
+            rating_buffer.add("item", 7, stars, user.id)
+        assert rating_buffer.flush() == 3
+        rating_buffer.add("item", 7, 1, user.id)
+        rating_buffer.add("item", 8, 3, user.id)
+        rating_buffer.flush()
+
+        summary = ratings.summary("item", 7)
+        assert summary.count == 4
+        assert summary.average == pytest.approx(14 / 4)
+        assert summary.histogram == [1, 0, 0, 2, 1]
+        assert ratings.summaries("item", [8, 9]) == {
+            8: (1, 3.0, [0, 0, 1, 0, 0]),
+            9: ratings.EMPTY_SUMMARY,
+        }
+
+    def test_invalid(self, user):
+        """Only 1 to 5 stars for known kinds are accepted."""
+        with pytest.raises(ValueError):
+            rating_buffer.add("item", 7, 6, user.id)
+        with pytest.raises(ValueError):
+            rating_buffer.add("restaurant", 7, 3, user.id)
+
+    def test_flushed_after_interval(self, app, user, testapp):
+        """Requests flush the buffer once the interval has passed."""
+        rating_buffer.interval = 0
+        rating_buffer.add("item", 7, 5, user.id)
+        testapp.get("/")
+        assert RatingAggregate.query.get(("item", 7)).count == 1
+
+    def test_rebuild(self, db, user):
+        """Drifted aggregates are found and rebuilt from the ratings."""
+        for stars in (5, 3):
+            rating_buffer.add("item", 7, stars, user.id)
+        rating_buffer.add("courier", 1, 4, user.id)
+        rating_buffer.flush()
+        assert ratings.rebuild() == []
+
+        RatingAggregate.query.get(("item", 7)).update(total=1, stars_5=0)
+        db.session.add(RatingAggregate(kind="item", subject_id=99, count=1, total=1))
+        db.session.commit()
+        assert ratings.rebuild(fix=False) == [("item", 7), ("item", 99)]
+        assert ratings.rebuild() == [("item", 7), ("item", 99)]
+        assert ratings.summary("item", 7) == (2, 4.0, [0, 0, 1, 0, 1])
+        assert RatingAggregate.query.get(("item", 99)) is None
+        assert ratings.rebuild() == []
+
+
+class TestRatingViews:
+    """Rating pages."""
+
+    def test_rate_food(self, user, order, testapp):
+        """Items of the user's orders can be rated."""
+        login(testapp, user)
+        item_id = order.items[0].menu_item_id
+        res = testapp.get(url_for("public.customerFoodRating"))
+        assert "Taco" in res
+        testapp.post(
+            url_for("shop.rate", kind="item"),
+            {"order_id": order.id, "subject_id": item_id, "stars": 4},
+        )
+        rating_buffer.flush()
+        res = testapp.get(url_for("public.customerFoodRating"))
+        assert "4.0 stars from 1 ratings" in res
+
+    def test_rate_delivery(self, user, order, testapp):
+        """The courier of the user's order can be rated."""
+        login(testapp, user)
+        res = testapp.get(url_for("public.customerDeliveryRating"))
+        assert "Casey" in res
+        testapp.post(
+            url_for("shop.rate", kind="courier"),
+            {"order_id": order.id, "subject_id": order.courier_id, "stars": 2},
+        )
+        assert rating_buffer.pending[0]["subject_id"] == order.courier_id
+
+    def test_rate_again_replaces(self, user, order, testapp):
+        """Rating the same item of an order again replaces the stars."""
+        login(testapp, user)
+        item_id = order.items[0].menu_item_id
+        for stars in (5, 1):
+            testapp.post(
+                url_for("shop.rate", kind="item"),
+                {"order_id": order.id, "subject_id": item_id, "stars": stars},
+            )
+        rating_buffer.flush()
+        testapp.post(
+            url_for("shop.rate", kind="item"),
+            {"order_id": order.id, "subject_id": item_id, "stars": 3},
+        )
+        rating_buffer.flush()
+        assert [rating.stars for rating in Rating.query] == [3]
+        assert ratings.summary("item", item_id) == (1, 3.0, [0, 0, 1, 0, 0])
+        assert ratings.rebuild(fix=False) == []
+
+    def test_rate_others_orders(self, db, order, testapp):
+        """Other users' orders cannot be rated."""
+        other = UserFactory(password="myprecious")
+        db.session.commit()
+        login(testapp, other)
+        res = testapp.post(
+            url_for("shop.rate", kind="courier"),
+            {"order_id": order.id, "subject_id": order.courier_id, "stars": 1},
+        ).follow()
+        assert "only rate your own orders" in res
+        assert rating_buffer.pending == []
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""Read replica routing tests.
+
+The primary and the replica are two separate SQLite files, so a read only sees
+a row if it went to the database the row was written to.
+"""
+import pytest
+from flask import session
+
+from app.app import create_app
+from app.database import STICKY_UNTIL_KEY, db, replica_router, use_primary
+from app.user.identity import identity_cache
+from app.user.models import Role, User
+from app.user.permissions import Permission
+from tests import settings as test_settings
+
+
+def make_app(primary, replicas, create_replicas=True, **config):
+    """Create an app with ``replicas`` and an empty schema on each database."""
+    values = {name: getattr(test_settings, name) for name in dir(test_settings)}
+    values.update(
+        SQLALCHEMY_DATABASE_URI=primary,
+        SQLALCHEMY_REPLICA_URIS=replicas,
+        METRICS_ENABLED=False,
+        **config,
+    )
+    app = create_app(type("ReplicaSettings", (), values))
+    with app.app_context():
+        db.create_all(bind=None)
+        if create_replicas:
+            for key in replica_router.binds:
+                db.Model.metadata.create_all(bind=db.get_engine(app, bind=key))
+    return app
+
+
+@pytest.fixture
+def replica_app(tmp_path):
+    """App with one reachable replica."""
+    app = make_app(
+        f"sqlite:///{tmp_path / 'primary.db'}", [f"sqlite:///{tmp_path / 'replica.db'}"]
+    )
+    with app.test_request_context():
+        yield app
+        db.session.remove()
+
+
+def replicate(app, user):
+    """Copy ``user`` to the replica, as replication eventually would."""
+    with db.get_engine(app, bind="replica0").begin() as connection:
+        connection.execute(
+            User.__table__.insert(),
+            {
+                "id": user.id,
+                "username": user.username,
+                "email": user.email,
+                "created_at": user.created_at,
+                "active": user.active,
+                "is_admin": user.is_admin,
+            },
+        )
+
+
+class TestReplicaRouter:
+    """Replica routing."""
+
+    def test_reads_go_to_replica(self, replica_app):
+        """A fresh session reads from the replica, writes went to the primary."""
+        user = User.create(username="foo", email="foo@bar.com")
+        user_id = user.id
+        session.pop(STICKY_UNTIL_KEY)
+        db.session.remove()
+        assert User.get_by_id(user_id) is None
+
+        replicate(replica_app, user)
+        db.session.remove()
+        assert User.get_by_id(user_id).username == "foo"
+        assert replica_router.stats()["replica_reads"] >= 2
+
+    def test_session_reads_its_own_writes(self, replica_app):
+        """Once a session has written, it keeps reading from the primary."""
+        user = User.create(username="foo", email="foo@bar.com")
+        db.session.expire_all()
+        assert User.query.filter_by(username="foo").one().id == user.id
+
+    def test_request_sticks_after_commit(self, replica_app):
+        """Later requests of the same visitor read from the primary for a while."""
+        user_id = User.create(username="foo", email="foo@bar.com").id
+        assert session[STICKY_UNTIL_KEY] > 0
+        db.session.remove()
+        assert User.get_by_id(user_id) is not None
+
+    def test_unit_of_work_requests_stick(self, tmp_path):
+        """A write committed by the request's unit of work reaches the cookie."""
+        app = make_app(
+            f"sqlite:///{tmp_path / 'primary.db'}",
+            [f"sqlite:///{tmp_path / 'replica.db'}"],
+            UNIT_OF_WORK_REQUESTS=True,
+        )
+
+        def write():
+            User.create(username="foo", email="foo@bar.com")
+            return ""
+
+        app.add_url_rule("/write", "write", write)
+        app.add_url_rule("/sticky", "sticky", lambda: str(STICKY_UNTIL_KEY in session))
+        client = app.test_client()
+        client.get("/write")
+        assert client.get("/sticky").data == b"True"
+        with app.app_context():
+            db.session.remove()
+
+    def test_no_stickiness_outside_requests(self, tmp_path):
+        """Without a request there is no visitor to keep on the primary."""
+        app = make_app(
+            f"sqlite:///{tmp_path / 'primary.db'}",
+            [f"sqlite:///{tmp_path / 'replica.db'}"],
+        )
+        with app.app_context():
+            user_id = User.create(username="foo", email="foo@bar.com").id
+            db.session.remove()
+            assert User.get_by_id(user_id) is None
+            db.session.remove()
+
+    def test_unhealthy_replica_falls_back(self, tmp_path):
+        """Reads go to the primary while the only replica is down."""
+        app = make_app(
+            f"sqlite:///{tmp_path / 'primary.db'}",
+            [f"sqlite:///{tmp_path / 'missing' / 'replica.db'}"],
+            create_replicas=False,
+        )
+        with app.app_context():
+            user_id = User.create(username="foo", email="foo@bar.com").id
+            db.session.remove()
+            assert User.get_by_id(user_id) is not None
+            assert replica_router.stats()["replicas_down"] == 1
+            db.session.remove()
+
+    def test_locking_reads_use_primary(self, replica_app):
+        """``SELECT ... FOR UPDATE`` is not sent to a replica."""
+        user_id = User.create(username="foo", email="foo@bar.com").id
+        session.pop(STICKY_UNTIL_KEY)
+        db.session.remove()
+        assert User.query.filter_by(id=user_id).with_for_update().first() is not None
+
+    def test_use_primary(self, replica_app):
+        """Reads inside a ``use_primary`` block skip the replica, later ones not."""
+        user_id = User.create(username="foo", email="foo@bar.com").id
+        session.pop(STICKY_UNTIL_KEY)
+        db.session.remove()
+        with use_primary():
+            assert User.get_by_id(user_id) is not None
+        db.session.expunge_all()
+        assert User.get_by_id(user_id) is None
+
+    def test_identity_reads_primary(self, replica_app):
+        """A lagging replica does not get a revoked permission cached again."""
+        user = User.create(username="foo", email="foo@bar.com")
+        role = Role.create(
+            name="analyst", user=user, permissions=int(Permission.EXPORT_DATA)
+        )
+        replicate(replica_app, user)
+        with db.get_engine(replica_app, bind="replica0").begin() as connection:
+            connection.execute(
+                Role.__table__.insert(),
+                {
+                    "id": role.id,
+                    "name": role.name,
+                    "user_id": user.id,
+                    "permissions": role.permissions,
+                },
+            )
+        user_id = user.id
+        role.delete()
+        session.pop(STICKY_UNTIL_KEY)
+        db.session.remove()
+        assert not identity_cache.get(user_id).can(Permission.EXPORT_DATA)
+        assert User.get_by_id(user_id) is not None
+
+    def test_no_replicas(self, db):
+        """Without replicas nothing is routed."""
+        assert replica_router.binds == []
+        assert User.query.count() == 0
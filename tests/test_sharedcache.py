@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Test the shared memory cache backend."""
+import multiprocessing
+import time
+
+import pytest
+from flask_caching import Cache
+
+from app.sharedcache import SharedMemoryCache
+
+
+@pytest.fixture
+def shared_cache(tmpdir):
+    """Create a small shared cache."""
+    return SharedMemoryCache(
+        path=str(tmpdir.join("cache")), slots=64, slot_size=256, stripe_size=16
+    )
+
+
+def _increment(path, times):
+    cache = SharedMemoryCache(path=path, slots=64, slot_size=256, stripe_size=16)
+    for _ in range(times):
+        cache.inc("counter")
+
+
+class TestSharedMemoryCache:
+    """Shared memory cache."""
+
+    def test_set_get_delete(self, shared_cache):
+        """Values round trip and can be deleted."""
+        assert shared_cache.get("missing") is None
+        assert shared_cache.set("key", {"a": [1, 2]}) is True
+        assert shared_cache.get("key") == {"a": [1, 2]}
+        assert shared_cache.add("key", "other") is False
+        assert shared_cache.delete("key") is True
+        assert shared_cache.has("key") is False
+
+    def test_ttl(self, shared_cache, monkeypatch):
+        """Entries expire after their timeout."""
+        now = time.time()
+        shared_cache.set("key", "value", timeout=10)
+        shared_cache.set("forever", "value", timeout=0)
+        monkeypatch.setattr(time, "time", lambda: now + 11)
+        assert shared_cache.get("key") is None
+        assert shared_cache.get("forever") == "value"
+
+    def test_value_too_large(self, shared_cache):
+        """Values larger than a slot are not cached."""
+        assert shared_cache.set("key", "x" * 1000) is False
+        assert shared_cache.get("key") is None
+
+    def test_bounded_size(self, shared_cache):
+        """Writing more keys than slots evicts old entries."""
+        for n in range(500):
+            assert shared_cache.set(f"key{n}", n) is True
+        assert shared_cache.get("key499") == 499
+        live = sum(shared_cache.has(f"key{n}") for n in range(500))
+        assert 0 < live <= 64
+
+    def test_shared_between_instances(self, shared_cache):
+        """A second instance on the same file sees the same entries."""
+        shared_cache.set("key", "value")
+        other = SharedMemoryCache(
+            path=shared_cache.path, slots=64, slot_size=256, stripe_size=16
+        )
+        assert other.get("key") == "value"
+
+    def test_atomic_inc_across_processes(self, shared_cache):
+        """Increments from several processes are not lost."""
+        workers = [
+            multiprocessing.Process(target=_increment, args=(shared_cache.path, 200))
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        assert shared_cache.get("counter") == 800
+
+    def test_flask_caching_factory(self, app, tmpdir):
+        """The backend plugs into a Flask-Caching ``Cache``."""
+        app.config.update(
+            CACHE_TYPE="app.sharedcache.shared_memory",
+            CACHE_SHARED_PATH=str(tmpdir.join("flask-cache")),
+        )
+        cache = Cache(app)
+        cache.set("key", "value")
+        assert cache.get("key") == "value"
+        assert cache.cache.inc("hits") == 1
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Order status push tests."""
+import json
+
+import pytest
+from flask import url_for
+
+from app.shop import status
+from app.shop.dispatch import complete_delivery, dispatcher
+from app.shop.models import Order, OrderEvent
+from app.shop.status import HubFull, status_hub
+
+from .factories import CourierFactory, RestaurantFactory, UserFactory
+
+
+def place(user, **kwargs):
+    """Commit an order of ``user``."""
+    return Order.create(
+        user_id=user.id, subtotal_cents=500, total_cents=500, **kwargs
+    )
+
+
+def statuses(**filters):
+    """Statuses recorded so far, oldest first."""
+    return [
+        event.status
+        for event in OrderEvent.query.filter_by(**filters).order_by(OrderEvent.id)
+    ]
+
+
+def parse(chunk):
+    """Return the event ID and data of one Server-Sent Event."""
+    fields = dict(line.split(": ", 1) for line in chunk.strip().splitlines())
+    return int(fields["id"]), json.loads(fields["data"])
+
+
+@pytest.mark.usefixtures("db")
+class TestEvents:
+    """Recording status changes."""
+
+    def test_orm_changes(self, user):
+        """Placing an order and changing its status record events."""
+        order = place(user)
+        order.update(total_cents=400)
+        complete_delivery(order)
+        assert statuses(order_id=order.id) == ["placed", "delivered"]
+
+    def test_dispatch(self, user):
+        """Orders assigned in bulk record their dispatch."""
+        restaurant = RestaurantFactory(latitude=40.75, longitude=-73.99)
+        CourierFactory(latitude=40.751, longitude=-73.991)
+        restaurant.save()
+        order = place(user, restaurant_id=restaurant.id)
+        assert dispatcher.run_once() == 1
+        assert statuses(order_id=order.id) == ["placed", "dispatched"]
+
+
+@pytest.mark.usefixtures("db")
+class TestHub:
+    """Fanning events out to clients."""
+
+    def test_poll_publishes_new_events(self, user):
+        """Each client gets its own customer's events, once."""
+        other = UserFactory()
+        other.save()
+        place(user)
+        mine = status_hub.subscribe(user.id, start=False)
+        theirs = status_hub.subscribe(other.id, start=False)
+        assert status_hub.poll() == 0
+
+        order = place(user)
+        complete_delivery(order)
+        assert status_hub.poll() == 2
+        assert status_hub.poll() == 0
+        events = mine.wait(0)
+        assert [(e.order_id, e.status) for e in events] == [
+            (order.id, "placed"),
+            (order.id, "delivered"),
+        ]
+        assert theirs.wait(0) == []
+        status_hub.unsubscribe(mine)
+        status_hub.unsubscribe(theirs)
+        assert status_hub.stats()["clients"] == 0
+
+    def test_slow_client_is_dropped(self, app, user):
+        """A client whose buffer fills up is disconnected."""
+        app.config["ORDER_EVENTS_BUFFER"] = 2
+        subscriber = status_hub.subscribe(user.id, start=False)
+        status_hub.poll()
+        for _ in range(3):
+            place(user)
+        status_hub.poll()
+        assert subscriber.dropped
+        assert subscriber.wait(0) == []
+        assert status_hub.stats()["dropped"] == 1
+        assert status_hub.stats()["clients"] == 0
+
+    def test_max_clients(self, app, user):
+        """Clients beyond the limit are refused."""
+        app.config["ORDER_EVENTS_MAX_CLIENTS"] = 1
+        subscriber = status_hub.subscribe(user.id, start=False)
+        with pytest.raises(HubFull):
+            status_hub.subscribe(user.id, start=False)
+        status_hub.unsubscribe(subscriber)
+
+    def test_stream(self, app, user):
+        """The stream sends the backlog, new events and keepalives."""
+        app.config["ORDER_EVENTS_KEEPALIVE"] = 0
+        first = place(user)
+        backlog = status.missed_events(user.id, 0)
+        subscriber = status_hub.subscribe(user.id, start=False)
+        status_hub.poll()
+        stream = status_hub.stream(subscriber, backlog)
+        assert next(stream).startswith("retry:")
+        assert parse(next(stream))[1]["order_id"] == first.id
+        assert next(stream) == ": keepalive\n\n"
+        second = place(user)
+        status_hub.poll()
+        assert parse(next(stream))[1] == {
+            "order_id": second.id,
+            "status": "placed",
+            "at": OrderEvent.query.filter_by(order_id=second.id).one().created_at
+            .isoformat(),
+        }
+        stream.close()
+        assert status_hub.stats()["clients"] == 0
+
+
+class TestEventsView:
+    """The Server-Sent Events endpoint."""
+
+    def test_reconnect_gets_missed_events(self, app, user, monkeypatch):
+        """A client reconnecting with Last-Event-ID is sent what it missed."""
+        monkeypatch.setattr(status_hub, "start", lambda: None)
+        username = user.username
+        orders = [place(user).id for _ in range(3)]
+        first_event = OrderEvent.query.filter_by(order_id=orders[0]).one().id
+
+        client = app.test_client()
+        client.post("/", data={"username": username, "password": "myprecious"})
+        response = client.get(
+            url_for("shop.order_events"), headers={"Last-Event-ID": str(first_event)}
+        )
+        assert response.mimetype == "text/event-stream"
+        chunks = iter(response.response)
+        assert next(chunks).startswith(b"retry:")
+        sent = [parse(next(chunks).decode())[1]["order_id"] for _ in range(2)]
+        assert sent == orders[1:]
+        assert status_hub.stats()["clients"] == 1
+        response.close()
+        assert status_hub.stats()["clients"] == 0
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""Test the worker warm-up."""
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+import gunicorn_config
+from app import warmup
+from app.pagecache import page_cache
+
+
+@pytest.mark.usefixtures("db")
+class TestWarmup:
+    """Warm-up."""
+
+    def test_prepare_compiles_templates(self, app):
+        """Every template is loaded."""
+        assert warmup.compile_templates(app) >= 10
+        assert list(warmup.prepare(app)) == ["templates"]
+
+    def test_bytecode_cache(self, app):
+        """Compiled templates are persisted."""
+        assert app.jinja_env.bytecode_cache is not None
+
+    def test_warm_worker(self, app):
+        """The per-process warm-up primes the page cache."""
+        report = warmup.warm_worker(app)
+        assert list(report) == ["database", "hashing", "page_cache"]
+        assert page_cache.stats()["pages"] == 2
+        assert "Warmed up" in warmup.format_report("Warmed up", report)
+
+    def test_failed_warm_up_serves_cold(self, app, monkeypatch):
+        """A warm-up error is logged instead of failing the worker boot."""
+
+        def fail(app):
+            raise RuntimeError("database is down")
+
+        monkeypatch.setattr(warmup, "warm_worker", fail)
+        worker = SimpleNamespace(
+            pid=1, wsgi=app, cfg=SimpleNamespace(preload_app=True), log=mock.Mock()
+        )
+        gunicorn_config.post_worker_init(worker)
+        worker.log.exception.assert_called_once()
+        worker.log.info.assert_not_called()